@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import logging
+
+from lib.fragments import bam_to_fragment_files, MAX_FRAG_LEN, MAX_MATE_BUFFER
+
+############################################
+############################################
+## PARSE ARGUMENTS
+############################################
+############################################
+Description = 'Fragment bed and fragment length histogram of a paired end bam in a single pass.'
+Epilog = """Example usage: python bam_to_fragments.py --bam <BAM> --bed <ID>.frags.cut.bed --frag_len <ID>.frag_len.txt"""
+
+parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+
+## REQUIRED PARAMETERS
+parser.add_argument('--bam', required=True, help="Paired end bam, coordinate or name sorted.")
+parser.add_argument('--bed', required=True, help="Output bed of fragments on one chromosome and shorter than --max_frag_len.")
+parser.add_argument('--frag_len', required=True, help="Output histogram of template lengths of mapped reads.")
+
+## OPTIONAL PARAMETERS
+parser.add_argument('--max_frag_len', type=int, default=MAX_FRAG_LEN, help="Fragments of this length or longer are left out of the bed.")
+parser.add_argument('--threads', type=int, default=1, help="Bam decompression threads.")
+parser.add_argument('--mate_buffer', type=int, default=MAX_MATE_BUFFER, help="Unpaired mates held in memory before spilling to disk.")
+parser.add_argument('--tmp_dir', help="Directory for spilled mates.")
+args = parser.parse_args()
+
+############################################
+############################################
+## MAIN FUNCTION
+############################################
+############################################
+
+logging.basicConfig(format='%(asctime)s:%(name)s:%(levelname)s - %(message)s', level=logging.INFO)
+logger = logging.getLogger('bam_to_fragments')
+
+paired, written = bam_to_fragment_files(args.bam, args.bed, args.frag_len, args.max_frag_len, args.threads, args.mate_buffer, args.tmp_dir)
+logger.info('%d fragments paired, %d shorter than %d bp written to %s', paired, written, args.max_frag_len, args.bed)
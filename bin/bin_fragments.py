@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import argparse
+
+from lib.bins import FragmentBinner, read_chrom_sizes
+
+############################################
+############################################
+## PARSE ARGUMENTS
+############################################
+############################################
+Description = 'Count fragment midpoints in fixed width genome bins at one or more bin widths.'
+Epilog = """Example usage: python bin_fragments.py --bed <ID>.frags.cut.bed --chrom_sizes <GENOME>.sizes --widths 500,5000 --prefix <ID>.frags"""
+
+parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+
+## REQUIRED PARAMETERS
+parser.add_argument('--bed', required=True, help="Fragment bed with chrom, start and end columns.")
+parser.add_argument('--prefix', required=True, help="Output prefix, bins are written to <PREFIX>.bin<WIDTH>.awk.bed.")
+
+## OPTIONAL PARAMETERS
+parser.add_argument('--chrom_sizes', help="Chromosome sizes file used to preallocate the count arrays.")
+parser.add_argument('--widths', default="500", help="Comma separated bin widths in bp.")
+args = parser.parse_args()
+
+############################################
+############################################
+## MAIN FUNCTION
+############################################
+############################################
+
+chrom_sizes = read_chrom_sizes(args.chrom_sizes) if args.chrom_sizes else None
+binner = FragmentBinner([int(width) for width in args.widths.split(",")], chrom_sizes)
+binner.add_bed(args.bed)
+
+# The source column holds the fragment file name, as the awk FILENAME did
+source = os.path.basename(args.bed)
+for width in binner.widths:
+    binner.write("%s.bin%d.awk.bed" % (args.prefix, width), width, source)
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import glob
+import argparse
+
+from lib.intervals import merge_replicate_peaks
+
+############################################
+############################################
+## PARSE ARGUMENTS
+############################################
+############################################
+Description = 'Merge replicate peak beds into consensus peaks laid out as bedtools merge -c 2,3,4,5,6,7,7 -o collapse,collapse,collapse,collapse,collapse,collapse,count_distinct.'
+Epilog = """Example usage: python consensus_merge.py --peaks "*.peaks.bed.stringent.bed" --prefix <GROUP> --min_replicates 2"""
+
+parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+
+## REQUIRED PARAMETERS
+parser.add_argument('--peaks', required=True, nargs='+', help="Replicate SEACR peak beds or glob patterns, in any order.")
+parser.add_argument('--prefix', required=True, help="Output prefix.")
+
+## OPTIONAL PARAMETERS
+parser.add_argument('--min_replicates', type=int, default=1, help="Replicates a peak must be found in to be kept in the filtered set.")
+args = parser.parse_args()
+
+############################################
+############################################
+## MAIN FUNCTION
+############################################
+############################################
+
+# Replicates are named by their bed file
+paths = sorted(set(path for pattern in args.peaks for path in glob.glob(pattern)), key=os.path.basename)
+names = [os.path.basename(path) for path in paths]
+
+# Columns: chrom, start, end, then the collapsed starts, ends, total signals, max signals, max signal regions
+# and replicate names of the merged peaks, and the number of distinct replicates
+with open(args.prefix + ".consensus.peaks.bed", "w") as fout, open(args.prefix + ".consensus.peaks.filtered.awk.bed", "w") as fout_filtered:
+    for chrom, start, end, rows in merge_replicate_peaks(paths):
+        replicates = [names[row[3]] for row in rows]
+        collapsed = [",".join(row[2][k] for row in rows) for k in range(5)]
+        count = len(set(replicates))
+        line = "\t".join([chrom, str(start), str(end)] + collapsed + [",".join(replicates), str(count)]) + "\n"
+        fout.write(line)
+        if count >= args.min_replicates:
+            fout_filtered.write(line)
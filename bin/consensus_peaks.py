@@ -2,12 +2,16 @@
 
 import os
 import glob
-import re
 import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import argparse
 import upsetplot
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.intervals import MAX_REPLICATES
 
 ############################################
 ############################################
@@ -22,53 +26,69 @@ parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
 ## REQUIRED PARAMETERS
 parser.add_argument('--peaks', help="Merged peaks interval file with replicate counts column.")
 parser.add_argument('--outpath', help="Full path to output directory.")
+
+## OPTIONAL PARAMETERS
+parser.add_argument('--threads', type=int, default=1, help="Number of groups plotted in parallel.")
+parser.add_argument('--max_intersections', type=int, default=40, help="Largest replicate intersections drawn per group.")
 args = parser.parse_args()
 
 ############################################
 ############################################
-## MAIN FUNCTION
+## FUNCTIONS
 ############################################
 ############################################
 
-# create list of data frames, one for each group consensus peaks file
-peak_file_list = glob.glob(args.peaks)
-peak_df_list = list()
-for i in list(range(len(peak_file_list))):
-    peaks_i = pd.read_csv(peak_file_list[i], sep='\t', header=None, usecols=[0,1,2,8,9], names=['chrom','start','end','sample_reps','count'])
-    peaks_i['sample_reps'] = peaks_i['sample_reps'].replace(".peaks.bed.stringent.bed", "", regex=True)
-    peak_df_list.append(peaks_i)
-    reps2 = peaks_i[peaks_i["count"]>1]
+def replicate_sets(peaks):
+    # Encode the replicates of each merged peak as a bitmask over the sorted replicate names
+    reps = peaks['sample_reps'].str.split(',').explode()
+    names, codes = np.unique(reps.to_numpy(dtype=str), return_inverse=True)
+    if len(names) > MAX_REPLICATES:
+        raise ValueError("At most %d replicates per group are supported, found %d" % (MAX_REPLICATES, len(names)))
+
+    # Exploded rows keep the peak order, so each peak is a contiguous run
+    bits = np.left_shift(np.int64(1), codes.astype(np.int64))
+    starts = np.flatnonzero(np.r_[True, reps.index.to_numpy()[1:] != reps.index.to_numpy()[:-1]])
+    masks = np.bitwise_or.reduceat(bits, starts)
+    return names, masks
+
+def summarise_peaks(peak_file):
+    # Peak counts of every replicate set of a group consensus peaks file
+    peaks = pd.read_csv(peak_file, sep='\t', header=None, usecols=[8,9], names=['sample_reps','count'], dtype={'sample_reps': str, 'count': np.int64})
+    peaks['sample_reps'] = peaks['sample_reps'].str.replace(".peaks.bed.stringent.bed", "", regex=False)
+    names, masks = replicate_sets(peaks)
+    summary = pd.DataFrame({'mask': masks, 'count': peaks['count'].to_numpy()}).groupby('mask', as_index=False)['count'].sum()
+    return names, summary
+
+def plot_group(peak_file, outpath, max_intersections):
+    # Upset plot of the largest replicate intersections of one group
+    group_name = os.path.basename(peak_file).split(".")[0]
+    if os.path.getsize(peak_file) == 0:
+        return group_name, 0, 0
 
-# add sorted column to each dataframe, and make new condensed dataframe list
-summary_peak_df_list = list()
-for i in list(range(len(peak_df_list))):
-    peaks_i = peak_df_list[i]
-    peaks_i['sorted_samples'] = ''
-    rows_now = peaks_i.shape[0]
-    for j in list(range(rows_now)):
-        sample_list = peaks_i.at[j,'sample_reps']
-        sample_array = np.unique(sample_list.split(','))
-        sample_sorted = sorted(sample_array)
-        sample_str = ",".join(sample_sorted)
-        peaks_i.at[j,'sorted_samples'] = sample_str
-    summary_peaks_i = peaks_i[['sorted_samples', 'count']].groupby(['sorted_samples'], as_index = False).sum()
-    summary_peak_df_list.append(summary_peaks_i)
+    names, summary = summarise_peaks(peak_file)
+    total = summary.shape[0]
+    summary = summary.nlargest(max_intersections, 'count', keep='first')
+    memberships = [[names[k] for k in range(len(names)) if mask >> k & 1] for mask in summary['mask'].tolist()]
 
-# construct data in appropriate format for upsetplot, and plot
-for i in list(range(len(summary_peak_df_list))):
-    df_i = summary_peak_df_list[i]
-    # Get group name
-    basename = os.path.basename(peak_file_list[i])
-    group_name = basename.rsplit(".", -1)[0]
-    file_name = group_name + ".consensus_peaks.pdf"
-    categories = df_i.shape[0]
-    cat_list = []
-    for j in list(range(categories)):
-        summary_sample = df_i.at[j,'sorted_samples'].split(',')
-        cat_list.append(summary_sample)
+    fig = plt.figure()
+    peak_counts = upsetplot.from_memberships(memberships, data=summary['count'].to_numpy())
+    upsetplot.plot(peak_counts, fig=fig)
+    fig.savefig(os.path.join(outpath, group_name + ".consensus_peaks.pdf"))
+    plt.close(fig)
+    return group_name, total, summary.shape[0]
+
+############################################
+############################################
+## MAIN FUNCTION
+############################################
+############################################
 
-    # Plot
-    peak_counts = upsetplot.from_memberships(cat_list, data = df_i['count'])
-    upsetplot.plot(peak_counts)
-    plt.show()
-    plt.savefig(os.path.join(args.outpath, file_name))
+# one upset plot for each group consensus peaks file
+peak_file_list = sorted(glob.glob(args.peaks))
+n_files = len(peak_file_list)
+workers = max(1, min(args.threads, n_files))
+with ProcessPoolExecutor(max_workers=workers) as pool:
+    results = pool.map(plot_group, peak_file_list, [args.outpath] * n_files, [args.max_intersections] * n_files)
+    for group_name, total, drawn in results:
+        if drawn < total:
+            print("%s: drawing the %d largest of %d replicate intersections" % (group_name, drawn, total))
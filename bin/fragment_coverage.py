@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+
+from lib.coverage import bam_coverage
+from lib.fragments import MAX_MATE_BUFFER
+
+############################################
+############################################
+## PARSE ARGUMENTS
+############################################
+############################################
+Description = 'Scaled coverage bedGraph of a paired end bam, piled up one chromosome at a time.'
+Epilog = """Example usage: python fragment_coverage.py --bam <BAM> --scale <SCALE_FACTOR> --output <ID>.bedGraph"""
+
+parser = argparse.ArgumentParser(description=Description, epilog=Epilog)
+
+## REQUIRED PARAMETERS
+parser.add_argument('--bam', required=True, help="Coordinate sorted and indexed paired end bam.")
+parser.add_argument('--output', required=True, help="Output bedGraph, sorted as bedtools sort.")
+
+## OPTIONAL PARAMETERS
+parser.add_argument('--scale', type=float, default=1.0, help="Spike-in scale factor applied to the depth.")
+parser.add_argument('--pileup', choices=['fragments', 'reads'], default='fragments', help="Pile up whole fragments, or the aligned span of each read as bedtools genomecov -ibam does.")
+parser.add_argument('--threads', type=int, default=1, help="Chromosomes processed in parallel.")
+parser.add_argument('--mate_buffer', type=int, default=MAX_MATE_BUFFER, help="Unpaired mates held in memory before spilling to disk.")
+parser.add_argument('--tmp_dir', help="Directory for spilled mates.")
+parser.add_argument('--cache_dir', help="Fragment cache read instead of the bam, filled on a miss.")
+args = parser.parse_args()
+
+############################################
+############################################
+## MAIN FUNCTION
+############################################
+############################################
+
+bam_coverage(args.bam, args.output, args.scale, args.pileup, args.threads, args.mate_buffer, args.tmp_dir, args.cache_dir)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+
+from lib.bins import PearsonAccumulator, BLOCK_ROWS
+
+# Width of the *.bin500 input bins
+INPUT_BIN_WIDTH = 500
+
+# Bin sizes kept in the store by default, all multiples of the 500 bp input bins
+DEFAULT_RESOLUTIONS = [500, 5000, 50000]
+
+INDEX_FILE = "index.json"
+
+#*
+#========================================================================================
+# RESOLUTIONS
+#========================================================================================
+#*/
+
+def rebin(bins, entry_row, entry_col, entry_count, width):
+    # Sum the counts of a sparse chromosome chunk into bins of the given width.
+    # Bins are labelled by their centre, as the awk binning step does.
+    coarse_bins = (bins // width) * width + width // 2
+    union, row_map = np.unique(coarse_bins, return_inverse=True)
+    rows = row_map[entry_row]
+
+    # Combine entries falling in the same coarse row and sample, sorted by row
+    n_cols = int(entry_col.max()) + 1 if len(entry_col) else 1
+    keys, inverse = np.unique(rows.astype(np.int64) * n_cols + entry_col, return_inverse=True)
+    counts = np.bincount(inverse, weights=entry_count, minlength=len(keys)).astype(np.int64)
+    return union, keys // n_cols, (keys % n_cols).astype(np.int32), counts
+
+def matrix_pearson(matrix, resolution, transform=np.log2, block_rows=BLOCK_ROWS):
+    # Pearson correlation of an in-memory BinMatrix at a resolution, rebinned one chromosome at a time
+    if resolution <= 0 or resolution % INPUT_BIN_WIDTH:
+        raise ValueError("Resolution %d is not a multiple of the %d bp input bins" % (resolution, INPUT_BIN_WIDTH))
+    if resolution == INPUT_BIN_WIDTH:
+        return matrix.pearson(transform, block_rows)
+
+    acc = PearsonAccumulator(len(matrix.samples), transform, block_rows)
+    for _, bins, entry_row, entry_col, entry_count in matrix.chunks():
+        bins, rows, cols, counts = rebin(bins, entry_row, entry_col, entry_count, resolution)
+        acc.add(len(bins), rows, cols, counts)
+    return acc.result(matrix.samples)
+
+#*
+#========================================================================================
+# STORE
+#========================================================================================
+#*/
+
+class BinStore:
+    """
+    On-disk store of binned fragment counts for all samples at several
+    resolutions. Each resolution holds one compressed chunk per chromosome in
+    sparse coordinate form, so any resolution can be read back lazily one
+    chromosome at a time without parsing bed text.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        with open(os.path.join(self.path, INDEX_FILE)) as fin:
+            index = json.load(fin)
+        self.samples = index["samples"]
+        self.chroms = index["chroms"]
+        self.resolutions = index["resolutions"]
+        self.source = index.get("source")
+
+    @staticmethod
+    def source_id(paths):
+        # Identity of the input bin files, used to decide whether a store is current
+        return sorted([os.path.basename(path), os.path.getsize(path), os.stat(path).st_mtime_ns] for path in paths)
+
+    @classmethod
+    def open_current(cls, path, paths, resolutions=()):
+        # The store at path if it was built from exactly these bin files and holds the resolutions, else None
+        if not os.path.isfile(os.path.join(path, INDEX_FILE)):
+            return None
+        store = cls(path)
+        if store.source != cls.source_id(paths) or not set(resolutions) <= set(store.resolutions):
+            return None
+        return store
+
+    @classmethod
+    def write(cls, path, matrix, resolutions=DEFAULT_RESOLUTIONS, paths=None):
+        # Build every resolution from a BinMatrix and swap the finished store into place
+        parent = os.path.dirname(os.path.abspath(path))
+        tmp_path = tempfile.mkdtemp(prefix=".tmp_bin_store_", dir=parent)
+        resolutions = sorted(set(int(res) for res in resolutions))
+        for res in resolutions:
+            os.makedirs(os.path.join(tmp_path, str(res)))
+
+        for c, (chrom, bins, entry_row, entry_col, entry_count) in enumerate(matrix.chunks()):
+            for res in resolutions:
+                chunk = rebin(bins, entry_row, entry_col, entry_count, res)
+                np.savez_compressed(os.path.join(tmp_path, str(res), "%d.npz" % c),
+                                    bins=chunk[0], rows=chunk[1], cols=chunk[2], counts=chunk[3])
+
+        index = {
+            "samples": matrix.samples,
+            "chroms": matrix.chroms,
+            "resolutions": resolutions,
+            "source": None if paths is None else cls.source_id(paths)
+        }
+        with open(os.path.join(tmp_path, INDEX_FILE), "w") as fout:
+            json.dump(index, fout)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        return cls(path)
+
+    def chunks(self, resolution, chroms=None):
+        # Lazily yield (chrom, bins, entry rows, entry cols, counts) at a resolution, one chromosome at a time
+        if resolution not in self.resolutions:
+            raise ValueError("Resolution %d is not in the bin store, available: %s" % (resolution, self.resolutions))
+
+        for c, chrom in enumerate(self.chroms):
+            if chroms is not None and chrom not in chroms:
+                continue
+            with np.load(os.path.join(self.path, str(resolution), "%d.npz" % c)) as chunk:
+                yield chrom, chunk["bins"], chunk["rows"], chunk["cols"], chunk["counts"]
+
+    def pearson(self, resolution, transform=np.log2, block_rows=BLOCK_ROWS):
+        # Pairwise complete Pearson correlation between samples at a resolution, read chunk by chunk
+        acc = PearsonAccumulator(len(self.samples), transform, block_rows)
+        for _, bins, rows, cols, counts in self.chunks(resolution):
+            acc.add(len(bins), rows, cols, counts)
+        return acc.result(self.samples)
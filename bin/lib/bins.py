@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import re
+import heapq
+import numpy as np
+import pandas as pd
+
+# Lines read from each bin file at a time
+READ_CHUNK = 1 << 20
+
+# Matrix rows densified at a time when accumulating correlations
+BLOCK_ROWS = 1 << 16
+
+#*
+#========================================================================================
+# SORTED BIN FILES
+#========================================================================================
+#*/
+
+def natural_key(chrom):
+    # Approximates the order of sort -V, digit runs compare as numbers
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", chrom)]
+
+def bin_file_sample(path):
+    # Sample name from the source file column of the first line
+    with open(path) as fin:
+        line = fin.readline().rstrip("\n")
+    return line.split("\t")[3].split(".")[0] if line else None
+
+def read_bin_blocks(path, chunksize=READ_CHUNK):
+    # Yield (chrom, bins, counts) for each chromosome of a sorted bin file, reading it in chunks
+    pending = None
+    reader = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1, 2], names=["chrom", "bin", "count"],
+                         dtype={"chrom": str, "bin": np.int64, "count": np.int64}, chunksize=chunksize)
+    for chunk in reader:
+        chroms = chunk["chrom"].to_numpy()
+        bins = chunk["bin"].to_numpy()
+        counts = chunk["count"].to_numpy()
+        edges = np.concatenate([[0], np.flatnonzero(chroms[1:] != chroms[:-1]) + 1, [len(chroms)]])
+        for start, end in zip(edges[:-1], edges[1:]):
+            if pending is not None and pending[0] == chroms[start]:
+                pending[1].append(bins[start:end])
+                pending[2].append(counts[start:end])
+                continue
+            if pending is not None:
+                yield pending[0], np.concatenate(pending[1]), np.concatenate(pending[2])
+            pending = (chroms[start], [bins[start:end]], [counts[start:end]])
+
+    if pending is not None:
+        yield pending[0], np.concatenate(pending[1]), np.concatenate(pending[2])
+
+def merge_bin_files(paths, chunksize=READ_CHUNK):
+    # k-way merge of sorted bin files one chromosome at a time. Yields the chromosome, the union of
+    # its bins and for each file holding it the file index, row positions in the union and counts.
+    return merge_bin_blocks([read_bin_blocks(path, chunksize) for path in paths])
+
+def merge_bin_blocks(readers):
+    # k-way merge of per sample (chrom, bins, counts) blocks, as merge_bin_files
+    readers = [iter(reader) for reader in readers]
+    heap = list()
+    for k, reader in enumerate(readers):
+        head = next(reader, None)
+        if head is not None:
+            heapq.heappush(heap, (natural_key(head[0]), k, head))
+
+    seen = set()
+    while heap:
+        key = heap[0][0]
+        members = list()
+        while heap and heap[0][0] == key:
+            members.append(heapq.heappop(heap)[1:])
+
+        chrom = members[0][1][0]
+        if chrom in seen:
+            raise ValueError("Bin files are not sorted consistently by chromosome (sort -k1,1V -k2,2n): " + chrom)
+        seen.add(chrom)
+
+        union = np.unique(np.concatenate([head[1] for _, head in members]))
+        yield chrom, union, [(k, np.searchsorted(union, head[1]), head[2]) for k, head in members]
+
+        for k, _ in members:
+            head = next(readers[k], None)
+            if head is not None:
+                heapq.heappush(heap, (natural_key(head[0]), k, head))
+
+#*
+#========================================================================================
+# SPARSE BIN MATRIX
+#========================================================================================
+#*/
+
+class BinMatrix:
+    """
+    Sparse chrom/bin by sample count matrix. Rows are the union of bins over
+    all samples in file order, entries are stored sorted by row as coordinate
+    arrays, so bins missing from a sample take no space.
+    """
+
+    def __init__(self, samples, chroms, row_chrom, row_bin, entry_row, entry_col, entry_count):
+        self.samples = samples
+        self.chroms = chroms
+        self.row_chrom = row_chrom
+        self.row_bin = row_bin
+        self.entry_row = entry_row
+        self.entry_col = entry_col
+        self.entry_count = entry_count
+
+    @classmethod
+    def from_files(cls, paths, chunksize=READ_CHUNK):
+        return cls.from_blocks([bin_file_sample(path) for path in paths], [read_bin_blocks(path, chunksize) for path in paths])
+
+    @classmethod
+    def from_blocks(cls, samples, readers):
+        # Matrix of per sample (chrom, bins, counts) blocks, each sorted as the bin files are
+        chroms = list()
+        row_chrom, row_bin = list(), list()
+        entry_row, entry_col, entry_count = list(), list(), list()
+        n_rows = 0
+
+        for chrom, union, members in merge_bin_blocks(readers):
+            rows = np.concatenate([idx for _, idx, _ in members]) + n_rows
+            cols = np.concatenate([np.full(len(idx), k, dtype=np.int32) for k, idx, _ in members])
+            counts = np.concatenate([counts for _, _, counts in members])
+            order = np.argsort(rows, kind="stable")
+
+            row_chrom.append(np.full(len(union), len(chroms), dtype=np.int32))
+            row_bin.append(union)
+            entry_row.append(rows[order])
+            entry_col.append(cols[order])
+            entry_count.append(counts[order])
+            chroms.append(chrom)
+            n_rows += len(union)
+
+        def join(parts, dtype):
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        return cls(samples, chroms, join(row_chrom, np.int32), join(row_bin, np.int64),
+                   join(entry_row, np.int64), join(entry_col, np.int32), join(entry_count, np.int64))
+
+    def __len__(self):
+        return len(self.row_bin)
+
+    def to_dataframe(self):
+        # Dense outer join form with missing bins as NaN, only for small matrices
+        values = np.full((len(self), len(self.samples)), np.nan)
+        values[self.entry_row, self.entry_col] = self.entry_count
+        df = pd.DataFrame(values, columns=self.samples)
+        df.insert(0, "bin", self.row_bin)
+        df.insert(0, "chrom", np.array(self.chroms, dtype=object)[self.row_chrom])
+        return df
+
+    def chunks(self):
+        # (chrom, bins, entry rows, entry cols, counts) per chromosome with rows local to the chromosome
+        edges = np.searchsorted(self.row_chrom, np.arange(len(self.chroms) + 1))
+        entry_edges = np.searchsorted(self.entry_row, edges)
+        for c, chrom in enumerate(self.chroms):
+            lo, hi = entry_edges[c], entry_edges[c + 1]
+            yield chrom, self.row_bin[edges[c]:edges[c + 1]], self.entry_row[lo:hi] - edges[c], self.entry_col[lo:hi], self.entry_count[lo:hi]
+
+    def pearson(self, transform=np.log2, block_rows=BLOCK_ROWS):
+        # Pairwise complete Pearson correlation between samples, as DataFrame.corr gives on the outer join
+        acc = PearsonAccumulator(len(self.samples), transform, block_rows)
+        acc.add(len(self), self.entry_row, self.entry_col, self.entry_count)
+        return acc.result(self.samples)
+
+#*
+#========================================================================================
+# CORRELATION
+#========================================================================================
+#*/
+
+class PearsonAccumulator:
+    """
+    Running sums for pairwise complete Pearson correlation between the columns
+    of sparse count chunks. Only the k x k sums are kept between chunks.
+    """
+
+    def __init__(self, k, transform=np.log2, block_rows=BLOCK_ROWS):
+        self.k = k
+        self.transform = transform
+        self.block_rows = block_rows
+        self.n = np.zeros((k, k))
+        self.sum_x = np.zeros((k, k))
+        self.sum_xx = np.zeros((k, k))
+        self.sum_xy = np.zeros((k, k))
+
+    def add(self, n_rows, entry_row, entry_col, entry_count):
+        # Sums over the rows both samples hold are accumulated block by block as k x k products.
+        # Entries must be sorted by row.
+        values = self.transform(np.asarray(entry_count, dtype=np.float64))
+        for row_start in range(0, n_rows, self.block_rows):
+            lo, hi = np.searchsorted(entry_row, [row_start, row_start + self.block_rows])
+            block_len = min(self.block_rows, n_rows - row_start)
+            present = np.zeros((block_len, self.k))
+            x = np.zeros((block_len, self.k))
+            present[entry_row[lo:hi] - row_start, entry_col[lo:hi]] = 1
+            x[entry_row[lo:hi] - row_start, entry_col[lo:hi]] = values[lo:hi]
+
+            self.n += present.T @ present
+            self.sum_x += x.T @ present
+            self.sum_xx += (x * x).T @ present
+            self.sum_xy += x.T @ x
+
+    def result(self, samples):
+        # sum_x[i, j] is the sum of sample i over rows shared with sample j
+        n = self.n
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cov = self.sum_xy - self.sum_x * self.sum_x.T / n
+            var = self.sum_xx - self.sum_x * self.sum_x / n
+            corr = cov / np.sqrt(var * var.T)
+        corr[n < 2] = np.nan
+        return pd.DataFrame(corr, index=pd.Index(samples, name="sample"), columns=samples)
+
+#*
+#========================================================================================
+# FRAGMENT BINNING
+#========================================================================================
+#*/
+
+def read_chrom_sizes(path):
+    # Chromosome lengths from a two column sizes file such as samtools faidx | cut -f 1,2 writes
+    sizes = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1], names=["chrom", "size"], dtype={"chrom": str, "size": np.int64})
+    return dict(zip(sizes["chrom"], sizes["size"]))
+
+class FragmentBinner:
+    """
+    Fragment midpoint counts in fixed width bins for several widths at once.
+    Each chromosome gets one dense count array per width, sized from the
+    chromosome lengths when known and grown otherwise, filled chunk by chunk
+    with np.bincount. Bins follow the awk binning step: a fragment falls in
+    bin int((start + end) / (2 * width)) labelled by the bin centre.
+    """
+
+    def __init__(self, widths, chrom_sizes=None):
+        self.widths = sorted(set(int(width) for width in widths))
+        self.chrom_sizes = chrom_sizes or dict()
+        self.counts = {width: dict() for width in self.widths}
+
+    def _array(self, width, chrom, n_bins):
+        counts = self.counts[width].get(chrom)
+        if counts is None:
+            counts = np.zeros(max(self.chrom_sizes.get(chrom, 0) // width + 1, n_bins), dtype=np.int64)
+            self.counts[width][chrom] = counts
+        elif len(counts) < n_bins:
+            counts = np.concatenate([counts, np.zeros(n_bins - len(counts), dtype=np.int64)])
+            self.counts[width][chrom] = counts
+        return counts
+
+    def add(self, chroms, starts, ends):
+        # Count a chunk of fragments, chroms as an array of names
+        codes, names = pd.factorize(chroms)
+        twice_mid = starts.astype(np.int64) + ends.astype(np.int64)
+        order = np.argsort(codes, kind="stable")
+        edges = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        for code, chrom in enumerate(names):
+            mids = twice_mid[order[edges[code]:edges[code + 1]]]
+            for width in self.widths:
+                bins = np.bincount(mids // (2 * width))
+                counts = self._array(width, chrom, len(bins))
+                counts[:len(bins)] += bins
+
+    def add_bed(self, path, chunksize=READ_CHUNK):
+        # Stream a chrom, start, end fragment bed through the binner
+        reader = pd.read_csv(path, sep="\t", header=None, usecols=[0, 1, 2], names=["chrom", "start", "end"],
+                             dtype={"chrom": str, "start": np.int64, "end": np.int64}, chunksize=chunksize)
+        for chunk in reader:
+            self.add(chunk["chrom"].to_numpy(), chunk["start"].to_numpy(), chunk["end"].to_numpy())
+
+    def write(self, path, width, source):
+        # Non-empty bins as chrom, bin centre, count, source file, sorted as sort -k1,1V -k2,2n
+        half = width // 2 if width % 2 == 0 else width / 2
+        with open(path, "w") as fout:
+            for chrom in sorted(self.counts[width], key=natural_key):
+                counts = self.counts[width][chrom]
+                bins = np.flatnonzero(counts)
+                centres = bins * width + half
+                fout.writelines("%s\t%s\t%d\t%s\n" % (chrom, centre, count, source) for centre, count in zip(centres.tolist(), counts[bins].tolist()))
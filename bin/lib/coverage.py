@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pysam
+
+from lib.fragments import pe_bam_to_fragments, MAX_MATE_BUFFER
+from lib.fragment_cache import FragmentCache
+
+# Rows formatted and written at a time
+WRITE_ROWS = 1 << 18
+
+#*
+#========================================================================================
+# PILEUP
+#========================================================================================
+#*/
+
+def pileup(starts, ends):
+    # Depth of half-open intervals as run length encoded (run starts, run ends, depths) of covered runs.
+    # A sparse difference array: +1 at every start and -1 at every end, summed per position and accumulated.
+    positions, inverse = np.unique(np.concatenate([starts, ends]).astype(np.int64), return_inverse=True)
+    deltas = np.bincount(inverse, weights=np.repeat([1, -1], [len(starts), len(ends)]), minlength=len(positions)).astype(np.int64)
+
+    # Positions where starts and ends cancel out do not change the depth
+    changes = deltas != 0
+    positions = positions[changes]
+    depths = np.cumsum(deltas[changes])
+
+    covered = depths[:-1] > 0
+    return positions[:-1][covered], positions[1:][covered], depths[:-1][covered]
+
+def write_bedgraph(fout, chrom, run_starts, run_ends, depths, scale=1.0):
+    # Scaled depths formatted as bedtools genomecov -bg prints them, six significant digits
+    values = depths * scale
+    for lo in range(0, len(run_starts), WRITE_ROWS):
+        hi = lo + WRITE_ROWS
+        fout.writelines("%s\t%d\t%d\t%g\n" % (chrom, start, end, value) for start, end, value in zip(run_starts[lo:hi].tolist(), run_ends[lo:hi].tolist(), values[lo:hi].tolist()))
+
+#*
+#========================================================================================
+# PER CHROMOSOME INTERVALS
+#========================================================================================
+#*/
+
+def contig_reads(bam_path, contig):
+    # Reference span of every mapped read on a contig, as bedtools genomecov -ibam counts them
+    bamfile = pysam.AlignmentFile(bam_path, "rb")
+    starts = list()
+    ends = list()
+    for read in bamfile.fetch(contig):
+        if read.is_unmapped:
+            continue
+        starts.append(read.reference_start)
+        ends.append(read.reference_end)
+    bamfile.close()
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def contig_fragments(bam_path, contig, length, max_buffer=MAX_MATE_BUFFER, spill_dir=None):
+    # Fragments of one contig, duplicates included (and flagged) as bedtools genomecov counts them. Ends are the last base.
+    fragments = pe_bam_to_fragments(bam_path, max_buffer=max_buffer, spill_dir=spill_dir, regions=[(contig, 0, length)], keep_duplicates=True)
+    return fragments.start, fragments.end, fragments.duplicate
+
+def contig_coverage(bam_path, contig, length, mode="fragments", max_buffer=MAX_MATE_BUFFER, spill_dir=None, keep_fragments=False):
+    # Run length encoded pileup of one contig, the unit of work of a coverage worker.
+    # The fragments are sent back as well when they are to be cached.
+    if mode == "reads":
+        return pileup(*contig_reads(bam_path, contig)), None
+
+    starts, ends, duplicate = contig_fragments(bam_path, contig, length, max_buffer, spill_dir)
+    return pileup(starts.astype(np.int64), ends.astype(np.int64) + 1), ((starts, ends, duplicate) if keep_fragments else None)
+
+#*
+#========================================================================================
+# BEDGRAPH
+#========================================================================================
+#*/
+
+def write_fragment_coverage(out_path, contigs, fragments, scale=1.0):
+    # bedGraph of a whole fragment set, one contig at a time
+    slices = {name: (starts, ends) for name, starts, ends in fragments.contig_slices()}
+    with open(out_path, "w") as fout:
+        for contig, _ in contigs:
+            if contig in slices:
+                starts, ends = slices[contig]
+                write_bedgraph(fout, contig, *pileup(starts.astype(np.int64), ends.astype(np.int64) + 1), scale=scale)
+
+def bam_coverage(bam_path, out_path, scale=1.0, mode="fragments", threads=1, max_buffer=MAX_MATE_BUFFER, spill_dir=None, cache_dir=None):
+    # Scaled bedGraph of a sample, one chromosome per task. Contigs are written in the order of
+    # bedtools sort (chrom as text, then start) as their results arrive, so the output needs no sort.
+    bamfile = pysam.AlignmentFile(bam_path, "rb")
+    contigs = sorted(zip(bamfile.references, bamfile.lengths))
+    indexed = bamfile.has_index()
+    bamfile.close()
+
+    # The cache entry of a bam is shared with the report, which drops the flagged duplicates on read
+    cache = None
+    if cache_dir is not None and mode == "fragments":
+        cache = FragmentCache(cache_dir)
+        key = cache.key(bam_path)
+        fragments = cache.get(key, keep_duplicates=True)
+        if fragments is not None:
+            write_fragment_coverage(out_path, contigs, fragments, scale)
+            return
+
+    if not indexed:
+        # Without an index the bam is read once and piled up per contig
+        if mode == "reads":
+            raise ValueError("Read coverage needs an indexed bam: " + bam_path)
+        fragments = pe_bam_to_fragments(bam_path, max_buffer=max_buffer, spill_dir=spill_dir, threads=threads, keep_duplicates=True)
+        write_fragment_coverage(out_path, contigs, fragments, scale)
+        if cache is not None:
+            cache.put(key, fragments)
+        return
+
+    # At most one result per worker is held, each contig is written and dropped before the next is submitted
+    writer = cache.writer(key) if cache is not None else None
+    workers = max(1, min(threads, len(contigs)))
+    tasks = iter(contigs)
+    pending = deque()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool, open(out_path, "w") as fout:
+            def submit():
+                task = next(tasks, None)
+                if task is not None:
+                    pending.append((task[0], pool.submit(contig_coverage, bam_path, task[0], task[1], mode, max_buffer, spill_dir, writer is not None)))
+
+            for _ in range(workers):
+                submit()
+            while pending:
+                contig, future = pending.popleft()
+                runs, fragments = future.result()
+                submit()
+                write_bedgraph(fout, contig, *runs, scale=scale)
+                if writer is not None:
+                    writer.add(contig, *fragments)
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+
+    if writer is not None:
+        writer.commit()
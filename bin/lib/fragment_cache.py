@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+
+from lib.fragments import ContigTable, FragmentSet
+
+# Leading bytes of a bam (the bgzf compressed header) hashed into the cache key
+HEADER_BYTES = 1 << 16
+
+# Default upper bound on the total size of the cache
+DEFAULT_MAX_BYTES = 50 * (1 << 30)
+
+COLUMNS = ['chrom', 'start', 'end', 'duplicate']
+
+DTYPES = {'chrom': np.int32, 'start': np.int32, 'end': np.int32, 'duplicate': np.bool_}
+
+class FragmentCache:
+    """
+    Content addressed on-disk store of extracted fragment sets. Entries are keyed
+    by bam path, size, mtime and a checksum of the bam header block, and hold one
+    .npy file per column so they can be memory mapped back without reading the
+    bam. Entries keep duplicate pairs with a flag column, so one entry serves
+    both coverage (duplicates kept) and the report (duplicates dropped). Least
+    recently used entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, bam_path):
+        real_path = os.path.realpath(bam_path)
+        stat = os.stat(real_path)
+        with open(real_path, "rb") as fin:
+            header_md5 = hashlib.md5(fin.read(HEADER_BYTES)).hexdigest()
+        fields = [real_path, str(stat.st_size), str(stat.st_mtime_ns), header_md5]
+        return hashlib.sha1("\t".join(fields).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, keep_duplicates=False):
+        # Duplicate pairs are dropped on read unless kept
+        path = self.entry_path(key)
+        if not os.path.isdir(path):
+            return None
+
+        try:
+            with open(os.path.join(path, "contigs.txt")) as fin:
+                contigs = ContigTable(fin.read().splitlines())
+            arrays = [np.load(os.path.join(path, col + ".npy"), mmap_mode="r") for col in COLUMNS]
+        except (OSError, ValueError):
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        fragments = FragmentSet(arrays[0], arrays[1], arrays[2], contigs, arrays[3])
+        return fragments if keep_duplicates else fragments.drop_duplicates()
+
+    def put(self, key, fragments):
+        # Write to a temporary folder then rename so readers never see a partial entry.
+        # Fragments must have been extracted with duplicates kept.
+        if fragments.duplicate is None:
+            raise ValueError("Cached fragments must be extracted with duplicate pairs kept and flagged")
+        tmp_path = tempfile.mkdtemp(prefix=".tmp_", dir=self.cache_dir)
+        for col in COLUMNS:
+            np.save(os.path.join(tmp_path, col + ".npy"), getattr(fragments, col))
+        with open(os.path.join(tmp_path, "contigs.txt"), "w") as fout:
+            fout.write("".join(name + "\n" for name in fragments.contigs.names))
+        self.install(tmp_path, key)
+
+    def writer(self, key):
+        return CacheEntryWriter(self, key)
+
+    def install(self, tmp_path, key):
+        # Swap a finished temporary folder into place as the entry for key
+        path = self.entry_path(key)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(tmp_path, path)
+        self.evict(keep=key)
+
+    def entries(self):
+        entries = list()
+        for key in os.listdir(self.cache_dir):
+            path = self.entry_path(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, key))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        # Remove the least recently used entries until the cache fits
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_path(key), ignore_errors=True)
+            total -= size
+
+class CacheEntryWriter:
+    """
+    Streams fragments into a new cache entry one contig at a time, so an entry
+    can be written without holding every fragment in memory. Contigs are coded
+    in the order they are added and each must come with its starts sorted and
+    its duplicate pairs flagged.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.tmp_path = tempfile.mkdtemp(prefix=".tmp_", dir=cache.cache_dir)
+        self.files = {col: open(os.path.join(self.tmp_path, col + ".raw"), "wb") for col in COLUMNS}
+        self.names = list()
+        self.size = 0
+
+    def add(self, name, starts, ends, duplicate):
+        code = len(self.names)
+        self.names.append(name)
+        np.full(len(starts), code, dtype=np.int32).tofile(self.files["chrom"])
+        np.asarray(starts, dtype=np.int32).tofile(self.files["start"])
+        np.asarray(ends, dtype=np.int32).tofile(self.files["end"])
+        np.asarray(duplicate, dtype=np.bool_).tofile(self.files["duplicate"])
+        self.size += len(starts)
+
+    def commit(self):
+        # Raw columns get a .npy header in front so the entry reads back like one written by put
+        for col in COLUMNS:
+            header = {"descr": np.lib.format.dtype_to_descr(np.dtype(DTYPES[col])), "fortran_order": False, "shape": (self.size,)}
+            self.files[col].close()
+            raw_path = os.path.join(self.tmp_path, col + ".raw")
+            with open(os.path.join(self.tmp_path, col + ".npy"), "wb") as fout, open(raw_path, "rb") as fin:
+                np.lib.format.write_array_header_1_0(fout, header)
+                shutil.copyfileobj(fin, fout)
+            os.remove(raw_path)
+        with open(os.path.join(self.tmp_path, "contigs.txt"), "w") as fout:
+            fout.write("".join(name + "\n" for name in self.names))
+        self.cache.install(self.tmp_path, self.key)
+
+    def abort(self):
+        for fout in self.files.values():
+            fout.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
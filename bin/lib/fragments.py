@@ -0,0 +1,633 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import heapq
+from array import array
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+import pysam
+
+from lib.intervals import PeakIndex
+from lib.sampling import name_hashes, occurrence_ranks, interval_priorities, bottom_k, DEFAULT_SAMPLE_SIZE, DEFAULT_SEED
+
+# Number of fragments held by each buffer chunk
+CHUNK_SIZE = 1 << 20
+
+# Maximum number of unmatched mates held in memory when pairing a coordinate sorted bam
+MAX_MATE_BUFFER = 500000
+
+# Number of hash buckets mates are spilled into once the mate buffer is full
+SPILL_BUCKETS = 16
+
+# Fragments of this length or longer are left out of the fragment bed
+MAX_FRAG_LEN = 1000
+
+# Template lengths counted in the dense length histogram, longer ones are counted individually
+LONG_TLEN = 1 << 16
+
+#*
+#========================================================================================
+# BUFFERS
+#========================================================================================
+#*/
+
+class FragmentBuffer:
+    """
+    Growable fragment store made of fixed size numpy chunks. Chunks are only
+    concatenated once, when the arrays are requested, so no pre-count of the
+    input is needed. Each fragment carries a flag for duplicate pairs.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.pos = 0
+        self._new_chunk()
+
+    def _new_chunk(self):
+        self.chrom = np.empty(self.chunk_size, dtype=np.int32)
+        self.start = np.empty(self.chunk_size, dtype=np.int32)
+        self.end = np.empty(self.chunk_size, dtype=np.int32)
+        self.duplicate = np.empty(self.chunk_size, dtype=np.bool_)
+        self.chunks.append((self.chrom, self.start, self.end, self.duplicate))
+        self.pos = 0
+
+    def append(self, chrom, start, end, duplicate=False):
+        if self.pos == self.chunk_size:
+            self._new_chunk()
+        self.chrom[self.pos] = chrom
+        self.start[self.pos] = start
+        self.end[self.pos] = end
+        self.duplicate[self.pos] = duplicate
+        self.pos += 1
+
+    def __len__(self):
+        return (len(self.chunks) - 1) * self.chunk_size + self.pos
+
+    def to_arrays(self):
+        # Trim the last chunk to the filled length and join
+        last = len(self.chunks) - 1
+        parts = [[chunk[i] if k < last else chunk[i][:self.pos] for k, chunk in enumerate(self.chunks)] for i in range(4)]
+        return tuple(np.concatenate(part) for part in parts)
+
+#*
+#========================================================================================
+# FRAGMENT SETS
+#========================================================================================
+#*/
+
+class ContigTable:
+    """
+    Contig names and the integer codes fragment sets use for them. One table is
+    shared by all samples of a report so codes can be compared across samples.
+    """
+
+    def __init__(self, names=()):
+        self.names = list()
+        self.codes = dict()
+        for name in names:
+            self.code(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def code(self, name):
+        if name not in self.codes:
+            self.codes[name] = len(self.names)
+            self.names.append(name)
+        return self.codes[name]
+
+    def encode(self, names):
+        return np.array([self.code(name) for name in names], dtype=np.int32)
+
+class FragmentSet:
+    """
+    Fragments of one sample as int32 contig codes, starts and ends, sorted by
+    contig code then start. Ends follow the report convention of the last base
+    of the rightmost mate. Sets extracted with duplicates kept also flag the
+    duplicate pairs, otherwise duplicate is None.
+    """
+
+    def __init__(self, chrom, start, end, contigs, duplicate=None):
+        self.chrom = np.asarray(chrom, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int32)
+        self.end = np.asarray(end, dtype=np.int32)
+        self.duplicate = None if duplicate is None else np.asarray(duplicate, dtype=np.bool_)
+        self.contigs = contigs
+        self._sort()
+
+    def _sort(self):
+        if len(self) > 1:
+            keys = self.chrom.astype(np.int64) << 32 | self.start.astype(np.int64)
+            if np.any(keys[1:] < keys[:-1]):
+                order = np.argsort(keys, kind="stable")
+                self.chrom = self.chrom[order]
+                self.start = self.start[order]
+                self.end = self.end[order]
+                if self.duplicate is not None:
+                    self.duplicate = self.duplicate[order]
+        self.bounds = np.searchsorted(self.chrom, np.arange(len(self.contigs) + 1))
+
+    def __len__(self):
+        return len(self.chrom)
+
+    @property
+    def nbytes(self):
+        return self.chrom.nbytes + self.start.nbytes + self.end.nbytes
+
+    def contig_slices(self):
+        # Yield (name, starts, ends) views for each contig holding fragments
+        for code in range(len(self.bounds) - 1):
+            lo, hi = self.bounds[code], self.bounds[code + 1]
+            if hi > lo:
+                yield self.contigs.names[code], self.start[lo:hi], self.end[lo:hi]
+
+    def lengths(self):
+        return np.abs(self.end - self.start)
+
+    def drop_duplicates(self):
+        # The fragments of pairs not marked as duplicates
+        if self.duplicate is None:
+            return self
+        keep = ~self.duplicate
+        return FragmentSet(self.chrom[keep], self.start[keep], self.end[keep], self.contigs)
+
+    def remap(self, contigs):
+        # Re-encode onto another (shared) contig table
+        lookup = contigs.encode(self.contigs.names)
+        if np.array_equal(lookup, np.arange(len(lookup))):
+            chrom = self.chrom
+        else:
+            chrom = lookup[self.chrom]
+        return FragmentSet(chrom, self.start, self.end, contigs, self.duplicate)
+
+    def to_dataframe(self):
+        names = np.array(self.contigs.names, dtype=object)
+        return pd.DataFrame({ "Chromosome" : names[self.chrom], "Start" : self.start, "End" : self.end })
+
+    @classmethod
+    def concat(cls, sets, contigs=None):
+        if contigs is None:
+            contigs = sets[0].contigs
+        sets = [fs if fs.contigs is contigs else fs.remap(contigs) for fs in sets]
+        duplicate = None
+        if any(fs.duplicate is not None for fs in sets):
+            duplicate = np.concatenate([np.zeros(len(fs), dtype=np.bool_) if fs.duplicate is None else fs.duplicate for fs in sets])
+        return cls(np.concatenate([fs.chrom for fs in sets]), np.concatenate([fs.start for fs in sets]), np.concatenate([fs.end for fs in sets]), contigs, duplicate)
+
+class FragmentSample:
+    """
+    Seeded uniform sample of at most size fragments of one sample, with the
+    number of fragments it was drawn from. Priorities are hashed from the
+    fragment coordinates and the occurrence rank of identical fragments, and
+    are kept with the sample, so shard samples merge into exactly the sample
+    of the whole bam.
+    """
+
+    def __init__(self, fragments, total, size=DEFAULT_SAMPLE_SIZE, seed=DEFAULT_SEED, priority=None):
+        self.fragments = fragments
+        self.total = total
+        self.size = size
+        self.seed = seed
+        self.priority = priority
+
+    def __len__(self):
+        return len(self.fragments)
+
+    @property
+    def weight(self):
+        # Fragments each sampled fragment stands for
+        return self.total / len(self) if len(self) else 0.0
+
+    @classmethod
+    def from_fragments(cls, fragments, size=DEFAULT_SAMPLE_SIZE, seed=DEFAULT_SEED, total=None):
+        # Identical fragments all come from one shard, as they share their leftmost mate position,
+        # so their occurrence ranks are the same whichever way the bam is split
+        ranks = occurrence_ranks(fragments.chrom, fragments.start, fragments.end)
+        priority = interval_priorities(name_hashes(fragments.contigs.names, seed)[fragments.chrom], fragments.start, fragments.end, ranks)
+        return cls.from_priorities(fragments.chrom, fragments.start, fragments.end, priority, fragments.contigs, size, seed,
+                                   len(fragments) if total is None else total)
+
+    @classmethod
+    def from_priorities(cls, chrom, start, end, priority, contigs, size, seed, total):
+        # Bottom-k of fragments with known priorities, in any order
+        order = np.argsort(chrom.astype(np.int64) << 32 | start.astype(np.int64), kind="stable")
+        keep = order[bottom_k(priority[order], size)]
+        sample = FragmentSet(chrom[keep], start[keep], end[keep], contigs)
+        return cls(sample, total, size, seed, priority[keep])
+
+    @classmethod
+    def merge(cls, samples, contigs=None):
+        # Bottom-k of the union of shard samples, on the priorities they were drawn with
+        # Contig codes are recoded in place, a remapped FragmentSet could be reordered away from its priorities
+        if contigs is None:
+            contigs = samples[0].fragments.contigs
+        sets = [sample.fragments for sample in samples]
+        chrom = np.concatenate([contigs.encode(fs.contigs.names)[fs.chrom] if len(fs) else fs.chrom for fs in sets])
+        return cls.from_priorities(chrom, np.concatenate([fs.start for fs in sets]), np.concatenate([fs.end for fs in sets]),
+                                   np.concatenate([sample.priority for sample in samples]), contigs, samples[0].size, samples[0].seed,
+                                   sum(sample.total for sample in samples))
+
+class MateBuffer:
+    """
+    Unmatched mates from one contig of a coordinate sorted bam, keyed by query
+    name. A mate is evicted once the scan has passed the position of its
+    partner. When more than max_size mates are waiting, new ones are spilled
+    to hash bucketed files on disk and paired when the contig is flushed.
+    """
+
+    def __init__(self, max_size=MAX_MATE_BUFFER, spill_dir=None, buckets=SPILL_BUCKETS):
+        self.max_size = max_size
+        self.spill_dir = spill_dir
+        self.buckets = buckets
+        self.mates = dict()
+        self.heap = list()
+        self.tmp_dir = None
+        self.spill_files = None
+        self.horizon = -1
+
+    @property
+    def spilling(self):
+        return self.spill_files is not None
+
+    def pop(self, name):
+        return self.mates.pop(name, None)
+
+    def push(self, name, start, end, mate_start, duplicate=False):
+        # The horizon is the last position a pending partner can start at
+        self.horizon = max(self.horizon, mate_start)
+        if len(self.mates) >= self.max_size:
+            self.spill(name, start, end, duplicate)
+            return
+        self.mates[name] = (start, end, duplicate)
+        heapq.heappush(self.heap, (mate_start, name))
+
+    def evict(self, pos):
+        # Drop mates whose partner should have been seen before pos
+        while self.heap and self.heap[0][0] < pos:
+            _, name = heapq.heappop(self.heap)
+            self.mates.pop(name, None)
+
+    def spill(self, name, start, end, duplicate=False):
+        if self.spill_files is None:
+            if self.tmp_dir is None:
+                self.tmp_dir = tempfile.mkdtemp(prefix="mates_", dir=self.spill_dir)
+            self.spill_files = [open(os.path.join(self.tmp_dir, "bucket_%d.txt" % i), "w") for i in range(self.buckets)]
+        self.spill_files[hash(name) % self.buckets].write("%s\t%d\t%d\t%d\n" % (name, start, end, duplicate))
+
+    def flush(self, frags, chrom):
+        # Pair any spilled mates one bucket at a time and reset for the next contig
+        self.mates.clear()
+        self.heap = list()
+        self.horizon = -1
+        if self.spill_files is None:
+            return
+
+        for spill_file in self.spill_files:
+            spill_file.close()
+            pending = dict()
+            with open(spill_file.name) as fin:
+                for line in fin:
+                    name, start, end, duplicate = line.split("\t")
+                    mate = pending.pop(name, None)
+                    if mate is None:
+                        pending[name] = (int(start), int(end), int(duplicate))
+                    else:
+                        frags.append(chrom, min(mate[0], int(start)), max(mate[1], int(end)) - 1, mate[2] or int(duplicate))
+            os.remove(spill_file.name)
+        self.spill_files = None
+
+    def close(self):
+        if self.spill_files is not None:
+            for spill_file in self.spill_files:
+                spill_file.close()
+            self.spill_files = None
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+#*
+#========================================================================================
+# BAM EXTRACTION
+#========================================================================================
+#*/
+
+def bam_sort_order(bamfile):
+    return bamfile.header.to_dict().get("HD", {}).get("SO", "unknown")
+
+def pair_name_sorted(reads, frags, keep_duplicates=False):
+    # Pair adjacent mates from a name sorted bam. Kept duplicate pairs are flagged in frags.
+    read1 = None
+    read2 = None
+
+    for read in reads:
+        if not read.is_paired or read.mate_is_unmapped or (read.is_duplicate and not keep_duplicates):
+            continue
+
+        if read.is_read2:
+            read2 = read
+        else:
+            read1 = read
+            read2 = None
+
+        if read1 is not None and read2 is not None and read1.query_name == read2.query_name:
+            start_pos = min(read1.reference_start, read2.reference_start)
+            end_pos = max(read1.reference_end, read2.reference_end) - 1
+            frags.append(read.reference_id, start_pos, end_pos, read1.is_duplicate or read2.is_duplicate)
+
+def pair_coordinate_sorted(reads, frags, max_buffer=MAX_MATE_BUFFER, spill_dir=None, region=None, keep_duplicates=False):
+    # Pair mates from a coordinate sorted bam, holding the first mate of each pair until its partner arrives.
+    # With a region only fragments whose leftmost mate starts inside it are kept, so a fragment is
+    # emitted by exactly one shard even when its mates straddle a shard boundary. Kept duplicate pairs are
+    # flagged in frags.
+    buffer = MateBuffer(max_buffer, spill_dir)
+    chrom = -1
+
+    try:
+        for read in reads:
+            if region is not None and read.reference_start >= region[1] and read.reference_start > buffer.horizon:
+                break
+
+            if not read.is_paired or read.mate_is_unmapped or (read.is_duplicate and not keep_duplicates):
+                continue
+            if read.is_unmapped or read.is_secondary or read.is_supplementary:
+                continue
+            if read.next_reference_id != read.reference_id:
+                continue
+            if region is not None and not region[0] <= min(read.reference_start, read.next_reference_start) < region[1]:
+                continue
+
+            if read.reference_id != chrom:
+                buffer.flush(frags, chrom)
+                chrom = read.reference_id
+
+            start = read.reference_start
+            buffer.evict(start)
+            mate = buffer.pop(read.query_name)
+
+            if mate is not None:
+                frags.append(chrom, min(mate[0], start), max(mate[1], read.reference_end) - 1, mate[2] or read.is_duplicate)
+            elif read.next_reference_start > start:
+                buffer.push(read.query_name, start, read.reference_end, read.next_reference_start, read.is_duplicate)
+            elif buffer.spilling:
+                # The partner may be waiting on disk
+                buffer.spill(read.query_name, start, read.reference_end, read.is_duplicate)
+            elif read.next_reference_start == start:
+                buffer.push(read.query_name, start, read.reference_end, start, read.is_duplicate)
+
+        buffer.flush(frags, chrom)
+    finally:
+        buffer.close()
+
+def plan_shards(bam_path, shard_size=0):
+    # Split an indexed, coordinate sorted bam into lists of (contig, start, end) regions.
+    # A shard size of 0 gives one shard per contig, otherwise contigs are cut into chunks of
+    # shard_size bp and small contigs are packed together up to the same size.
+    bamfile = pysam.AlignmentFile(bam_path, "rb")
+    if bam_sort_order(bamfile) != "coordinate" or not bamfile.has_index():
+        bamfile.close()
+        return [None]
+
+    shards = list()
+    current = list()
+    current_size = 0
+    for contig, length in zip(bamfile.references, bamfile.lengths):
+        if shard_size <= 0:
+            shards.append([(contig, 0, length)])
+            continue
+
+        for start in range(0, length, shard_size):
+            end = min(start + shard_size, length)
+            current.append((contig, start, end))
+            current_size += end - start
+            if current_size >= shard_size:
+                shards.append(current)
+                current = list()
+                current_size = 0
+
+    if current:
+        shards.append(current)
+    bamfile.close()
+    return shards
+
+def pe_bam_to_fragments(bam_path, sort_order=None, max_buffer=MAX_MATE_BUFFER, spill_dir=None, threads=1, regions=None, keep_duplicates=False):
+    # Extract fragments in a single pass, the pairing mode follows the bam header unless given.
+    # Regions restrict the scan to an indexed shard of the bam. Duplicate pairs are skipped unless kept,
+    # kept ones are flagged in the fragment set.
+    bamfile = pysam.AlignmentFile(bam_path, "rb", threads=threads)
+    frags = FragmentBuffer()
+
+    if sort_order is None:
+        sort_order = bam_sort_order(bamfile)
+
+    if regions is not None:
+        for contig, start, end in regions:
+            pair_coordinate_sorted(bamfile.fetch(contig, start), frags, max_buffer, spill_dir, region=(start, end), keep_duplicates=keep_duplicates)
+    elif sort_order == "coordinate":
+        pair_coordinate_sorted(bamfile, frags, max_buffer, spill_dir, keep_duplicates=keep_duplicates)
+    else:
+        pair_name_sorted(bamfile, frags, keep_duplicates=keep_duplicates)
+
+    contigs = ContigTable(bamfile.references)
+    bamfile.close()
+
+    chrom_arr, start_arr, end_arr, dup_arr = frags.to_arrays()
+    return FragmentSet(chrom_arr, start_arr, end_arr, contigs, dup_arr if keep_duplicates else None)
+
+#*
+#========================================================================================
+# PER SAMPLE STATS
+#========================================================================================
+#*/
+
+def fragment_lengths(fragments):
+    return np.unique(fragments.lengths(), return_counts=True)
+
+def frags_in_peaks(fragments, peaks):
+    # Count the fragments overlapping at least one peak
+    return PeakIndex.from_bed(peaks).count_fragments(fragments)
+
+def process_sample_bam(bam_path, peaks, regions=None, threads=1, max_buffer=MAX_MATE_BUFFER, spill_dir=None, sample_size=DEFAULT_SAMPLE_SIZE, seed=DEFAULT_SEED, keep_fragments=True):
+    # All per sample (or per shard) bam work, kept at module level so it can run in a worker process.
+    # Fragments sent back for the cache include the flagged duplicate pairs so coverage can share them.
+    if regions is not None:
+        peaks = peaks[peaks['chrom'].isin([region[0] for region in regions])]
+    fragments = pe_bam_to_fragments(bam_path, max_buffer=max_buffer, spill_dir=spill_dir, threads=threads, regions=regions, keep_duplicates=keep_fragments)
+    result = process_sample_fragments(fragments.drop_duplicates(), peaks, sample_size, seed, keep_fragments=False)
+    return ((fragments if keep_fragments else None),) + result[1:]
+
+def process_sample_fragments(fragments, peaks, sample_size=DEFAULT_SAMPLE_SIZE, seed=DEFAULT_SEED, keep_fragments=True):
+    # Exact length counts and FRiP over every fragment; only the sample is returned unless the fragments are kept
+    frag_lens, frag_counts = fragment_lengths(fragments)
+    sample = FragmentSample.from_fragments(fragments, sample_size, seed)
+    return (fragments if keep_fragments else None), frag_lens, frag_counts, frags_in_peaks(fragments, peaks), sample
+
+def merge_sample_results(parts, contigs):
+    # Combine shard results of one bam into a single sample result on the shared contig table
+    fragments = None
+    if parts[0][0] is not None:
+        fragments = FragmentSet.concat([part[0] for part in parts], contigs)
+    sample = FragmentSample.merge([part[4] for part in parts], contigs)
+    if len(parts) == 1:
+        return fragments, parts[0][1], parts[0][2], parts[0][3], sample
+
+    frag_lens = np.concatenate([part[1] for part in parts])
+    frag_counts = np.concatenate([part[2] for part in parts])
+    unique_lens, inverse = np.unique(frag_lens, return_inverse=True)
+    unique_counts = np.bincount(inverse, weights=frag_counts, minlength=len(unique_lens)).astype(np.int64)
+    return fragments, unique_lens, unique_counts, sum(part[3] for part in parts), sample
+
+#*
+#========================================================================================
+# INDEX DRIVEN FRIP
+#========================================================================================
+#*/
+
+def counted_mate(read):
+    # The mate a usable fragment is counted through: the leftmost primary mate of a mapped, non duplicate
+    # pair on one contig, the same pairs a full scan turns into fragments
+    if not read.is_paired or read.mate_is_unmapped or read.is_duplicate:
+        return False
+    if read.is_unmapped or read.is_secondary or read.is_supplementary:
+        return False
+    if read.next_reference_id != read.reference_id:
+        return False
+    if read.next_reference_start < read.reference_start:
+        return False
+    return not (read.next_reference_start == read.reference_start and read.is_read2)
+
+def frip_from_index(bam_path, peaks, threads=1):
+    # Usable fragments and fragments in peaks from one pass over the flags of an indexed bam, without
+    # pairing mates. Each fragment is seen once, through its leftmost mate, and spans the whole template,
+    # so both counts match a full scan with no cap on fragment length. Fragments are counted a chunk at a time.
+    bamfile = pysam.AlignmentFile(bam_path, "rb", threads=threads)
+    index = PeakIndex.from_bed(peaks)
+    mapped_frags = 0
+    counted = 0
+
+    def count_chunk(contig, frags):
+        _, starts, ends, _ = frags.to_arrays()
+        return len(starts), int(np.count_nonzero(index.overlaps(contig, starts, ends)))
+
+    for contig in bamfile.references:
+        frags = FragmentBuffer()
+        for read in bamfile.fetch(contig):
+            if not counted_mate(read):
+                continue
+
+            end = read.reference_start + max(abs(read.template_length), read.reference_end - read.reference_start)
+            frags.append(0, read.reference_start, end - 1)
+            if len(frags) == CHUNK_SIZE:
+                chunk_frags, chunk_counted = count_chunk(contig, frags)
+                mapped_frags += chunk_frags
+                counted += chunk_counted
+                frags = FragmentBuffer()
+
+        chunk_frags, chunk_counted = count_chunk(contig, frags)
+        mapped_frags += chunk_frags
+        counted += chunk_counted
+
+    bamfile.close()
+    return mapped_frags, counted
+
+#*
+#========================================================================================
+# FRAGMENT FILES
+#========================================================================================
+#*/
+
+class LengthHistogram:
+    """
+    Counts of absolute template lengths of mapped reads, collected while the
+    reads stream past and summed chunk by chunk with np.bincount. Lengths at
+    or above max_bin, from discordant pairs, are kept in a dict.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, max_bin=LONG_TLEN):
+        self.chunk_size = chunk_size
+        self.max_bin = max_bin
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.long_counts = dict()
+        self.chunk = array("q")
+
+    def tally(self, reads):
+        # Pass reads through, counting the template length of every mapped read as samtools view -F 0x04 does
+        for read in reads:
+            if not read.is_unmapped:
+                self.chunk.append(abs(read.template_length))
+                if len(self.chunk) >= self.chunk_size:
+                    self._add_chunk()
+            yield read
+        self._add_chunk()
+
+    def _add_chunk(self):
+        if not self.chunk:
+            return
+        values = np.frombuffer(self.chunk, dtype=np.int64)
+        is_long = values >= self.max_bin
+        for value in values[is_long]:
+            self.long_counts[int(value)] = self.long_counts.get(int(value), 0) + 1
+        counts = np.bincount(values[~is_long])
+        if len(counts) > len(self.counts):
+            counts[:len(self.counts)] += self.counts
+            self.counts = counts
+        else:
+            self.counts[:len(counts)] += counts
+        self.chunk = array("q")
+
+    def items(self):
+        # (length, read count) pairs of every length seen
+        sizes = np.flatnonzero(self.counts)
+        items = list(zip(sizes.tolist(), self.counts[sizes].tolist()))
+        return items + sorted(self.long_counts.items())
+
+def awk_number(value):
+    # Numbers as awk prints them: integers in full, anything else with the %.6g OFMT
+    return "%d" % value if value == int(value) else "%.6g" % value
+
+def write_frag_len(path, hist):
+    # Histogram in the format of `awk '{print abs($9)}' | sort | uniq -c | awk '{print $2, $1/2}'`:
+    # lengths in text sort order, each with its read count halved to a pair count
+    with open(path, "w") as fout:
+        for size, count in sorted(hist.items(), key=lambda item: str(item[0])):
+            fout.write("%d\t%s\n" % (size, awk_number(count / 2)))
+
+def write_fragment_bed(path, fragments, max_frag_len=MAX_FRAG_LEN):
+    # Fragments shorter than max_frag_len as a chrom, start, end bed sorted as `sort -k1,1 -k2,2n -k3,3n`
+    ends = fragments.end.astype(np.int64) + 1
+    keep = ends - fragments.start < max_frag_len
+    chrom, start, end = fragments.chrom[keep], fragments.start[keep], ends[keep]
+
+    names = np.array(fragments.contigs.names, dtype=object)
+    name_rank = np.argsort(np.argsort(names.astype(str), kind="stable"), kind="stable")
+    order = np.lexsort((end, start, name_rank[chrom]))
+
+    with open(path, "w") as fout:
+        for lo in range(0, len(order), CHUNK_SIZE):
+            block = order[lo:lo + CHUNK_SIZE]
+            fout.writelines("%s\t%d\t%d\n" % row for row in zip(names[chrom[block]], start[block].tolist(), end[block].tolist()))
+    return len(order)
+
+def bam_to_fragment_files(bam_path, bed_path, frag_len_path, max_frag_len=MAX_FRAG_LEN, threads=1, max_buffer=MAX_MATE_BUFFER, spill_dir=None):
+    # One pass over a paired end bam writing both the fragment bed and the template length histogram.
+    # Duplicates are kept, as bedtools bamtobed -bedpe keeps them.
+    bamfile = pysam.AlignmentFile(bam_path, "rb", threads=threads)
+    hist = LengthHistogram()
+    frags = FragmentBuffer()
+
+    reads = hist.tally(bamfile.fetch(until_eof=True))
+    if bam_sort_order(bamfile) == "coordinate":
+        pair_coordinate_sorted(reads, frags, max_buffer, spill_dir, keep_duplicates=True)
+    else:
+        pair_name_sorted(reads, frags, keep_duplicates=True)
+
+    contigs = ContigTable(bamfile.references)
+    bamfile.close()
+
+    chrom_arr, start_arr, end_arr, _ = frags.to_arrays()
+    written = write_fragment_bed(bed_path, FragmentSet(chrom_arr, start_arr, end_arr, contigs), max_frag_len)
+    write_frag_len(frag_len_path, hist)
+    return len(chrom_arr), written
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+# Number of points each violin density is evaluated at
+VIOLIN_POINTS = 100
+
+# Bandwidths past the extreme values the density is drawn to, as in seaborn
+VIOLIN_CUT = 2
+
+# Unique values folded into the density per step, bounds the grid x values temporary
+KDE_BLOCK = 4096
+
+#*
+#========================================================================================
+# WEIGHTED STATISTICS
+#========================================================================================
+#*/
+
+def collapse(values, weights=None):
+    # Sorted unique values with summed weights, turns raw observations into a histogram
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=np.float64)
+    unique_values, inverse = np.unique(values, return_inverse=True)
+    return unique_values, np.bincount(inverse, weights=weights, minlength=len(unique_values))
+
+def weighted_quantiles(values, weights, quantiles):
+    # Quantiles of a histogram with the same interpolation as np.quantile on the expanded values
+    order = np.argsort(values, kind="stable")
+    values = np.asarray(values, dtype=np.float64)[order]
+    cumulative = np.cumsum(np.asarray(weights, dtype=np.float64)[order])
+    total = cumulative[-1]
+
+    result = list()
+    for q in np.atleast_1d(quantiles):
+        pos = q * (total - 1)
+        lower = np.floor(pos)
+        frac = pos - lower
+        lower_value = values[np.searchsorted(cumulative, lower, side="right")]
+        upper_value = values[np.searchsorted(cumulative, min(lower + 1, total - 1), side="right")]
+        result.append(lower_value + (upper_value - lower_value) * frac)
+    return np.array(result)
+
+def weighted_std(values, weights):
+    mean = np.average(values, weights=weights)
+    total = weights.sum()
+    if total <= 1:
+        return 0.0
+    return np.sqrt(np.sum(weights * (values - mean) ** 2) / (total - 1))
+
+def histogram_summary(values, weights):
+    # Exact count, mean, range and quartiles of a histogram
+    values, weights = collapse(values, weights)
+    keep = weights > 0
+    values = values[keep]
+    weights = weights[keep]
+    quartiles = weighted_quantiles(values, weights, [0.25, 0.5, 0.75])
+    return {'count': int(weights.sum()), 'mean': np.average(values, weights=weights), 'min': values[0],
+            'q1': quartiles[0], 'median': quartiles[1], 'q3': quartiles[2], 'max': values[-1]}
+
+def weighted_kde(values, weights, grid, bandwidth):
+    # Gaussian density of a histogram evaluated on grid, one kernel per unique value
+    density = np.zeros(len(grid))
+    for i in range(0, len(values), KDE_BLOCK):
+        block_values = values[i:i + KDE_BLOCK]
+        block_weights = weights[i:i + KDE_BLOCK]
+        z = (grid[:, None] - block_values[None, :]) / bandwidth
+        density += np.exp(-0.5 * z * z) @ block_weights
+    return density / (weights.sum() * bandwidth * np.sqrt(2 * np.pi))
+
+def violin_stats(values, weights, points=VIOLIN_POINTS, cut=VIOLIN_CUT):
+    # Density and summary statistics of a histogram in the form matplotlib's Axes.violin takes
+    values, weights = collapse(values, weights)
+    keep = weights > 0
+    values = values[keep]
+    weights = weights[keep]
+
+    # Scott's rule on the number of observations, as gaussian_kde does for the expanded values
+    total = weights.sum()
+    bandwidth = weighted_std(values, weights) * total ** (-1 / 5)
+    if bandwidth == 0:
+        bandwidth = 1.0
+
+    coords = np.linspace(values[0] - cut * bandwidth, values[-1] + cut * bandwidth, points)
+    quartiles = weighted_quantiles(values, weights, [0.25, 0.5, 0.75])
+    return {
+        'coords': coords,
+        'vals': weighted_kde(values, weights, coords, bandwidth),
+        'mean': np.average(values, weights=weights),
+        'median': quartiles[1],
+        'min': values[0],
+        'max': values[-1],
+        'quartiles': quartiles,
+        'count': total
+    }
+
+#*
+#========================================================================================
+# PLOTS
+#========================================================================================
+#*/
+
+def histogram_violin(ax, hist, x, hue, value, weight=None, palette="viridis", width=0.8):
+    # Grouped violins drawn from per group/hue histograms, returns their summary statistics
+    groups = list(pd.unique(hist[x]))
+    hues = sorted(pd.unique(hist[hue]))
+    colors = sns.color_palette(palette, len(hues))
+    hue_width = width / len(hues)
+
+    rows = list()
+    for group_pos, group in enumerate(groups):
+        for hue_pos, hue_level in enumerate(hues):
+            subset = hist[(hist[x] == group) & (hist[hue] == hue_level)]
+            if subset.shape[0] == 0:
+                continue
+
+            stats = violin_stats(subset[value].to_numpy(), None if weight is None else subset[weight].to_numpy())
+            pos = group_pos - width / 2 + hue_width * (hue_pos + 0.5)
+            parts = ax.violin([stats], positions=[pos], widths=hue_width * 0.95, showextrema=False)
+            for body in parts['bodies']:
+                body.set_facecolor(colors[hue_pos])
+                body.set_edgecolor("0.25")
+                body.set_alpha(1)
+
+            # Box inner as seaborn draws it: whiskers over the range, thick quartile box and median point
+            q1, median, q3 = stats['quartiles']
+            ax.vlines(pos, stats['min'], stats['max'], color="0.25", linewidth=1)
+            ax.vlines(pos, q1, q3, color="0.25", linewidth=4)
+            ax.scatter([pos], [median], color="white", s=12, zorder=3)
+
+            rows.append({x: group, hue: hue_level, 'count': int(stats['count']), 'mean': stats['mean'], 'min': stats['min'],
+                         'q1': q1, 'median': median, 'q3': q3, 'max': stats['max']})
+
+    ax.set_xticks(range(len(groups)))
+    ax.set_xticklabels(groups)
+    ax.set_xlabel(x)
+    ax.set_xlim(-0.5, len(groups) - 0.5)
+    handles = [ax.fill_between([], [], color=colors[k], label=level) for k, level in enumerate(hues)]
+    ax.legend(handles=handles, title=hue)
+    return pd.DataFrame(rows, columns=[x, hue, 'count', 'mean', 'min', 'q1', 'median', 'q3', 'max'])
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import heapq
+import numpy as np
+
+# Replicate sets are held as bits of an int64
+MAX_REPLICATES = 63
+
+#*
+#========================================================================================
+# SWEEP LINE PRIMITIVES
+#========================================================================================
+#*/
+
+def merge_intervals(starts, ends):
+    # Union of half-open intervals as sorted, disjoint starts and ends. Touching intervals are joined.
+    starts = np.asarray(starts)
+    ends = np.asarray(ends)
+    if len(starts) == 0:
+        return starts.astype(np.int64), ends.astype(np.int64)
+
+    order = np.argsort(starts, kind="stable")
+    starts = starts[order].astype(np.int64)
+    ends = ends[order].astype(np.int64)
+
+    # A new block opens wherever a start is past every end seen so far
+    reach = np.maximum.accumulate(ends)
+    opens = np.ones(len(starts), dtype=bool)
+    opens[1:] = starts[1:] > reach[:-1]
+    first = np.flatnonzero(opens)
+    return starts[first], np.maximum.reduceat(ends, first)
+
+def overlaps_any(starts, ends, merged_starts, merged_ends):
+    # Boolean mask of the intervals overlapping at least one merged interval.
+    # Blocks are disjoint and sorted, so the only candidate is the last block starting before the end.
+    idx = np.searchsorted(merged_starts, ends, side="left") - 1
+    hit = idx >= 0
+    hit[hit] = merged_ends[idx[hit]] > np.asarray(starts)[hit]
+    return hit
+
+#*
+#========================================================================================
+# PEAK INDEX
+#========================================================================================
+#*/
+
+class PeakIndex:
+    """
+    Peaks merged per chromosome into sorted, disjoint blocks, built once and
+    queried with vectorized binary searches.
+    """
+
+    def __init__(self, chroms, starts, ends):
+        chroms = np.asarray(chroms)
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+        self.blocks = dict()
+        for chrom in np.unique(chroms):
+            mask = chroms == chrom
+            self.blocks[chrom] = merge_intervals(starts[mask], ends[mask])
+
+    @classmethod
+    def from_bed(cls, peaks):
+        return cls(peaks['chrom'].to_numpy(), peaks['start'].to_numpy(), peaks['end'].to_numpy())
+
+    def __len__(self):
+        return sum(len(block[0]) for block in self.blocks.values())
+
+    def overlaps(self, chrom, starts, ends):
+        if chrom not in self.blocks:
+            return np.zeros(len(starts), dtype=bool)
+        merged_starts, merged_ends = self.blocks[chrom]
+        return overlaps_any(starts, ends, merged_starts, merged_ends)
+
+    def count_fragments(self, fragments):
+        # Number of fragments in a FragmentSet overlapping any peak
+        return int(sum(np.count_nonzero(self.overlaps(chrom, starts, ends)) for chrom, starts, ends in fragments.contig_slices()))
+
+    def covered_bp(self):
+        return int(sum((ends - starts).sum() for starts, ends in self.blocks.values()))
+
+    def intersection_bp(self, other):
+        # Bases covered by both indexes, from the union of two sets of disjoint blocks
+        shared = 0
+        for chrom in self.blocks.keys() & other.blocks.keys():
+            a_starts, a_ends = self.blocks[chrom]
+            b_starts, b_ends = other.blocks[chrom]
+            union_starts, union_ends = merge_intervals(np.concatenate([a_starts, b_starts]), np.concatenate([a_ends, b_ends]))
+            shared += int((a_ends - a_starts).sum() + (b_ends - b_starts).sum() - (union_ends - union_starts).sum())
+        return shared
+
+#*
+#========================================================================================
+# REPLICATE OVERLAPS
+#========================================================================================
+#*/
+
+def replicate_masks(peak_sets):
+    # For every peak of every replicate a bitmask of the replicates it overlaps, bit j set for replicate j.
+    # A peak always overlaps its own replicate, so a complete mask means the peak is reproduced in all of them.
+    if len(peak_sets) > MAX_REPLICATES:
+        raise ValueError("At most %d replicates per group are supported" % MAX_REPLICATES)
+
+    indexes = [PeakIndex.from_bed(peaks) for peaks in peak_sets]
+    masks = list()
+    for peaks in peak_sets:
+        chroms = peaks['chrom'].to_numpy()
+        starts = peaks['start'].to_numpy()
+        ends = peaks['end'].to_numpy()
+        mask = np.zeros(len(peaks), dtype=np.int64)
+        for chrom in np.unique(chroms):
+            rows = np.flatnonzero(chroms == chrom)
+            for j, index in enumerate(indexes):
+                mask[rows] |= index.overlaps(chrom, starts[rows], ends[rows]).astype(np.int64) << j
+        masks.append(mask)
+    return indexes, masks
+
+def replicate_overlap_stats(peak_sets, replicates):
+    # Reproduced peaks per replicate and pairwise overlap/Jaccard table for one group of replicates
+    indexes, masks = replicate_masks(peak_sets)
+    complete = (1 << len(peak_sets)) - 1
+
+    reproduced = list()
+    pairwise = list()
+    for i, (peaks, mask) in enumerate(zip(peak_sets, masks)):
+        # Duplicate peak records are counted once
+        hits = peaks[mask == complete]
+        reproduced.append(len(hits[['chrom', 'start']].drop_duplicates()))
+
+        for j in range(len(peak_sets)):
+            overlapping = int(np.count_nonzero((mask >> j) & 1))
+            shared_bp = indexes[i].intersection_bp(indexes[j])
+            union_bp = indexes[i].covered_bp() + indexes[j].covered_bp() - shared_bp
+            pairwise.append({
+                'replicate': replicates[i],
+                'other_replicate': replicates[j],
+                'peaks': len(peaks),
+                'peaks_overlapping': overlapping,
+                'overlap_rate': overlapping / len(peaks) * 100 if len(peaks) else np.nan,
+                'jaccard_bp': shared_bp / union_bp if union_bp else np.nan
+            })
+    return reproduced, pairwise
+
+#*
+#========================================================================================
+# CONSENSUS MERGE
+#========================================================================================
+#*/
+
+def read_peak_rows(path, replicate):
+    # Rows of a SEACR bed by chromosome, each list sorted by start, so inputs need not be sorted.
+    # Rows are (start, end, columns 2-6 as text, replicate); the text is written back unchanged.
+    rows = dict()
+    with open(path) as fin:
+        for line in fin:
+            fields = line.rstrip("\n").split("\t")
+            rows.setdefault(fields[0], []).append((int(fields[1]), int(fields[2]), fields[1:6], replicate))
+    for chrom_rows in rows.values():
+        chrom_rows.sort(key=lambda row: row[0])
+    return rows
+
+def merge_replicate_peaks(paths):
+    # Merge of replicate peak beds into consensus intervals in one sweep per chromosome. Overlapping
+    # and touching peaks are joined as bedtools merge does. Yields (chrom, start, end, merged rows)
+    # with chromosomes in sort -k1,1 order and the merged rows in start order.
+    tables = [read_peak_rows(path, k) for k, path in enumerate(paths)]
+    for chrom in sorted(set(chrom for table in tables for chrom in table)):
+        rows = heapq.merge(*[table.get(chrom, []) for table in tables], key=lambda row: row[0])
+        current = None
+        for row in rows:
+            if current is not None and row[0] <= current[1]:
+                current[1] = max(current[1], row[1])
+                current[2].append(row)
+                continue
+
+            if current is not None:
+                yield chrom, current[0], current[1], current[2]
+            current = [row[0], row[1], [row]]
+
+        if current is not None:
+            yield chrom, current[0], current[1], current[2]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Occurrences are read counts halved, so a pair with one mate filtered out leaves a half count
+FRAG_HIST_DTYPES = {'Size': np.int32, 'Occurrences': np.float64}
+PEAK_DTYPES = {'chrom': 'category', 'start': np.int32, 'end': np.int32, 'total_signal': np.float64, 'max_signal': np.float64}
+
+#*
+#========================================================================================
+# UTIL
+#========================================================================================
+#*/
+
+def csv_engine():
+    # pyarrow parses in parallel and is used when installed on a pandas that supports it
+    try:
+        import pyarrow
+    except ImportError:
+        return 'c'
+    major, minor = (int(part) for part in pd.__version__.split('.')[:2])
+    return 'pyarrow' if (major, minor) >= (1, 4) else 'c'
+
+def parse_sample(path):
+    # (sample id, group, replicate) from a file named <group>_<replicate>.<suffix>
+    sample_id = os.path.basename(path).split(".")[0]
+    group, replicate = sample_id.rsplit("_", 1)
+    return sample_id, group, replicate
+
+def read_table(path, names, dtype, usecols=None, engine='c'):
+    return pd.read_csv(path, sep='\t', header=None, names=names, usecols=usecols, dtype=dtype, engine=engine)
+
+def read_tables(paths, names, dtype, usecols=None, threads=1):
+    # Read per-sample tables concurrently, in path order
+    engine = csv_engine()
+    workers = max(1, min(threads, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda path: read_table(path, names, dtype, usecols, engine), paths))
+
+def stack_tables(tables, paths, names, dtype):
+    # Stack per-sample tables once, tagged with group and replicate
+    samples = [parse_sample(path) for path in paths]
+    sizes = [table.shape[0] for table in tables]
+    if tables:
+        combined = pd.concat(tables, ignore_index=True)
+    else:
+        combined = pd.DataFrame({name: pd.Series(dtype=dtype[name]) for name in names})
+
+    # Categorical columns with different categories per file fall back to object when stacked
+    for name in names:
+        if dtype.get(name) == 'category' and combined[name].dtype != 'category':
+            combined[name] = combined[name].astype('category')
+
+    combined['group'] = np.repeat([group for _, group, _ in samples], sizes)
+    combined['replicate'] = np.repeat([replicate for _, _, replicate in samples], sizes)
+    return combined
+
+def load_tables(paths, names, dtype, usecols=None, threads=1):
+    return stack_tables(read_tables(paths, names, dtype, usecols, threads), paths, names, dtype)
+
+#*
+#========================================================================================
+# REPORT INPUTS
+#========================================================================================
+#*/
+
+def load_frag_hists(paths, threads=1):
+    # Fragment length histograms (Size, Occurrences) of all samples. Counts stay integers unless a half count is present.
+    hists = load_tables(paths, ['Size', 'Occurrences'], FRAG_HIST_DTYPES, threads=threads)
+    occurrences = hists['Occurrences'].to_numpy()
+    if np.array_equal(occurrences, np.floor(occurrences)):
+        hists['Occurrences'] = occurrences.astype(np.int64)
+    return hists
+
+def read_peaks(paths, threads=1):
+    # SEACR peaks of each sample, keeping the coordinates and signal columns
+    return read_tables(paths, list(PEAK_DTYPES), PEAK_DTYPES, usecols=[0, 1, 2, 3, 4], threads=threads)
+
+def stack_peaks(tables, paths):
+    return stack_tables(tables, paths, list(PEAK_DTYPES), PEAK_DTYPES)
+
+def load_peaks(paths, threads=1):
+    # SEACR peaks of all samples
+    return stack_peaks(read_peaks(paths, threads), paths)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import numpy as np
+
+#*
+#========================================================================================
+# HEADERS
+#========================================================================================
+#*/
+
+def _scalar(value):
+    # Strings are quoted so MultiQC never reads them as numbers or booleans
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+def config_lines(config, indent=0):
+    # YAML lines of a nested dict of MultiQC section config
+    lines = list()
+    for key, value in config.items():
+        if isinstance(value, dict):
+            lines.append("%s%s:" % (" " * indent, key))
+            lines.extend(config_lines(value, indent + 4))
+        else:
+            lines.append("%s%s: %s" % (" " * indent, key, _scalar(value)))
+    return lines
+
+#*
+#========================================================================================
+# CUSTOM CONTENT WRITERS
+#========================================================================================
+#*/
+
+def write_linegraph(fout, config, series):
+    # YAML line graph streamed one sample at a time. series yields (sample, x values, y values).
+    fout.write("\n".join(config_lines(dict(config, plot_type='linegraph'))) + "\n")
+    fout.write("data:\n")
+    for sample, xs, ys in series:
+        points = ", ".join("%s: %s" % point for point in zip(np.asarray(xs).tolist(), np.asarray(ys).tolist()))
+        fout.write("    %s: {%s}\n" % (_scalar(sample), points))
+
+def write_table(fout, config, table, index, index_label='Sample'):
+    # Tab separated table with the section config in '#' header lines, one row per sample named by the index column
+    columns = [col for col in table.columns if col != index]
+    for line in config_lines(dict(config, plot_type='table')):
+        fout.write("# " + line + "\n")
+    fout.write("\t".join([index_label] + [str(col) for col in columns]) + "\n")
+    for row in table[[index] + columns].itertuples(index=False):
+        fout.write("\t".join("" if value is None or value != value else str(value) for value in row) + "\n")
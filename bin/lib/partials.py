@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+
+# Leading bytes of each input hashed into its fingerprint
+HEAD_BYTES = 1 << 16
+
+#*
+#========================================================================================
+# FINGERPRINTS
+#========================================================================================
+#*/
+
+def file_identity(path):
+    # Name, size, mtime and a checksum of the leading bytes. The directory is left out so
+    # inputs staged into a new work folder still match.
+    stat = os.stat(path)
+    with open(path, "rb") as fin:
+        head_md5 = hashlib.md5(fin.read(HEAD_BYTES)).hexdigest()
+    return [os.path.basename(path), stat.st_size, stat.st_mtime_ns, head_md5]
+
+def fingerprint(paths, **settings):
+    # Identity of the inputs and settings a partial result was computed from
+    ident = json.dumps({"inputs": [file_identity(path) for path in paths], "settings": settings}, sort_keys=True)
+    return hashlib.sha1(ident.encode()).hexdigest()
+
+#*
+#========================================================================================
+# STORE
+#========================================================================================
+#*/
+
+class PartialStore:
+    """
+    On-disk store of per-sample (or per-group) partial report results. Each
+    entry is pickled with the fingerprint of the inputs and settings that
+    produced it, and is only returned while that fingerprint still matches, so
+    a rerun recomputes just the new or changed samples.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, kind, name):
+        return os.path.join(self.path, kind, name + ".pkl")
+
+    def get(self, kind, name, key):
+        path = self.entry_path(kind, name)
+        try:
+            with open(path, "rb") as fin:
+                entry = pickle.load(fin)
+        except (OSError, EOFError, ValueError, AttributeError, pickle.UnpicklingError):
+            entry = None
+
+        if entry is None or entry.get("fingerprint") != key:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["data"]
+
+    def put(self, kind, name, key, data):
+        # Write to a temporary file then rename so readers never see a partial entry
+        folder = os.path.join(self.path, kind)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_", dir=folder)
+        with os.fdopen(fd, "wb") as fout:
+            pickle.dump({"fingerprint": key, "data": data}, fout, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.entry_path(kind, name))
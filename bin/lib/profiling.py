@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import json
+import time
+import resource
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+from lib.multiqc import write_table
+
+# Allocation sites kept per stage when tracemalloc is on
+TOP_ALLOCATIONS = 5
+
+# Minimum seconds between progress log lines
+PROGRESS_INTERVAL = 30
+
+PROFILE_MQC = {
+    'id': 'reporting_profile',
+    'section_name': 'Report Generation Profile',
+    'description': 'Wall time, CPU time and peak memory of each stage of the python reporting step.'
+}
+
+#*
+#========================================================================================
+# STAGE PROFILER
+#========================================================================================
+#*/
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+def cpu_seconds():
+    # CPU time of this process plus any children that have been waited for, such as pool workers
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self_usage.ru_utime + self_usage.ru_stime + child_usage.ru_utime + child_usage.ru_stime
+
+class StageProfiler:
+    """
+    Records wall time, CPU time, peak RSS and optionally the top tracemalloc
+    allocation sites for named stages of the report, and writes them as JSON
+    and as a MultiQC custom content table.
+    """
+
+    def __init__(self, logger, trace_malloc=False, top_n=TOP_ALLOCATIONS):
+        self.logger = logger
+        self.trace_malloc = trace_malloc
+        self.top_n = top_n
+        self.records = list()
+        if trace_malloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name):
+        # Time a block and add its record once it completes
+        record = {'stage': name, 'pid': os.getpid()}
+        snapshot = tracemalloc.take_snapshot() if self.trace_malloc else None
+        if self.trace_malloc and hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        wall_start = time.perf_counter()
+        cpu_start = cpu_seconds()
+
+        yield record
+
+        record['wall_s'] = round(time.perf_counter() - wall_start, 3)
+        record['cpu_s'] = round(cpu_seconds() - cpu_start, 3)
+        record['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        record['children_peak_rss_mb'] = round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1)
+        if snapshot is not None:
+            record['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1 << 20), 1)
+            stats = tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')
+            record['top_allocations'] = [{'site': str(stat.traceback[0]), 'size_diff_mb': round(stat.size_diff / (1 << 20), 3), 'count_diff': stat.count_diff} for stat in stats[:self.top_n]]
+
+        self.add(record)
+
+    def add(self, record, log=True):
+        # Records from worker processes are added by the parent, already logged by the worker
+        self.records.append(record)
+        if log:
+            self.logger.info('Stage %s: %.1fs wall, %.1fs cpu, %.0f MB peak rss', record['stage'], record['wall_s'], record['cpu_s'], record['peak_rss_mb'])
+
+    def write_json(self, path):
+        with open(path, 'w') as fout:
+            json.dump(self.records, fout, indent=2)
+
+    def write_multiqc(self, path):
+        # MultiQC custom content table, one row per stage
+        columns = ['wall_s', 'cpu_s', 'peak_rss_mb', 'children_peak_rss_mb']
+        if self.trace_malloc:
+            columns.append('traced_peak_mb')
+        table = pd.DataFrame([[record['stage']] + [record.get(col) for col in columns] for record in self.records], columns=['stage'] + columns)
+        with open(path, 'w') as fout:
+            write_table(fout, PROFILE_MQC, table, 'stage', 'Stage')
+
+#*
+#========================================================================================
+# PROGRESS
+#========================================================================================
+#*/
+
+class ProgressLogger:
+    """
+    Logs completed tasks with an ETA extrapolated from the mean time per task,
+    at most once every interval seconds.
+    """
+
+    def __init__(self, logger, label, total, interval=PROGRESS_INTERVAL):
+        self.logger = logger
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.perf_counter()
+        self.last_log = self.start
+
+    def update(self, n=1):
+        self.done += n
+        now = time.perf_counter()
+        if self.done < self.total and now - self.last_log < self.interval:
+            return
+        self.last_log = now
+        elapsed = now - self.start
+        eta = elapsed / self.done * (self.total - self.done)
+        self.logger.info('%s: %d/%d done, %.0fs elapsed, ETA %.0fs', self.label, self.done, self.total, elapsed, eta)
@@ -2,37 +2,136 @@
 # coding: utf-8
 
 import os
+import io
 import glob
 import re
 import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from matplotlib.ticker import FuncFormatter
 import seaborn as sns
-import pyranges as pr
-import pysam
-import time
+import pickle
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+from lib.intervals import replicate_overlap_stats
+from lib.histograms import histogram_violin, histogram_summary
+from lib.bins import BinMatrix, bin_file_sample, read_bin_blocks, natural_key
+from lib.profiling import StageProfiler, ProgressLogger
+from lib.multiqc import write_linegraph, write_table
+from lib.loaders import load_frag_hists, load_peaks as load_peak_tables, read_peaks, stack_peaks, parse_sample
+from lib.bin_store import BinStore, matrix_pearson, DEFAULT_RESOLUTIONS
+from lib.fragments import ContigTable, FragmentSample, process_sample_bam, process_sample_fragments, plan_shards, merge_sample_results, frip_from_index, MAX_MATE_BUFFER
+from lib.partials import fingerprint
+from lib.sampling import DEFAULT_SAMPLE_SIZE, DEFAULT_SEED, PRIORITY_VERSION
+
+# Data sources in load order, with the loader method and the sources it builds on
+DATA_SOURCES = {
+    'meta': ('load_meta', []),
+    'frag_hist': ('load_frag_hist', []),
+    'bins': ('load_bins', []),
+    'peaks': ('load_peaks', []),
+    'bams': ('load_bams', ['peaks']),
+    'reproducibility': ('load_reproducibility', ['peaks'])
+}
+
+# Input path attribute each data source reads
+DATA_INPUTS = {
+    'meta': 'meta_path',
+    'frag_hist': 'raw_frag_path',
+    'bins': 'bin_frag_path',
+    'peaks': 'seacr_bed_path',
+    'bams': 'bam_path'
+}
+
+# Report sections in output order and the data sources they need
+SECTIONS = {
+    'alignment_summary': ['meta'],
+    'duplication_summary': ['meta'],
+    'fraglen_summary_violin': ['frag_hist'],
+    'fraglen_summary_histogram': ['frag_hist'],
+    'replicate_heatmap': ['bins'],
+    'scale_factor_summary': ['meta'],
+    'no_of_peaks': ['peaks'],
+    'peak_widths': ['peaks'],
+    'reproduced_peaks': ['reproducibility'],
+    'frags_in_peaks': ['bams'],
+    'frag_len_hist_mqc': ['frag_hist']
+}
+
+# MultiQC custom content sections, written with their headers embedded
+MULTIQC_CONFIG = {
+    'frag_len_hist_mqc': {
+        'id': 'fragment_lengths',
+        'section_name': 'Fragment Length Distribution',
+        'description': 'Fragment length distribution QC',
+        'anchor': 'fragment_lengths',
+        'pconfig': {'title': 'Fragment Length Distribution Plot', 'xlab': 'Length (bp)', 'ylab': 'Frequency'}
+    },
+    '02_duplication_summary': {
+        'id': 'duplication_summary',
+        'section_name': 'Duplication Summary',
+        'description': 'Duplication rate, estimated library size and unique fragments of each sample.'
+    },
+    '06_01_peak_stats': {
+        'id': 'peak_stats',
+        'section_name': 'Peak Statistics',
+        'description': 'Number, width and total signal of the peaks called for each sample.'
+    },
+    '06_03_reproduced_peaks': {
+        'id': 'reproduced_peaks',
+        'section_name': 'Peak Reproducibility',
+        'description': 'Peaks of each sample that overlap peaks in every other replicate of its group.'
+    },
+    '06_04_frags_in_peaks': {
+        'id': 'frags_in_peaks',
+        'section_name': 'Fragments within Peaks',
+        'description': 'Aligned fragments falling within the peaks of each sample (FRiP).'
+    }
+}
+
+# Report being rendered, inherited by forked render workers so it is never pickled
+_render_report = None
+
+def _render_section(section, output_path):
+    return _render_report.render_section(section, output_path)
 
 class Reports:
     data_table = None
     frag_hist = None
     frag_violin = None
-    frag_bin500 = None
+    bin_matrix = None
     seacr_beds = None
     bams = None
 
-    def __init__(self, logger, meta, raw_frags, bin_frag, seacr_bed, bams):
+    def __init__(self, logger, meta, raw_frags, bin_frag, seacr_bed, bams, mate_buffer = MAX_MATE_BUFFER, tmp_dir = None, threads = 1, shard_size = None, cache = None, frip_mode = 'scan', frip_validate = False, bin_store = None, bin_resolutions = DEFAULT_RESOLUTIONS, heatmap_resolution = 500, profiler = None, frag_sample_size = DEFAULT_SAMPLE_SIZE, seed = DEFAULT_SEED, partials = None):
         self.logger = logger
         self.meta_path = meta
         self.raw_frag_path = raw_frags
         self.bin_frag_path = bin_frag
         self.seacr_bed_path = seacr_bed
         self.bam_path = bams
-
-        sns.set()
-        sns.set_theme()
-        sns.set_context("paper")
+        self.mate_buffer = mate_buffer
+        self.tmp_dir = tmp_dir
+        self.threads = max(1, threads)
+        self.shard_size = shard_size
+        self.cache = cache
+        self.frip_mode = frip_mode
+        self.frip_validate = frip_validate
+        self.bin_store_path = bin_store
+        self.bin_resolutions = bin_resolutions
+        self.heatmap_resolution = heatmap_resolution
+        self.profiler = profiler if profiler is not None else StageProfiler(logger)
+        self.frag_sample_size = frag_sample_size
+        self.seed = seed
+        self.partials = partials
+
+        # Theme is set once so figures look the same whichever process renders them
+        sns.set(font_scale=0.6)
 
     #*
     #========================================================================================
@@ -40,288 +139,303 @@ class Reports:
     #========================================================================================
     #*/
 
-    def format_millions(self, x, pos):
+    @staticmethod
+    def format_millions(x, pos):
         #the two args are the value and tick position
         return '%1.1fM' % (x * 1e-6)
 
-    def format_thousands(self, x, pos):
+    @staticmethod
+    def format_thousands(x, pos):
         #the two args are the value and tick position
         return '%1.1fK' % (x * 1e-3)
 
+    def map_samples(self, func, *iterables, label='samples'):
+        # Run func for each sample in a process pool, results are returned in input order
+        tasks = list(zip(*iterables))
+        progress = ProgressLogger(self.logger, label, len(tasks))
+        workers = min(self.threads, len(tasks))
+        if workers < 2:
+            results = list()
+            for task in tasks:
+                results.append(func(*task))
+                progress.update()
+            return results
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(func, *task) for task in tasks]
+            for _ in as_completed(futures):
+                progress.update()
+            return [future.result() for future in futures]
+
+    def with_partials(self, kind, names, keys, compute):
+        # Per sample results from the partial store where the fingerprint still matches.
+        # compute(indexes) returns the missing results in order, which are saved for the next run.
+        results = [self.partials.get(kind, name, key) for name, key in zip(names, keys)]
+        missing = [k for k, result in enumerate(results) if result is None]
+        if missing:
+            for k, result in zip(missing, compute(missing)):
+                self.partials.put(kind, names[k], keys[k], result)
+                results[k] = result
+        self.logger.info('Partial %s results reused: %d/%d', kind, len(names) - len(missing), len(names))
+        return results
+
+    def sample_threads(self, samples):
+        # Spread the remaining threads over the workers as bam decompression threads
+        return max(1, self.threads // max(1, min(self.threads, samples)))
+
     #*
     #========================================================================================
     # LOAD DATA
     #========================================================================================
     #*/
 
-    def load_data(self):
+    def required_data(self, sections):
+        # Data sources the sections need, with their own dependencies, in load order
+        needed = set()
+        pending = [source for section in sections for source in SECTIONS[section]]
+        while pending:
+            source = pending.pop()
+            if source not in needed:
+                needed.add(source)
+                pending.extend(DATA_SOURCES[source][1])
+        return [source for source in DATA_SOURCES if source in needed]
+
+    def missing_inputs(self, sections):
+        # Input paths that are needed by the sections but were not given
+        return [DATA_INPUTS[source] for source in self.required_data(sections) if source in DATA_INPUTS and getattr(self, DATA_INPUTS[source]) is None]
+
+    def load_data(self, sources=None):
+        # Load the data sources in dependency order, all of them by default
+        if sources is None:
+            sources = list(DATA_SOURCES)
+        for source in sources:
+            with self.profiler.stage('load_' + source):
+                getattr(self, DATA_SOURCES[source][0])()
+
+    def load_meta(self):
         # ---------- Data - data_table --------- #
         self.data_table = pd.read_csv(self.meta_path, sep=',')
         self.duplicate_info = False
         if 'dedup_percent_duplication' in self.data_table.columns:
             self.duplicate_info = True
+        self.annotate_data_table()
 
+    def load_frag_hist(self):
         # ---------- Data - Raw frag histogram --------- #
         # Create list of deeptools raw fragment files
-        dt_frag_list = glob.glob(self.raw_frag_path)
-
-
-        for i in list(range(len(dt_frag_list))):
-            # create dataframe from csv file for each file and save to a list
-            dt_frag_i = pd.read_csv(dt_frag_list[i], sep='\t', header=None, names=['Size','Occurrences'])
-            frag_base_i = os.path.basename(dt_frag_list[i])
-            sample_id = frag_base_i.split(".")[0]
-            sample_id_split = sample_id.rsplit("_", 1)
-            rep_i = sample_id_split[1]
-            group_i = sample_id_split[0]
-
-            # create long forms of fragment histograms
-            dt_frag_i_long = np.repeat(dt_frag_i['Size'].values, dt_frag_i['Occurrences'].values)
-            dt_group_i_long = np.repeat(group_i, len(dt_frag_i_long))
-            dt_rep_i_long = np.repeat(rep_i, len(dt_frag_i_long))
-
-            dt_group_i_short = np.repeat(group_i, dt_frag_i.shape[0])
-            dt_rep_i_short = np.repeat(rep_i, dt_frag_i.shape[0])
-
-            if i==0:
-                frags_arr = dt_frag_i_long
-                group_arr = dt_group_i_long
-                rep_arr = dt_rep_i_long
-
-                group_short = dt_group_i_short
-                rep_short = dt_rep_i_short
-                self.frag_hist = dt_frag_i
-            else:
-                frags_arr = np.append(frags_arr, dt_frag_i_long)
-                group_arr = np.append(group_arr, dt_group_i_long)
-                rep_arr = np.append(rep_arr, dt_rep_i_long)
-
-                group_short = np.append(group_short, dt_group_i_short)
-                rep_short = np.append(rep_short, dt_rep_i_short)
-                self.frag_hist = self.frag_hist.append(dt_frag_i)
-
-        self.frag_hist['group'] = group_short
-        self.frag_hist['replicate'] = rep_short
-        self.frag_violin = pd.DataFrame( { "fragment_size" : frags_arr, "group" : group_arr , "replicate": rep_arr} ) #, index = np.arange(len(frags_arr)))
+        dt_frag_list = sorted(glob.glob(self.raw_frag_path))
+        self.frag_hist = load_frag_hists(dt_frag_list, self.threads)
 
+    def load_bins(self):
         # ---------- Data - Binned frags --------- #
-        # create full join data frame for count data
-        # start by creating list of bin500 files
-        dt_bin_frag_list = glob.glob(self.bin_frag_path)
-        for i in list(range(len(dt_bin_frag_list))):
-            dt_bin_frag_i_read = pd.read_csv(dt_bin_frag_list[i], sep='\t', header=None, names=['chrom','bin','count','sample'])
-            sample_name = dt_bin_frag_i_read['sample'].iloc[0].split(".")[0]
-            dt_bin_frag_i = dt_bin_frag_i_read[['chrom','bin','count']]
-            dt_bin_frag_i.columns = ['chrom','bin',sample_name]
-
-            if i==0:
-                self.frag_bin500 = dt_bin_frag_i
-
+        # Sorted bin files are merged chromosome by chromosome into a sparse bin x sample count matrix
+        dt_bin_frag_list = sorted(glob.glob(self.bin_frag_path))
+        resolutions = set(self.bin_resolutions) | {self.heatmap_resolution}
+        self.bin_store = None
+        if self.bin_store_path is not None:
+            self.bin_store = BinStore.open_current(self.bin_store_path, dt_bin_frag_list, resolutions)
+
+        if self.bin_store is not None:
+            self.logger.info('Reusing bin store %s', self.bin_store_path)
+        else:
+            if self.partials is None:
+                self.bin_matrix = BinMatrix.from_files(dt_bin_frag_list)
             else:
-                self.frag_bin500 = pd.merge(self.frag_bin500, dt_bin_frag_i, on=['chrom','bin'], how='outer')
+                # Only new or changed bin files are parsed, the cohort matrix is merged from every sample's bins
+                parsed = self.with_partials('bins', [os.path.basename(path) for path in dt_bin_frag_list], [fingerprint([path]) for path in dt_bin_frag_list],
+                                            lambda missing: [(bin_file_sample(dt_bin_frag_list[k]), list(read_bin_blocks(dt_bin_frag_list[k]))) for k in missing])
+                self.bin_matrix = BinMatrix.from_blocks([sample for sample, _ in parsed], [blocks for _, blocks in parsed])
 
-        # add log2 transformed count data column
-        log2_counts = self.frag_bin500[self.frag_bin500.columns[-(len(dt_bin_frag_list)):]].transform(lambda x: np.log2(x))
-        chrom_bin_cols = self.frag_bin500[['chrom','bin']]
-        self.frag_bin500 = pd.concat([chrom_bin_cols,log2_counts], axis=1)
+            # Keep every resolution on disk so later reads skip the bed text
+            if self.bin_store_path is not None:
+                self.bin_store = BinStore.write(self.bin_store_path, self.bin_matrix, resolutions, dt_bin_frag_list)
 
+    def load_peaks(self):
         # ---------- Data - Peaks --------- #
-        # create dataframe for seacr peaks
-        seacr_bed_list = glob.glob(self.seacr_bed_path)
-
         # combine all seacr bed files into one df including group and replicate info
-        for i in list(range(len(seacr_bed_list))):
-            seacr_bed_i = pd.read_csv(seacr_bed_list[i], sep='\t', header=None, usecols=[0,1,2,3,4], names=['chrom','start','end','total_signal','max_signal'])
-            bed_base_i = os.path.basename(seacr_bed_list[i])
-            sample_id = bed_base_i.split(".")[0]
-            sample_id_split = sample_id.rsplit("_", 1)
-            rep_i = sample_id_split[1]
-            group_i = sample_id_split[0]
-            seacr_bed_i['group'] = np.repeat(group_i, seacr_bed_i.shape[0])
-            seacr_bed_i['replicate'] = np.repeat(rep_i, seacr_bed_i.shape[0])
-
-            if i==0:
-                self.seacr_beds = seacr_bed_i
+        seacr_bed_list = sorted(glob.glob(self.seacr_bed_path))
+        self.peak_paths = {parse_sample(path)[1:]: path for path in seacr_bed_list}
+        if self.partials is None:
+            self.seacr_beds = load_peak_tables(seacr_bed_list, self.threads)
+        else:
+            tables = self.with_partials('peaks', [os.path.basename(path) for path in seacr_bed_list], [fingerprint([path]) for path in seacr_bed_list],
+                                        lambda missing: read_peaks([seacr_bed_list[k] for k in missing], self.threads))
+            self.seacr_beds = stack_peaks(tables, seacr_bed_list)
 
-            else:
-                self.seacr_beds = self.seacr_beds.append(seacr_bed_i)
+        # ---------- Data - Peak stats --------- #
+        self.seacr_beds_group_rep = self.seacr_beds[['group','replicate']].groupby(['group','replicate']).size().reset_index().rename(columns={0:'all_peaks'})
 
+    def load_bams(self):
         # ---------- Data - target histone mark bams --------- #
-        bam_list = glob.glob(self.bam_path)
-        self.bam_df_list = list()
+        bam_list = sorted(glob.glob(self.bam_path))
+        self.contigs = ContigTable()
+        self.frag_samples = list()
         self.frip = pd.DataFrame(data=None, index=range(len(bam_list)), columns=['group','replicate','mapped_frags','frags_in_peaks','percentage_frags_in_peaks'])
-        k = 0 #counter
-
-        def pe_bam_to_df(bam_path):
-            bamfile = pysam.AlignmentFile(bam_path, "rb")
-            # Iterate through reads.
-            read1 = None
-            read2 = None
-            k=0 #counter
-
-            # get number of reads in bam
-            count = 0
-            for _ in bamfile:
-                count += 1
-
-            bamfile.close()
-            bamfile = pysam.AlignmentFile(bam_path, "rb")
-
-            # initialise arrays
-            frag_no = round(count/2)
-            start_arr = np.zeros(frag_no, dtype=np.int64)
-            end_arr = np.zeros(frag_no, dtype=np.int64)
-            chrom_arr = np.empty(frag_no, dtype="<U20")
-
-            for read in bamfile:
 
-                if not read.is_paired or read.mate_is_unmapped or read.is_duplicate:
-                    continue
-
-                if read.is_read2:
-                    read2 = read
-                    # print("is read2: " + read.query_name)
-
-                else:
-                    read1 = read
-                    read2 = None
-                    # print("is read1: " + read.query_name)
-
-                if read1 is not None and read2 is not None and read1.query_name == read2.query_name:
-
-                    start_pos = min(read1.reference_start, read2.reference_start)
-                    end_pos = max(read1.reference_end, read2.reference_end) - 1
-                    chrom = read.reference_name
-
-                    start_arr[k] = start_pos
-                    end_arr[k] = end_pos
-                    chrom_arr[k] = chrom
-
-                    k +=1
-
-            bamfile.close()
-
-            # remove zeros and empty elements. The indicies for these are always the same from end_arr and chrom_arr
-            remove_idx = np.where(chrom_arr == '')[0]
-            chrom_arr = np.delete(chrom_arr, remove_idx)
-            start_arr = np.delete(start_arr, remove_idx)
-            end_arr = np.delete(end_arr, remove_idx)
-
-            # create dataframe
-            bam_df = pd.DataFrame({ "Chromosome" : chrom_arr, "Start" : start_arr, "End" : end_arr })
-            return(bam_df)
-
-        for bam in bam_list:
-            bam_now = pe_bam_to_df(bam)
-            self.bam_df_list.append(bam_now)
-            bam_base = os.path.basename(bam)
-            sample_id = bam_base.split(".")[0]
-            [group_now,rep_now] = sample_id.rsplit("_", 1)
+        # Fragment extraction, length counts and fragments in peaks are computed per sample in parallel
+        peak_groups = {key: peaks[['chrom','start','end']] for key, peaks in self.seacr_beds.groupby(['group','replicate'], sort=False)}
+        no_peaks = self.seacr_beds.iloc[:0][['chrom','start','end']]
+        peak_list = list()
+        for k, bam in enumerate(bam_list):
+            _, group_now, rep_now = parse_sample(bam)
             self.frip.at[k, 'group'] = group_now
             self.frip.at[k, 'replicate'] = rep_now
-            self.frip.at[k, 'mapped_frags'] = bam_now.shape[0]
-            k=k+1
-
-        # ---------- Data - New frag_hist --------- #
-        for i in list(range(len(self.bam_df_list))):
-            df_i = self.bam_df_list[i]
-            widths_i = (df_i['End'] - df_i['Start']).abs()
-            unique_i, counts_i = np.unique(widths_i, return_counts=True)
-            group_i = np.repeat(self.frip.at[i, 'group'], len(unique_i))
-            rep_i = np.repeat(self.frip.at[i, 'replicate'], len(unique_i))
-
-            if i==0:
-                frag_lens = unique_i
-                frag_counts = counts_i
-                group_arr = group_i
-                rep_arr = rep_i
-            else:
-                frag_lens = np.append(frag_lens, unique_i)
-                frag_counts = np.append(frag_counts, counts_i)
-                group_arr = np.append(group_arr, group_i)
-                rep_arr = np.append(rep_arr, rep_i)
+            peak_list.append(peak_groups.get((group_now, rep_now), no_peaks))
+
+        if self.frip_mode == 'index':
+            # Both counts come from one pass over the read flags, mates are not paired and fragments are not kept
+            frip_index = partial(frip_from_index, threads=self.sample_threads(len(bam_list)))
+            index_results = self.map_samples(frip_index, bam_list, peak_list, label='FRiP index queries')
+            for k, (mapped_frags_k, frags_in_peaks_k) in enumerate(index_results):
+                self.frip.at[k, 'mapped_frags'] = mapped_frags_k
+                self.frip.at[k, 'frags_in_peaks'] = frags_in_peaks_k
+            self.frag_series = pd.DataFrame(columns=['group','replicate','frag_len','occurences'])
+
+            if self.frip_validate:
+                self.validate_frip(self.scan_bams(bam_list, peak_list))
+
+        else:
+            bam_results = self.scan_bams(bam_list, peak_list)
+
+            # ---------- Data - New frag_hist --------- #
+            frag_lens = list()
+            frag_counts = list()
+            group_arr = list()
+            rep_arr = list()
+            for k, (_, lens_k, counts_k, frags_in_peaks_k, sample_k) in enumerate(bam_results):
+                self.frag_samples.append(sample_k)
+                self.frip.at[k, 'mapped_frags'] = sample_k.total
+                self.frip.at[k, 'frags_in_peaks'] = frags_in_peaks_k
+
+                frag_lens.append(lens_k)
+                frag_counts.append(counts_k)
+                group_arr.append(np.repeat(self.frip.at[k, 'group'], len(lens_k)))
+                rep_arr.append(np.repeat(self.frip.at[k, 'replicate'], len(lens_k)))
+
+            self.frag_series = pd.DataFrame({'group' : np.concatenate(group_arr), 'replicate' : np.concatenate(rep_arr), 'frag_len' : np.concatenate(frag_lens), 'occurences' : np.concatenate(frag_counts)})
 
-        self.frag_series = pd.DataFrame({'group' : group_arr, 'replicate' : rep_arr, 'frag_len' : frag_lens, 'occurences' : frag_counts})
-
-        # ---------- Data - Peak stats --------- #
-        self.seacr_beds_group_rep = self.seacr_beds[['group','replicate']].groupby(['group','replicate']).size().reset_index().rename(columns={0:'all_peaks'})
+        # ---------- Data - Percentage of fragments in peaks --------- #
+        self.frip['percentage_frags_in_peaks'] = (self.frip['frags_in_peaks'] / self.frip['mapped_frags'])*100
 
+    def load_reproducibility(self):
         # ---------- Data - Reproducibility of peaks between replicates --------- #
-        # empty dataframe to fill in loop
-        self.reprod_peak_stats = self.seacr_beds_group_rep #self.df_no_peaks
-        self.reprod_peak_stats = self.reprod_peak_stats.reindex(columns=self.reprod_peak_stats.columns.tolist() + ['no_peaks_reproduced','peak_reproduced_rate'])
-
-        # create permutations list
-        def array_permutate(x):
-            arr_len=len(x)
-            loop_list = x
-            out_list = x
-            for i in range(arr_len-1):
-                i_list = np.roll(loop_list, -1)
-                out_list = np.vstack((out_list, i_list))
-                loop_list = i_list
-            return out_list
-
-        # create pyranges objects and fill df
+        # Every peak gets a bitmask of the replicates it overlaps in one pass per group
+        self.reprod_peak_stats = self.seacr_beds_group_rep.copy()
+        self.reprod_peak_stats['no_peaks_reproduced'] = np.nan
+        self.reprod_peak_stats['peak_reproduced_rate'] = np.nan
+        self.replicate_overlaps = pd.DataFrame(columns=['group','replicate','other_replicate','peaks','peaks_overlapping','overlap_rate','jaccard_bp'])
+
         unique_groups = self.seacr_beds.group.unique()
-        unique_replicates = self.seacr_beds.replicate.unique()
-        self.replicate_number = 1
         self.multiple_reps = True
         if (len(unique_groups) == self.seacr_beds_group_rep.shape[0]):
             self.multiple_reps = False
 
         if self.multiple_reps:
-            idx_count=0
-            for i in list(range(len(unique_groups))):
-                group_i = unique_groups[i]
-                group_reps = len(self.seacr_beds_group_rep[self.seacr_beds_group_rep['group'] == group_i])
-                if group_reps < 2:
-                    continue
-                rep_permutations = array_permutate(range(group_reps))
-                for k in list(range(group_reps)):
-                    pyr_query = pr.PyRanges()
-                    rep_perm = rep_permutations[k]
-                    for j in rep_perm:
-                        rep_i = "R" + str(range(group_reps)[j]+1)
-                        peaks_i = self.seacr_beds[(self.seacr_beds['group']==group_i) & (self.seacr_beds['replicate']==rep_i)]
-                        pyr_subject = pr.PyRanges(chromosomes=peaks_i['chrom'], starts=peaks_i['start'], ends=peaks_i['end'])
-                        if(len(pyr_query) > 0):
-                            pyr_overlap = pyr_query.join(pyr_subject)
-                            pyr_overlap = pyr_overlap.apply(lambda df: df.drop(['Start_b','End_b'], axis=1))
-                            pyr_query = pyr_overlap
-
-                        else:
-                            pyr_query = pyr_subject
-
-                    if (pyr_query.empty):
-                        self.reprod_peak_stats.at[idx_count, 'no_peaks_reproduced'] = 0
-
-                    else :
-                        pyr_starts = pyr_query.values()[0]['Start']
-                        unique_pyr_starts = pyr_starts.unique()
-                        self.reprod_peak_stats.at[idx_count, 'no_peaks_reproduced'] = len(unique_pyr_starts)
-
-                    idx_count = idx_count + 1
+            groups = list()
+            for group_i in unique_groups:
+                group_reps = self.seacr_beds_group_rep[self.seacr_beds_group_rep['group'] == group_i]['replicate'].tolist()
+                if len(group_reps) >= 2:
+                    groups.append((group_i, group_reps))
+
+            def group_stats(group_i, group_reps):
+                group_peaks = self.seacr_beds[self.seacr_beds['group'] == group_i]
+                peak_sets = [group_peaks[group_peaks['replicate'] == rep_i][['chrom','start','end']] for rep_i in group_reps]
+                return replicate_overlap_stats(peak_sets, group_reps)
+
+            # A group is only joined again when one of its replicates' peaks changed
+            if self.partials is None:
+                group_results = [group_stats(group_i, group_reps) for group_i, group_reps in groups]
+            else:
+                keys = [fingerprint([self.peak_paths[(group_i, rep_i)] for rep_i in group_reps], replicates=group_reps) for group_i, group_reps in groups]
+                group_results = self.with_partials('reproducibility', [group_i for group_i, _ in groups], keys,
+                                                   lambda missing: [group_stats(*groups[k]) for k in missing])
+
+            reproduced_rows = list()
+            pairwise_rows = list()
+            for (group_i, group_reps), (reproduced, pairwise) in zip(groups, group_results):
+                for rep_i, reproduced_i in zip(group_reps, reproduced):
+                    reproduced_rows.append((group_i, rep_i, reproduced_i))
+                for row in pairwise:
+                    row['group'] = group_i
+                    pairwise_rows.append(row)
+
+            reproduced_df = pd.DataFrame(reproduced_rows, columns=['group','replicate','reproduced'])
+            self.reprod_peak_stats = self.reprod_peak_stats.merge(reproduced_df, on=['group','replicate'], how='left')
+            self.reprod_peak_stats['no_peaks_reproduced'] = self.reprod_peak_stats.pop('reproduced')
+            self.replicate_overlaps = pd.DataFrame(pairwise_rows, columns=self.replicate_overlaps.columns)
 
             fill_reprod_rate = (self.reprod_peak_stats['no_peaks_reproduced'] / self.reprod_peak_stats['all_peaks'])*100
             self.reprod_peak_stats['peak_reproduced_rate'] = fill_reprod_rate
 
-        # ---------- Data - Percentage of fragments in peaks --------- #
-        for i in range(len(self.bam_df_list)):
-            bam_i = self.bam_df_list[i]
-            self.frip.at[i,'mapped_frags'] = bam_i.shape[0]
-            group_i = self.frip.at[i,'group']
-            rep_i = self.frip.at[i,'replicate']
-            seacr_bed_i = self.seacr_beds[(self.seacr_beds['group']==group_i) & (self.seacr_beds['replicate']==rep_i)]
-            pyr_seacr = pr.PyRanges(chromosomes=seacr_bed_i['chrom'], starts=seacr_bed_i['start'], ends=seacr_bed_i['end'])
-            pyr_bam = pr.PyRanges(df=bam_i)
-            sample_id = group_i + "_" + rep_i
-            frag_count_pyr = pyr_bam.count_overlaps(pyr_seacr)
-            frag_counts = np.count_nonzero(frag_count_pyr.NumberOverlaps)
-
-            self.frip.at[i,'frags_in_peaks'] = frag_counts
+    def scan_bams(self, bam_list, peak_list):
+        # Per sample scan results, only new or changed samples are scanned when partial results are kept
+        if self.partials is None:
+            return self.scan_bam_files(bam_list, peak_list)
 
-        self.frip['percentage_frags_in_peaks'] = (self.frip['frags_in_peaks'] / self.frip['mapped_frags'])*100
+        keys = list()
+        for bam in bam_list:
+            peak_path = self.peak_paths.get(parse_sample(bam)[1:])
+            inputs = [bam] if peak_path is None else [bam, peak_path]
+            keys.append(fingerprint(inputs, frag_sample_size=self.frag_sample_size, seed=self.seed, priorities=PRIORITY_VERSION))
+
+        def scan_missing(missing):
+            results = self.scan_bam_files([bam_list[k] for k in missing], [peak_list[k] for k in missing])
+            return [result[1:] for result in results]
+
+        parsed = self.with_partials('bams', [os.path.basename(bam) for bam in bam_list], keys, scan_missing)
+        return [(None, lens_k, counts_k, frags_in_peaks_k, FragmentSample.merge([sample_k], self.contigs)) for lens_k, counts_k, frags_in_peaks_k, sample_k in parsed]
+
+    def scan_bam_files(self, bam_list, peak_list):
+        # Read every alignment of each bam into fragments, per sample or per genomic shard in parallel
+        # Samples found in the fragment cache are not read again
+        cache_keys = [None] * len(bam_list)
+        cached = [None] * len(bam_list)
+        if self.cache is not None:
+            for k, bam in enumerate(bam_list):
+                cache_keys[k] = self.cache.key(bam)
+                cached[k] = self.cache.get(cache_keys[k])
+            self.logger.info('Fragment cache hits: %d/%d', sum(fs is not None for fs in cached), len(bam_list))
+
+        # Indexed bams can be split into genomic shards so a single deep sample is scanned in parallel
+        task_sample = list()
+        task_regions = list()
+        for k, bam in enumerate(bam_list):
+            if cached[k] is not None:
+                continue
+            shards = [None] if self.shard_size is None else plan_shards(bam, self.shard_size)
+            task_sample.extend([k] * len(shards))
+            task_regions.extend(shards)
+
+        # Workers send back only a fixed size sample of the fragments, unless they are to be cached with duplicates flagged
+        keep_fragments = self.cache is not None
+        process_bam = partial(process_sample_bam, threads=self.sample_threads(len(task_sample)), max_buffer=self.mate_buffer, spill_dir=self.tmp_dir,
+                              sample_size=self.frag_sample_size, seed=self.seed, keep_fragments=keep_fragments)
+        task_results = self.map_samples(process_bam, [bam_list[k] for k in task_sample], [peak_list[k] for k in task_sample], task_regions, label='BAM scan tasks')
+        bam_results = list()
+        for k in range(len(bam_list)):
+            if cached[k] is not None:
+                bam_results.append(process_sample_fragments(cached[k].remap(self.contigs), peak_list[k], self.frag_sample_size, self.seed, keep_fragments=False))
+                continue
+
+            result_k = merge_sample_results([result for j, result in zip(task_sample, task_results) if j == k], self.contigs)
+            if keep_fragments:
+                self.cache.put(cache_keys[k], result_k[0])
+            bam_results.append((None,) + result_k[1:])
+
+        return bam_results
+
+    def validate_frip(self, bam_results):
+        # Compare index driven FRiP against the full scan, any difference in either count fails the report
+        failed = list()
+        for k, (_, _, _, frags_in_peaks_k, sample_k) in enumerate(bam_results):
+            sample = self.frip.at[k, 'group'] + '_' + self.frip.at[k, 'replicate']
+            index_counts = (self.frip.at[k, 'mapped_frags'], self.frip.at[k, 'frags_in_peaks'])
+            self.logger.info('FRiP validation %s: %d/%d fragments in peaks from index, %d/%d from full scan', sample, index_counts[1], index_counts[0], frags_in_peaks_k, sample_k.total)
+            if index_counts != (sample_k.total, frags_in_peaks_k):
+                failed.append(sample)
+
+        if failed:
+            raise ValueError('FRiP validation failed, index and full scan counts differ for: ' + ', '.join(failed))
 
     def annotate_data_table(self):
         # Make new perctenage alignment columns
@@ -334,105 +448,171 @@ class Reports:
     #========================================================================================
     #*/
 
-    def generate_plots(self):
+    def generate_plots(self, sections=None):
         # Init
         plots = dict()
         data = dict()
+        txt = None
+        if sections is None:
+            sections = list(SECTIONS)
 
-        # Get Data
-        self.load_data()
-        self.annotate_data_table()
+        # Get Data
+        self.load_data(self.required_data(sections))
+
+        for section in self.plot_sections(sections):
+            section_plots, section_data = self.plot_section(section)
+            plots.update(section_plots)
+            data.update(section_data)
+
+        # Fragment Length Histogram data in MultiQC yaml format
+        if 'frag_len_hist_mqc' in sections:
+            txt = io.StringIO()
+            self.frag_len_hist_mqc(txt)
+            txt = txt.getvalue()
+
+        return (plots, data, txt)
+
+    def plot_sections(self, sections):
+        # Sections that produce figures, always in report order
+        return [section for section in SECTIONS if section in sections and section != 'frag_len_hist_mqc']
+
+    def plot_section(self, section):
+        # Figures and supporting data tables of one report section
+        plots = dict()
+        data = dict()
 
         # Plot 1
-        multi_plot, data1 = self.alignment_summary()
-        plots["01_01_seq_depth"] = multi_plot[0]
-        plots["01_02_alignable_frag"] = multi_plot[1]
-        plots["01_03_alignment_rate_target"] = multi_plot[2]
-        plots["01_04_alignment_rate_spikein"] = multi_plot[3]
-        data["01_alignment_summary"] = data1
-
-        # Plot 2
-        if self.duplicate_info == True:
+        if section == 'alignment_summary':
+            multi_plot, data1 = self.alignment_summary()
+            plots["01_01_seq_depth"] = multi_plot[0]
+            plots["01_02_alignable_frag"] = multi_plot[1]
+            plots["01_03_alignment_rate_target"] = multi_plot[2]
+            plots["01_04_alignment_rate_spikein"] = multi_plot[3]
+            data["01_alignment_summary"] = data1
+
+        # Plot 2
+        if section == 'duplication_summary' and self.duplicate_info == True:
             multi_plot, data2 = self.duplication_summary()
             plots["02_01_dup_rate"] = multi_plot[0]
             plots["02_02_est_lib_size"] = multi_plot[1]
             plots["02_03_unique_frags"] = multi_plot[2]
             data["02_duplication_summary"] = data2
 
-        # Plot 3
-        plot3, data3 = self.fraglen_summary_violin()
-        plots["03_01_frag_len_violin"] = plot3
-        data["03_01_frag_len_violin"] = data3
+        # Plot 3
+        if section == 'fraglen_summary_violin':
+            plot3, data3 = self.fraglen_summary_violin()
+            plots["03_01_frag_len_violin"] = plot3
+            data["03_01_frag_len_violin"] = data3
 
-        # Plot 4
-        plot4, data4 = self.fraglen_summary_histogram()
-        plots["03_02_frag_len_hist"] = plot4
-        data["03_02_frag_len_hist"] = data4
+        # Plot 4
+        if section == 'fraglen_summary_histogram':
+            plot4, data4 = self.fraglen_summary_histogram()
+            plots["03_02_frag_len_hist"] = plot4
+            data["03_02_frag_len_hist"] = data4
 
         # Plot 5
-        plot5, data5 = self.replicate_heatmap()
-        plots["04_replicate_heatmap"] = plot5
-        data["04_replicate_heatmap"] = data5
+        if section == 'replicate_heatmap':
+            plot5, data5 = self.replicate_heatmap()
+            plots["04_replicate_heatmap"] = plot5
+            data["04_replicate_heatmap"] = data5
 
         # Plot 6
-        multi_plot, data6 = self.scale_factor_summary()
-        plots["05_01_scale_factor"] = multi_plot[0]
-        plots["05_02_frag_count"] = multi_plot[1]
-        data["05_scale_factor_summary"] = data6
+        if section == 'scale_factor_summary':
+            multi_plot, data6 = self.scale_factor_summary()
+            plots["05_01_scale_factor"] = multi_plot[0]
+            plots["05_02_frag_count"] = multi_plot[1]
+            data["05_scale_factor_summary"] = data6
 
         # Plot 7a
-        plot7a, data7a = self.no_of_peaks()
-        plots["06_01_no_of_peaks"] = plot7a
-        data["06_01_no_of_peaks"] = data7a
+        if section == 'no_of_peaks':
+            plot7a, data7a = self.no_of_peaks()
+            plots["06_01_no_of_peaks"] = plot7a
+            data["06_01_no_of_peaks"] = data7a
 
         # Plot 7b
-        plot7b, data7b = self.peak_widths()
-        plots["06_02_peak_widths"] = plot7b
-        data["06_02_peak_widths"] = data7b
+        if section == 'peak_widths':
+            plot7b, data7b = self.peak_widths()
+            plots["06_02_peak_widths"] = plot7b
+            data["06_02_peak_widths"] = data7b
 
         # Plot 7c
-        if self.multiple_reps:
+        if section == 'reproduced_peaks' and self.multiple_reps:
             plot7c, data7c = self.reproduced_peaks()
             plots["06_03_reproduced_peaks"] = plot7c
             data["06_03_reproduced_peaks"] = data7c
+            data["06_03_replicate_overlaps"] = self.replicate_overlaps
 
         # Plot 7d
-        plot7d, data7d = self.frags_in_peaks()
-        plots["06_04_frags_in_peaks"] = plot7d
-        data["06_04_frags_in_peaks"] = data7d
-
-        # Fragment Length Histogram data in MultiQC yaml format
-        txt = self.frag_len_hist_mqc()
-
-        return (plots, data, txt)
+        if section == 'frags_in_peaks':
+            plot7d, data7d = self.frags_in_peaks()
+            plots["06_04_frags_in_peaks"] = plot7d
+            data["06_04_frags_in_peaks"] = data7d
+
+            # Fragment level data, only from a full bam scan
+            if len(self.frag_samples) > 0:
+                data["06_05_frag_len_stats"] = self.frag_len_stats()
+                data["06_06_frag_sample"] = self.frag_sample_table()
+
+        return plots, data
+
+    def render_section(self, section, output_path, pdf=None):
+        # Save a section's tables and figures, each figure to png and pdf in one go and closed right away.
+        # Without a pdf the figures are returned pickled so the parent process can add the pages in order.
+        pages = list()
+        with self.profiler.stage('plot_' + section) as record:
+            plots, data = self.plot_section(section)
+            for key in data:
+                data[key].to_csv(os.path.join(output_path, key + '.csv'), index=False)
+
+            # Tables MultiQC renders interactively
+            for key, table in self.multiqc_tables(section).items():
+                with open(os.path.join(output_path, key + '_mqc.tsv'), 'w') as fout:
+                    write_table(fout, MULTIQC_CONFIG[key], table, 'sample')
+
+            for key, fig in plots.items():
+                fig.savefig(os.path.join(output_path, key + '.png'))
+                if pdf is not None:
+                    pdf.savefig(fig)
+                else:
+                    pages.append(pickle.dumps(fig))
+                plt.close(fig)
+        return pages, record
 
-    def gen_plots_to_folder(self, output_path):
+    def gen_plots_to_folder(self, output_path, sections=None):
         # Init
         abs_path = os.path.abspath(output_path)
-
-        # Get plots and supporting data tables
-        plots, data, txt = self.generate_plots()
-
-        # Save mqc text file
-        txt_mqc = open(os.path.join(abs_path, "03_03_frag_len_mqc.txt"), "w")
-        txt_mqc.write(txt)
-        txt_mqc.close()
-
-        # Save data to output folder
-        for key in data:
-            data[key].to_csv(os.path.join(abs_path, key + '.csv'), index=False)
-
-        # Save plots to output folder
-        for key in plots:
-            plots[key].savefig(os.path.join(abs_path, key + '.png'))
-
-        # Save pdf of the plots
-        self.gen_pdf(abs_path, plots)
-
-    def gen_pdf(self, output_path, plots):
-        with PdfPages(os.path.join(output_path, 'merged_report.pdf')) as pdf:
-            for key in plots:
-                pdf.savefig(plots[key])
+        if sections is None:
+            sections = list(SECTIONS)
+
+        # Get Data
+        self.load_data(self.required_data(sections))
+
+        # Save mqc line graph
+        if 'frag_len_hist_mqc' in sections:
+            with open(os.path.join(abs_path, "03_03_frag_len_mqc.yaml"), "w") as fout:
+                self.frag_len_hist_mqc(fout)
+
+        # Render sections in parallel; pdf pages are added in report order as sections complete
+        render_sections = self.plot_sections(sections)
+        with PdfPages(os.path.join(abs_path, 'merged_report.pdf')) as pdf:
+            workers = min(self.threads, len(render_sections))
+            if workers < 2 or 'fork' not in multiprocessing.get_all_start_methods():
+                for section in render_sections:
+                    self.render_section(section, abs_path, pdf)
+                return
+
+            global _render_report
+            _render_report = self
+            try:
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                    for pages, record in pool.map(_render_section, render_sections, [abs_path] * len(render_sections)):
+                        self.profiler.add(record, log=False)
+                        for page in pages:
+                            fig = pickle.loads(page)
+                            pdf.savefig(fig)
+                            plt.close(fig)
+            finally:
+                _render_report = None
 
     #*
     #========================================================================================
@@ -440,31 +620,73 @@ class Reports:
     #========================================================================================
     #*/
 
-    def frag_len_hist_mqc(self):
-        size_list = self.frag_hist["Size"].to_numpy().astype(str)
-        occurrences_list = self.frag_hist["Occurrences"].to_numpy().astype(str)
-        size_list_sep = np.core.defchararray.add(size_list, " : ")
-        x_y_list = np.core.defchararray.add(size_list_sep, occurrences_list)
-
-        group_rep = self.frag_hist[['group','replicate']].groupby(['group','replicate']).size().reset_index()
-        first_line = "data:"
-
-        for i in list(range(group_rep.shape[0])):
-            group_i = group_rep.at[i,"group"]
-            rep_i = group_rep.at[i,"replicate"]
-            str_list = x_y_list[ (self.frag_hist['group'] == group_i) & (self.frag_hist['replicate'] == rep_i) ]
-            # print(str_list)
-
-            x_y_str = ", ".join(str_list)
-            full_line_i = "    '" + group_i + "_" + rep_i + "' : {" + x_y_str + "}"
-            if i==0:
-                frag_len_hist_mqc_dict = "\n".join([first_line, full_line_i])
-
-            else:
-                frag_len_hist_mqc_dict = "\n".join([frag_len_hist_mqc_dict, full_line_i])
-
-
-        return frag_len_hist_mqc_dict
+    def frag_len_hist_mqc(self, fout):
+        # One line graph series per sample, from a single groupby over all histograms
+        series = ((group_i + "_" + rep_i, hist['Size'], hist['Occurrences']) for (group_i, rep_i), hist in self.frag_hist.groupby(['group','replicate']))
+        write_linegraph(fout, MULTIQC_CONFIG['frag_len_hist_mqc'], series)
+
+    def frag_len_stats(self):
+        # Fields prefixed exact_ are computed from every fragment, sampled_ from the fragment sample
+        rows = list()
+        for k, sample_k in enumerate(self.frag_samples):
+            group_k, rep_k = self.frip.at[k, 'group'], self.frip.at[k, 'replicate']
+            hist = self.frag_series[(self.frag_series['group'] == group_k) & (self.frag_series['replicate'] == rep_k)]
+            row = {'group': group_k, 'replicate': rep_k}
+            if hist.shape[0] > 0:
+                row.update(('exact_' + key, value) for key, value in histogram_summary(hist['frag_len'].to_numpy(), hist['occurences'].to_numpy()).items())
+            row['sampled_frags'] = len(sample_k)
+            row['sampled_fraction'] = len(sample_k) / sample_k.total if sample_k.total else np.nan
+            rows.append(row)
+        columns = ['group', 'replicate'] + ['exact_' + key for key in ('count', 'mean', 'min', 'q1', 'median', 'q3', 'max')] + ['sampled_frags', 'sampled_fraction']
+        return pd.DataFrame(rows, columns=columns)
+
+    def frag_sample_table(self):
+        # Every row is a sampled fragment; weight is the number of fragments of its sample it stands for
+        tables = list()
+        for k, sample_k in enumerate(self.frag_samples):
+            frags = sample_k.fragments.to_dataframe()
+            frags.insert(0, 'group', self.frip.at[k, 'group'])
+            frags.insert(1, 'replicate', self.frip.at[k, 'replicate'])
+            frags['frag_len'] = sample_k.fragments.lengths()
+            frags['weight'] = sample_k.weight
+
+            # Rows in chromosome, start, end order whatever order the contigs were coded in
+            ranks = {name: rank for rank, name in enumerate(sorted(sample_k.fragments.contigs.names, key=natural_key))}
+            order = np.lexsort((frags['End'].to_numpy(), frags['Start'].to_numpy(), frags['Chromosome'].map(ranks).to_numpy()))
+            tables.append(frags.iloc[order])
+        return pd.concat(tables, ignore_index=True)
+
+    def multiqc_tables(self, section):
+        # Per sample tables of a report section for MultiQC, keyed by output name
+        tables = dict()
+
+        if section == 'duplication_summary' and self.duplicate_info == True:
+            tables['02_duplication_summary'] = pd.DataFrame({
+                'sample': self.data_table['id'],
+                'group': self.data_table['group'],
+                'percent_duplication': self.data_table['dedup_percent_duplication'] * 100,
+                'estimated_library_size': self.data_table['dedup_estimated_library_size'],
+                'unique_frags': self.data_table['dedup_read_pairs_examined'] * (1 - self.data_table['dedup_percent_duplication'])
+            })
+
+        if section == 'no_of_peaks':
+            peaks = self.seacr_beds.assign(peak_width=(self.seacr_beds['end'] - self.seacr_beds['start']).abs())
+            stats = peaks.groupby(['group','replicate']).agg(peaks=('peak_width', 'size'), median_width=('peak_width', 'median'),
+                                                          mean_width=('peak_width', 'mean'), total_signal=('total_signal', 'sum')).reset_index()
+            stats.insert(0, 'sample', stats['group'] + '_' + stats['replicate'])
+            tables['06_01_peak_stats'] = stats
+
+        if section == 'reproduced_peaks' and self.multiple_reps:
+            stats = self.reprod_peak_stats.copy()
+            stats.insert(0, 'sample', stats['group'] + '_' + stats['replicate'])
+            tables['06_03_reproduced_peaks'] = stats
+
+        if section == 'frags_in_peaks':
+            stats = self.frip.copy()
+            stats.insert(0, 'sample', stats['group'] + '_' + stats['replicate'])
+            tables['06_04_frags_in_peaks'] = stats
+
+        return tables
 
     #*
     #========================================================================================
@@ -475,7 +697,6 @@ class Reports:
     # ---------- Plot 1 - Alignment Summary --------- #
     def alignment_summary(self):
         sns.color_palette("magma", as_cmap=True)
-        sns.set(font_scale=0.6)
         # Subset data
         df_data = self.data_table.loc[:, ('id', 'group', 'bt2_total_reads_target', 'bt2_total_aligned_target', 'target_alignment_rate', 'spikein_alignment_rate')]
 
@@ -559,7 +780,8 @@ class Reports:
     # ---------- Plot 3 - Fragment Distribution Violin --------- #
     def fraglen_summary_violin(self):
         fig, ax = plt.subplots()
-        ax = sns.violinplot(data=self.frag_violin, x="group", y="fragment_size", hue="replicate", palette = "viridis")
+        # Violins are drawn from the length histograms, the fragments are never expanded
+        self.frag_violin = histogram_violin(ax, self.frag_hist, x="group", hue="replicate", value="Size", weight="Occurrences", palette = "viridis")
         ax.set(ylabel="Fragment Size")
         fig.suptitle("Fragment Length Distribution")
 
@@ -585,13 +807,15 @@ class Reports:
     # ---------- Plot 5 - Replicate Reproducibility Heatmap --------- #
     def replicate_heatmap(self):
         fig, ax = plt.subplots()
-        plot_data = self.frag_bin500[self.frag_bin500.columns[-(len(self.frag_bin500.columns)-2):]]
-        # plot_data = plot_data.fillna(0)
-        corr_mat = plot_data.corr(method='pearson')
+        # Pearson correlation of log2 bin counts over the bins each pair of samples shares
+        if self.bin_store is not None:
+            corr_mat = self.bin_store.pearson(self.heatmap_resolution, np.log2)
+        else:
+            corr_mat = matrix_pearson(self.bin_matrix, self.heatmap_resolution, np.log2)
         ax = sns.heatmap(corr_mat, annot=True)
         fig.suptitle("Replicate Reproducibility")
 
-        return fig, self.frag_bin500
+        return fig, corr_mat.reset_index()
 
     # ---------- Plot 6 - Scale Factor Comparison --------- #
     def scale_factor_summary(self):
@@ -639,7 +863,8 @@ class Reports:
         self.seacr_beds['peak_width'] = self.seacr_beds['end'] - self.seacr_beds['start']
         self.seacr_beds['peak_width'] = self.seacr_beds['peak_width'].abs()
 
-        ax = sns.violinplot(data=self.seacr_beds, x="group", y="peak_width", hue="replicate", palette = "viridis")
+        width_hist = self.seacr_beds.groupby(['group','replicate','peak_width'], sort=False).size().reset_index(name='peaks')
+        histogram_violin(ax, width_hist, x="group", hue="replicate", value="peak_width", weight="peaks", palette = "viridis")
         ax.set_ylabel("Peak Width")
         fig.suptitle("Peak Width Distribution")
 
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import zlib
+import numpy as np
+
+# Fragments kept per sample for fragment level plots and tables
+DEFAULT_SAMPLE_SIZE = 200000
+
+DEFAULT_SEED = 0
+
+# Changed whenever priorities are computed differently, so stored samples drawn the old way are not reused
+PRIORITY_VERSION = 2
+
+#*
+#========================================================================================
+# PRIORITIES
+#========================================================================================
+#*/
+
+def mix64(x):
+    # splitmix64 finaliser, spreads any uint64 key over the whole range
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+def name_hashes(names, seed=DEFAULT_SEED):
+    # Seeded hash of each name, so priorities do not depend on how names were coded
+    return mix64(np.array([zlib.crc32(name.encode()) for name in names], dtype=np.uint64) ^ mix64(np.uint64(seed)))
+
+def occurrence_ranks(chrom, start, end):
+    # Rank of each interval among the identical intervals before it, 0 for the first copy.
+    # The ranks of a group of identical intervals are 0..n-1 in any order they are given in.
+    order = np.lexsort((end, start, chrom))
+    keys = np.stack([np.asarray(chrom)[order], np.asarray(start)[order], np.asarray(end)[order]])
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = np.any(keys[:, 1:] != keys[:, :-1], axis=0)
+    positions = np.arange(len(order))
+    group_start = np.maximum.accumulate(np.where(new_group, positions, 0))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = positions - group_start
+    return ranks
+
+def interval_priorities(name_hash, start, end, rank=0):
+    # Sampling priority of each interval from its coordinates and occurrence rank, the same in any shard
+    # or read order. Identical intervals get their own priorities through their ranks.
+    keys = np.asarray(start, dtype=np.int64).astype(np.uint64) << np.uint64(32) | np.asarray(end, dtype=np.int64).astype(np.uint64)
+    return mix64(mix64(keys ^ np.asarray(name_hash, dtype=np.uint64)) ^ np.asarray(rank, dtype=np.int64).astype(np.uint64))
+
+#*
+#========================================================================================
+# BOTTOM-K SAMPLING
+#========================================================================================
+#*/
+
+def bottom_k(priority, size):
+    # Sorted positions of the size lowest priorities, a uniform sample without replacement.
+    # Samples of disjoint parts merge into the sample of the whole by taking the bottom-k of their union.
+    if len(priority) <= size:
+        return np.arange(len(priority))
+    if size <= 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.sort(np.argpartition(priority, size - 1)[:size])
@@ -7,8 +7,25 @@ from __future__ import print_function
 
 import argparse
 import logging
+import os
+import sys
 
-from lib.reports import Reports
+from lib.reports import Reports, SECTIONS
+from lib.fragments import MAX_MATE_BUFFER
+from lib.fragment_cache import FragmentCache
+from lib.bin_store import DEFAULT_RESOLUTIONS
+from lib.profiling import StageProfiler
+from lib.sampling import DEFAULT_SAMPLE_SIZE, DEFAULT_SEED
+from lib.partials import PartialStore
+
+# Command line argument for each input path used by the report
+INPUT_ARGS = {
+    'meta_path': 'meta',
+    'raw_frag_path': 'raw_frag',
+    'bin_frag_path': 'bin_frag',
+    'seacr_bed_path': 'seacr_bed',
+    'bam_path': 'bams'
+}
 
 def init_logger(app_name, log_file = None):
     logger = logging.getLogger(app_name)
@@ -36,10 +53,41 @@ def gen_png(parsed_args):
     bin_frag_path = parsed_args.bin_frag
     seacr_bed_path = parsed_args.seacr_bed
     bams_path = parsed_args.bams
+    mate_buffer = parsed_args.mate_buffer
+    tmp_dir = parsed_args.tmp_dir
+    threads = parsed_args.threads
+    shard_size = parsed_args.shard_size
+    bin_resolutions = [int(res) for res in parsed_args.bin_resolutions.split(',')]
+    cache = None
+    if parsed_args.cache_dir:
+        cache = FragmentCache(parsed_args.cache_dir, int(parsed_args.cache_max_gb * (1 << 30)))
+    partials = None
+    if parsed_args.partials_dir:
+        partials = PartialStore(parsed_args.partials_dir)
+
+    profiler = StageProfiler(logger, parsed_args.trace_malloc)
 
     logger.info('Generating plots to output folder')
-    fig = Reports(logger, meta_path, frag_path, bin_frag_path, seacr_bed_path, bams_path)
-    fig.gen_plots_to_folder(output_path)
+    fig = Reports(logger, meta_path, frag_path, bin_frag_path, seacr_bed_path, bams_path, mate_buffer, tmp_dir, threads, shard_size, cache, parsed_args.frip_mode, parsed_args.frip_validate,
+        parsed_args.bin_store, bin_resolutions, parsed_args.heatmap_resolution, profiler, parsed_args.frag_sample_size, parsed_args.seed, partials)
+    # Only the inputs the selected sections depend on are needed
+    sections = [section.strip() for section in parsed_args.sections.split(',') if section.strip()]
+    unknown = [section for section in sections if section not in SECTIONS]
+    if unknown:
+        logger.error('Unknown report sections: %s', ', '.join(unknown))
+        sys.exit(1)
+
+    missing = fig.missing_inputs(sections)
+    if missing:
+        logger.error('Missing inputs for the selected sections: %s', ', '.join('--' + INPUT_ARGS[attr] for attr in missing))
+        sys.exit(1)
+
+    fig.gen_plots_to_folder(output_path, sections)
+
+    # Stage timings and memory for finding slow or memory hungry steps
+    if parsed_args.profile:
+        profiler.write_json(os.path.join(output_path, 'reporting_profile.json'))
+        profiler.write_multiqc(os.path.join(output_path, 'reporting_profile_mqc.tsv'))
 
     logger.info('Completed')
 
@@ -52,12 +100,29 @@ if __name__ == '__main__':
     parser_genimg = subparsers.add_parser('gen_reports')
     parser_genimg.set_defaults(func=gen_png)
     parser_genimg.add_argument('--log', required=False)
-    parser_genimg.add_argument('--meta', required=True)
-    parser_genimg.add_argument('--raw_frag', required=True)
-    parser_genimg.add_argument('--bin_frag', required=True)
-    parser_genimg.add_argument('--seacr_bed', required=True)
+    parser_genimg.add_argument('--meta', required=False)
+    parser_genimg.add_argument('--raw_frag', required=False)
+    parser_genimg.add_argument('--bin_frag', required=False)
+    parser_genimg.add_argument('--seacr_bed', required=False)
     parser_genimg.add_argument('--output', required=True)
-    parser_genimg.add_argument('--bams', required=True)
+    parser_genimg.add_argument('--bams', required=False)
+    parser_genimg.add_argument('--mate_buffer', required=False, type=int, default=MAX_MATE_BUFFER)
+    parser_genimg.add_argument('--tmp_dir', required=False)
+    parser_genimg.add_argument('--threads', '--workers', dest='threads', required=False, type=int, default=1)
+    parser_genimg.add_argument('--shard_size', required=False, type=int)
+    parser_genimg.add_argument('--cache_dir', required=False)
+    parser_genimg.add_argument('--cache_max_gb', required=False, type=float, default=50)
+    parser_genimg.add_argument('--partials_dir', required=False, help='folder of per sample partial results reused by later runs')
+    parser_genimg.add_argument('--frip_mode', required=False, choices=['scan', 'index'], default='scan')
+    parser_genimg.add_argument('--frip_validate', required=False, action='store_true')
+    parser_genimg.add_argument('--bin_store', required=False)
+    parser_genimg.add_argument('--bin_resolutions', required=False, default=','.join(str(res) for res in DEFAULT_RESOLUTIONS))
+    parser_genimg.add_argument('--heatmap_resolution', required=False, type=int, default=500)
+    parser_genimg.add_argument('--frag_sample_size', required=False, type=int, default=DEFAULT_SAMPLE_SIZE, help='fragments sampled per sample for fragment level outputs')
+    parser_genimg.add_argument('--seed', required=False, type=int, default=DEFAULT_SEED)
+    parser_genimg.add_argument('--profile', required=False, action='store_true')
+    parser_genimg.add_argument('--trace_malloc', required=False, action='store_true')
+    parser_genimg.add_argument('--sections', required=False, default=','.join(SECTIONS), help='comma separated report sections: ' + ', '.join(SECTIONS))
 
     # Parse
     parsed_args = parser.parse_args()
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Benchmarks of the python reporting and fragment scripts on synthetic datasets.
+
+Every benchmark runs in a fresh subprocess so peak memory is measured per run.
+Results are appended to a csv with the commit they were measured on, and a
+run can be compared against an earlier results file to flag regressions.
+
+Example:
+    python dev/benchmarks/run_benchmarks.py --samples 2,8 --depths 100000,1000000 --output bench.csv
+    python dev/benchmarks/run_benchmarks.py --samples 2,8 --depths 100000,1000000 --compare baseline.csv
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import logging
+import argparse
+import resource
+import subprocess
+import statistics
+
+import synthetic
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(BENCH_DIR))
+BIN_DIR = os.path.join(REPO_DIR, "bin")
+
+BENCHMARKS = ["load_data", "generate_plots", "bam_to_fragments", "bin_fragments", "fragment_coverage", "consensus_merge", "consensus_peaks", "check_samplesheet"]
+FIELDS = ["benchmark", "samples", "depth", "threads", "repeat", "wall_s", "cpu_s", "load_s", "peak_rss_mb", "commit"]
+
+#*
+#========================================================================================
+# TASKS
+#========================================================================================
+#*/
+
+def reports(data_dir, threads):
+    # Reports over a synthetic dataset, with the same inputs GENERATE_REPORTS passes
+    sys.path.insert(0, BIN_DIR)
+    from lib.reports import Reports
+    from lib.profiling import StageProfiler
+
+    logger = logging.getLogger("benchmark")
+    logger.addHandler(logging.NullHandler())
+    profiler = StageProfiler(logger)
+    report = Reports(logger,
+                     os.path.join(data_dir, "meta_table.csv"),
+                     os.path.join(data_dir, "*.frag_len.txt"),
+                     os.path.join(data_dir, "*.frags.bin500.awk.bed"),
+                     os.path.join(data_dir, "*.peaks.bed.stringent.bed"),
+                     os.path.join(data_dir, "*.bam"),
+                     tmp_dir=os.path.join(data_dir, "tmp"), threads=threads, profiler=profiler)
+    return report, profiler
+
+def task_load_data(data_dir, threads):
+    report, _ = reports(data_dir, threads)
+    report.load_data()
+    return {}
+
+def task_generate_plots(data_dir, threads):
+    # Load time is taken from the profiler so plotting can be told apart from parsing
+    report, profiler = reports(data_dir, threads)
+    report.generate_plots()
+    return {"load_s": round(sum(record["wall_s"] for record in profiler.records if record["stage"].startswith("load_")), 3)}
+
+def task_script(args):
+    subprocess.run([sys.executable] + args, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return {}
+
+def output_dir(data_dir, name):
+    out_dir = os.path.join(data_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+    return out_dir
+
+def sample_ids(data_dir):
+    return [os.path.basename(path).split(".")[0] for path in sorted(glob.glob(os.path.join(data_dir, "*.bam")))]
+
+def task_bam_to_fragments(data_dir, threads):
+    # BAM_TO_FRAGMENTS on every sample in turn
+    out_dir = output_dir(data_dir, "fragments_out")
+    for sample_id in sample_ids(data_dir):
+        task_script([os.path.join(BIN_DIR, "bam_to_fragments.py"), "--bam", os.path.join(data_dir, sample_id + ".target.markdup.sorted.bam"),
+                     "--bed", os.path.join(out_dir, sample_id + ".frags.cut.bed"), "--frag_len", os.path.join(out_dir, sample_id + ".frag_len.txt"),
+                     "--threads", str(threads), "--tmp_dir", out_dir])
+    return {}
+
+def task_bin_fragments(data_dir, threads):
+    out_dir = output_dir(data_dir, "bins_out")
+    for sample_id in sample_ids(data_dir):
+        task_script([os.path.join(BIN_DIR, "bin_fragments.py"), "--bed", os.path.join(data_dir, sample_id + ".frags.cut.bed"),
+                     "--chrom_sizes", os.path.join(data_dir, "genome.sizes"), "--prefix", os.path.join(out_dir, sample_id + ".frags")])
+    return {}
+
+def task_fragment_coverage(data_dir, threads):
+    out_dir = output_dir(data_dir, "coverage_out")
+    for sample_id in sample_ids(data_dir):
+        task_script([os.path.join(BIN_DIR, "fragment_coverage.py"), "--bam", os.path.join(data_dir, sample_id + ".target.markdup.sorted.bam"),
+                     "--output", os.path.join(out_dir, sample_id + ".bedGraph"), "--threads", str(threads), "--tmp_dir", out_dir])
+    return {}
+
+def task_consensus_merge(data_dir, threads):
+    # CONSENSUS_MERGE once per group, as CONSENSUS_PEAKS runs it
+    out_dir = output_dir(data_dir, "consensus_merge_out")
+    for group in sorted(set(sample_id.rsplit("_", 1)[0] for sample_id in sample_ids(data_dir))):
+        task_script([os.path.join(BIN_DIR, "consensus_merge.py"), "--peaks", os.path.join(data_dir, group + "_*.peaks.bed.stringent.bed"),
+                     "--prefix", os.path.join(out_dir, group)])
+    return {}
+
+def task_consensus_peaks(data_dir, threads):
+    out_dir = output_dir(data_dir, "consensus_out")
+    return task_script([os.path.join(BIN_DIR, "consensus_peaks.py"), "--peaks", os.path.join(data_dir, "*.consensus.peaks.bed"), "--outpath", out_dir])
+
+def task_check_samplesheet(data_dir, threads):
+    return task_script([os.path.join(BIN_DIR, "check_samplesheet.py"), os.path.join(data_dir, "samplesheet.csv"), os.path.join(data_dir, "samplesheet.valid.csv"), "true"])
+
+TASKS = {
+    "load_data": task_load_data,
+    "generate_plots": task_generate_plots,
+    "bam_to_fragments": task_bam_to_fragments,
+    "bin_fragments": task_bin_fragments,
+    "fragment_coverage": task_fragment_coverage,
+    "consensus_merge": task_consensus_merge,
+    "consensus_peaks": task_consensus_peaks,
+    "check_samplesheet": task_check_samplesheet
+}
+
+def run_task(name, data_dir, threads):
+    # Worker mode: time one benchmark in this process and print the result as json
+    import matplotlib
+    matplotlib.use("Agg")
+    wall_start = time.perf_counter()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    result = TASKS[name](data_dir, threads)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result["wall_s"] = round(time.perf_counter() - wall_start, 3)
+    result["cpu_s"] = round(usage.ru_utime + usage.ru_stime - usage_start.ru_utime - usage_start.ru_stime + children.ru_utime + children.ru_stime, 3)
+    print(json.dumps(result))
+
+#*
+#========================================================================================
+# RUNNER
+#========================================================================================
+#*/
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def dataset(data_root, samples, depth, seed):
+    # Generated datasets are cached by their parameters, as generation dominates small runs
+    data_dir = os.path.join(data_root, "s%d_d%d_seed%d" % (samples, depth, seed))
+    if not os.path.isfile(os.path.join(data_dir, "genome.sizes")):
+        print("Generating %d samples at depth %d in %s" % (samples, depth, data_dir), file=sys.stderr)
+        synthetic.generate(data_dir, samples=samples, depth=depth, seed=seed)
+    return data_dir
+
+def measure(name, data_dir, threads):
+    # Run one benchmark in a subprocess; peak rss covers the worker and anything it spawned
+    cmd = [sys.executable, os.path.abspath(__file__), "task", name, data_dir, "--threads", str(threads)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=dict(os.environ, MPLBACKEND="Agg"))
+    out = proc.stdout.read()
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8
+    if proc.returncode != 0:
+        raise RuntimeError("Benchmark %s failed on %s" % (name, data_dir))
+
+    result = json.loads(out.decode().strip().splitlines()[-1])
+    result["peak_rss_mb"] = round(usage.ru_maxrss / 1024, 1)
+    return result
+
+def run(args):
+    commit = git_commit()
+    rows = list()
+    for samples in args.samples:
+        for depth in args.depths:
+            data_dir = dataset(args.data_dir, samples, depth, args.seed)
+            for name in args.benchmarks:
+                for repeat in range(args.repeats):
+                    result = measure(name, data_dir, args.threads)
+                    row = {"benchmark": name, "samples": samples, "depth": depth, "threads": args.threads, "repeat": repeat,
+                           "load_s": result.get("load_s", ""), "commit": commit}
+                    row.update({key: result[key] for key in ("wall_s", "cpu_s", "peak_rss_mb")})
+                    print("%-18s samples=%-4d depth=%-10d wall=%7.2fs cpu=%7.2fs rss=%7.0f MB" % (name, samples, depth, row["wall_s"], row["cpu_s"], row["peak_rss_mb"]), file=sys.stderr)
+                    rows.append(row)
+    return rows
+
+#*
+#========================================================================================
+# RESULTS
+#========================================================================================
+#*/
+
+def write_rows(path, rows):
+    # Append to the results csv so runs on several commits can be kept together
+    exists = os.path.isfile(path)
+    with open(path, "a", newline="") as fout:
+        writer = csv.DictWriter(fout, fieldnames=FIELDS)
+        if not exists:
+            writer.writeheader()
+        writer.writerows(rows)
+
+def read_rows(path):
+    with open(path, newline="") as fin:
+        return list(csv.DictReader(fin))
+
+def medians(rows, metric):
+    # Median of a metric over repeats, keyed by (benchmark, samples, depth, threads)
+    groups = dict()
+    for row in rows:
+        key = (row["benchmark"], int(row["samples"]), int(row["depth"]), int(row["threads"]))
+        groups.setdefault(key, list()).append(float(row[metric]))
+    return {key: statistics.median(values) for key, values in groups.items()}
+
+def print_scaling(rows, metric):
+    # One table per benchmark: sample counts down, depths across
+    table = medians(rows, metric)
+    for name in sorted(set(key[0] for key in table)):
+        keys = [key for key in table if key[0] == name]
+        depths = sorted(set(key[2] for key in keys))
+        threads = keys[0][3]
+        print("\n%s (%s)" % (name, metric))
+        print("samples".rjust(8) + "".join(("depth %d" % depth).rjust(18) for depth in depths))
+        for samples in sorted(set(key[1] for key in keys)):
+            cells = [table.get((name, samples, depth, threads)) for depth in depths]
+            print(str(samples).rjust(8) + "".join(("%.2f" % cell if cell is not None else "-").rjust(18) for cell in cells))
+
+def compare(rows, baseline_rows, tolerance):
+    # Ratio of current to baseline medians; True if any benchmark is slower or larger than the tolerance allows
+    regressed = False
+    print("\n%-18s %8s %10s %10s %10s" % ("benchmark", "samples", "depth", "wall", "rss"))
+    wall, base_wall = medians(rows, "wall_s"), medians(baseline_rows, "wall_s")
+    rss, base_rss = medians(rows, "peak_rss_mb"), medians(baseline_rows, "peak_rss_mb")
+    for key in sorted(wall):
+        if key not in base_wall:
+            continue
+        wall_ratio = wall[key] / max(base_wall[key], 1e-6)
+        rss_ratio = rss[key] / max(base_rss[key], 1e-6)
+        flag = ""
+        if wall_ratio > tolerance or rss_ratio > tolerance:
+            flag = "  REGRESSION"
+            regressed = True
+        print("%-18s %8d %10d %9.2fx %9.2fx%s" % (key[0], key[1], key[2], wall_ratio, rss_ratio, flag))
+    return regressed
+
+def int_list(value):
+    return [int(item) for item in value.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the reporting scripts on synthetic CUT&RUN data.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    parser_task = subparsers.add_parser("task", help="run a single benchmark in this process (used internally)")
+    parser_task.add_argument("name", choices=BENCHMARKS)
+    parser_task.add_argument("data_dir")
+    parser_task.add_argument("--threads", type=int, default=1)
+
+    parser.add_argument("--samples", type=int_list, default=[2, 8], help="comma separated sample counts")
+    parser.add_argument("--depths", type=int_list, default=[100000, 1000000], help="comma separated fragments per sample")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma separated benchmarks: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data_dir", default=os.path.join(REPO_DIR, "bench_data"), help="cache of generated datasets")
+    parser.add_argument("--output", default=os.path.join(REPO_DIR, "bench_results.csv"))
+    parser.add_argument("--compare", help="results csv of a baseline run to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="ratio to the baseline above which a run is a regression")
+    args = parser.parse_args()
+
+    if args.command == "task":
+        run_task(args.name, args.data_dir, args.threads)
+        return
+
+    args.benchmarks = [name.strip() for name in args.benchmarks.split(",") if name.strip()]
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(unknown))
+
+    rows = run(args)
+    write_rows(args.output, rows)
+    print_scaling(rows, "wall_s")
+    print_scaling(rows, "peak_rss_mb")
+
+    if args.compare and compare(rows, read_rows(args.compare), args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+"""
+Deterministic synthetic CUT&RUN inputs for benchmarking the reporting scripts.
+
+Writes, for every sample, the files GENERATE_REPORTS, the fragment, coverage
+and consensus peak steps consume, with the same names and formats the pipeline
+produces: coordinate sorted and indexed bams, *.frags.cut.bed, *.frag_len.txt,
+*.frags.bin500.awk.bed, SEACR *.peaks.bed.stringent.bed, per group
+*.consensus.peaks.bed, a meta_table.csv with the EXPORT_META columns, a
+samplesheet.csv and the genome.sizes chromosome sizes.
+"""
+
+import os
+import re
+import argparse
+import tempfile
+import numpy as np
+import pysam
+
+READ_LEN = 40
+BIN_WIDTH = 500
+MAX_FRAG_LEN = 1000
+
+#*
+#========================================================================================
+# GENOME AND PEAKS
+#========================================================================================
+#*/
+
+def make_genome(genome_size, n_chroms):
+    # Chromosomes named chr1..chrN with lengths decreasing like a real karyotype
+    weights = np.linspace(2.0, 1.0, n_chroms)
+    lengths = (weights / weights.sum() * genome_size).astype(np.int64)
+    return [("chr%d" % (i + 1), int(length)) for i, length in enumerate(lengths)]
+
+def make_peak_sites(rng, genome, n_peaks):
+    # Shared peak centres for a group, spread over chromosomes by length
+    lengths = np.array([length for _, length in genome], dtype=np.float64)
+    chrom_idx = rng.choice(len(genome), size=n_peaks, p=lengths / lengths.sum())
+    centres = (rng.random(n_peaks) * (lengths[chrom_idx] - 2 * MAX_FRAG_LEN) + MAX_FRAG_LEN).astype(np.int64)
+    order = np.lexsort((centres, chrom_idx))
+    return chrom_idx[order], centres[order]
+
+def sample_frag_lengths(rng, n, modes, sd, weights):
+    # Mixture of normals around nucleosome ladder modes, clipped to the range the pipeline keeps
+    component = rng.choice(len(modes), size=n, p=weights)
+    lengths = rng.normal(np.asarray(modes)[component], sd)
+    return np.clip(np.rint(lengths), READ_LEN, MAX_FRAG_LEN - 1).astype(np.int64)
+
+def sample_fragments(rng, genome, sites, depth, frip, modes, sd, weights):
+    # Fragment chrom index, start and length; a frip fraction is centred around the peak sites
+    site_chrom, site_centre = sites
+    lengths = np.array([length for _, length in genome], dtype=np.float64)
+    frag_len = sample_frag_lengths(rng, depth, modes, sd, weights)
+
+    in_peak = rng.random(depth) < frip
+    chrom = rng.choice(len(genome), size=depth, p=lengths / lengths.sum())
+    start = (rng.random(depth) * (lengths[chrom] - frag_len)).astype(np.int64)
+
+    picks = rng.integers(0, len(site_chrom), size=int(in_peak.sum()))
+    chrom[in_peak] = site_chrom[picks]
+    start[in_peak] = site_centre[picks] + rng.normal(0, 150, size=len(picks)).astype(np.int64) - frag_len[in_peak] // 2
+    start = np.clip(start, 0, (lengths[chrom] - frag_len).astype(np.int64))
+    return chrom, start, frag_len
+
+#*
+#========================================================================================
+# WRITERS
+#========================================================================================
+#*/
+
+def write_bam(path, genome, sample_id, chrom, start, frag_len, dup_rate, rng):
+    # Properly paired reads written as sam text, then sorted and indexed with samtools
+    duplicate = rng.random(len(chrom)) < dup_rate
+    seq = "A" * READ_LEN
+    qual = "I" * READ_LEN
+    tmp_sam = tempfile.NamedTemporaryFile("w", suffix=".sam", dir=os.path.dirname(path), delete=False)
+    with tmp_sam as fout:
+        fout.write("@HD\tVN:1.6\tSO:unsorted\n")
+        for name, length in genome:
+            fout.write("@SQ\tSN:%s\tLN:%d\n" % (name, length))
+        for i in range(len(chrom)):
+            name = genome[chrom[i]][0]
+            left = int(start[i])
+            right = left + int(frag_len[i]) - READ_LEN
+            dup_flag = 1024 if duplicate[i] else 0
+            fout.write("%s_%d\t%d\t%s\t%d\t40\t%dM\t=\t%d\t%d\t%s\t%s\n" % (sample_id, i, 99 | dup_flag, name, left + 1, READ_LEN, right + 1, frag_len[i], seq, qual))
+            fout.write("%s_%d\t%d\t%s\t%d\t40\t%dM\t=\t%d\t%d\t%s\t%s\n" % (sample_id, i, 147 | dup_flag, name, right + 1, READ_LEN, left + 1, -frag_len[i], seq, qual))
+
+    pysam.sort("-o", path, tmp_sam.name)
+    pysam.index(path)
+    os.remove(tmp_sam.name)
+
+def write_frag_len(path, frag_len, single_mate_rate=0.0, rng=None):
+    # abs(tlen) of both mates, sorted as text, counted and halved as the samtools_frag_len step does.
+    # Pairs losing one mate (as to a MAPQ filter) leave odd read counts, printed as awk does: 12.5
+    reads = np.full(len(frag_len), 2)
+    if single_mate_rate > 0:
+        reads -= rng.random(len(frag_len)) < single_mate_rate
+    sizes, inverse = np.unique(frag_len, return_inverse=True)
+    counts = np.bincount(inverse, weights=reads, minlength=len(sizes))
+    order = np.argsort(sizes.astype(str))
+    with open(path, "w") as fout:
+        for size, count in zip(sizes[order], counts[order]):
+            fout.write("%d\t%.6g\n" % (size, count / 2))
+
+def natural_key(chrom):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", chrom)]
+
+def write_fragment_bed(path, genome, chrom, start, frag_len):
+    # Every fragment, duplicates included, as chrom, start, end sorted -k1,1 -k2,2n -k3,3n as BAM_TO_FRAGMENTS writes them
+    end = start + frag_len
+    with open(path, "w") as fout:
+        for c in sorted(range(len(genome)), key=lambda c: genome[c][0]):
+            on_chrom = chrom == c
+            order = np.lexsort((end[on_chrom], start[on_chrom]))
+            name = genome[c][0]
+            fout.writelines("%s\t%d\t%d\n" % (name, s, e) for s, e in zip(start[on_chrom][order].tolist(), end[on_chrom][order].tolist()))
+
+def write_chrom_sizes(path, genome):
+    with open(path, "w") as fout:
+        fout.writelines("%s\t%d\n" % (name, length) for name, length in genome)
+
+def write_bins(path, genome, sample_id, chrom, start, frag_len):
+    # Fragment midpoints counted in 500 bp bins labelled by their centre, sorted -k1,1V -k2,2n
+    bins = ((start + start + frag_len) // (2 * BIN_WIDTH)) * BIN_WIDTH + BIN_WIDTH // 2
+    with open(path, "w") as fout:
+        for c in sorted(range(len(genome)), key=lambda c: natural_key(genome[c][0])):
+            chrom_bins, counts = np.unique(bins[chrom == c], return_counts=True)
+            for b, count in zip(chrom_bins, counts):
+                fout.write("%s\t%d\t%d\t%s.frags.cut.bed\n" % (genome[c][0], b, count, sample_id))
+
+def write_peaks(path, rng, genome, sites, keep_rate):
+    # SEACR stringent peaks: chrom, start, end, total signal, max signal, max signal region
+    site_chrom, site_centre = sites
+    keep = rng.random(len(site_chrom)) < keep_rate
+    widths = rng.integers(200, 3000, size=len(site_chrom))
+    starts = np.maximum(site_centre + rng.integers(-200, 200, size=len(site_chrom)) - widths // 2, 0)
+    rows = list()
+    for c, s, w in zip(site_chrom[keep], starts[keep], widths[keep]):
+        name = genome[c][0]
+        total = rng.random() * 1000
+        peak = s + int(rng.integers(0, w))
+        rows.append((name, int(s), int(s + w), total, total / 20, "%s:%d-%d" % (name, peak, peak + 50)))
+    rows.sort()
+    with open(path, "w") as fout:
+        for row in rows:
+            fout.write("%s\t%d\t%d\t%.2f\t%.2f\t%s\n" % row)
+    return rows
+
+def write_consensus(path, peak_sets):
+    # Emulates sort -k1,1 -k2,2n | bedtools merge -c 2,3,4,5,6,7,7 -o collapse x6,count_distinct
+    rows = sorted((row[0], row[1], row[2]) + row[3:] + (name,) for name, peaks in peak_sets for row in peaks)
+    merged = list()
+    for row in rows:
+        if merged and merged[-1][0] == row[0] and row[1] <= merged[-1][2]:
+            merged[-1][2] = max(merged[-1][2], row[2])
+            merged[-1][3].append(row)
+        else:
+            merged.append([row[0], row[1], row[2], [row]])
+
+    with open(path, "w") as fout:
+        for chrom, start, end, members in merged:
+            cols = [",".join(str(m[k]) if k < 3 or k == 5 or k == 6 else "%.2f" % m[k] for m in members) for k in range(1, 7)]
+            fout.write("\t".join([chrom, str(start), str(end)] + cols + [str(len(set(m[6] for m in members)))]) + "\n")
+
+def meta_row(sample_id, group, replicate, depth, dup_rate, rng):
+    # One EXPORT_META row: sample meta, bowtie2 target/spike-in summaries, picard metrics and scale factor
+    aligned = int(depth * 0.95)
+    spikein = int(rng.integers(1000, 5000))
+    duplicates = int(depth * dup_rate)
+    row = {
+        'id': sample_id, 'group': group, 'replicate': replicate, 'single_end': 'false',
+        'bt2_total_reads_target': depth, 'bt2_align1_target': int(aligned * 0.9), 'bt2_align_gt1_target': aligned - int(aligned * 0.9),
+        'bt2_non_aligned_target': depth - aligned, 'bt2_total_aligned_target': aligned,
+        'bt2_total_reads_spikein': depth, 'bt2_align1_spikein': spikein, 'bt2_align_gt1_spikein': 0,
+        'bt2_non_aligned_spikein': depth - spikein, 'bt2_total_aligned_spikein': spikein,
+        'dedup_library': 'unknown library', 'dedup_unpaired_reads_examined': 0, 'dedup_read_pairs_examined': aligned,
+        'dedup_secondary_or_supplementary_rds': 0, 'dedup_unmapped_reads': 0, 'dedup_unpaired_read_duplicates': 0,
+        'dedup_read_pair_duplicates': duplicates, 'dedup_read_pair_optical_duplicates': 0,
+        'dedup_percent_duplication': round(duplicates / max(aligned, 1), 6),
+        'dedup_estimated_library_size': int(aligned / max(dup_rate, 1e-3)),
+        'scale_factor': round(10000 / spikein, 6)
+    }
+    return row
+
+#*
+#========================================================================================
+# DATASET
+#========================================================================================
+#*/
+
+def generate(outdir, samples=4, replicates=2, depth=100000, genome_size=10000000, n_chroms=5, n_peaks=2000,
+             frip=0.3, dup_rate=0.05, frag_modes=(170, 340), frag_sd=30, frag_weights=(0.8, 0.2), seed=1, single_mate_rate=0.01):
+    # Write a complete dataset to outdir. The same arguments always give byte-identical text files.
+    os.makedirs(outdir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    genome = make_genome(genome_size, n_chroms)
+    weights = np.asarray(frag_weights, dtype=np.float64)
+    weights = weights / weights.sum()
+
+    groups = ["group%d" % (g + 1) for g in range(int(np.ceil(samples / replicates)))]
+    group_sites = {group: make_peak_sites(rng, genome, n_peaks) for group in groups}
+    meta = list()
+    peak_sets = {group: list() for group in groups}
+    sheet = ["group,replicate,control_group,fastq_1,fastq_2"]
+
+    for k in range(samples):
+        group = groups[k // replicates]
+        replicate = k % replicates + 1
+        sample_id = "%s_R%d" % (group, replicate)
+        sites = group_sites[group]
+
+        chrom, start, frag_len = sample_fragments(rng, genome, sites, depth, frip, frag_modes, frag_sd, weights)
+        write_bam(os.path.join(outdir, sample_id + ".target.markdup.sorted.bam"), genome, sample_id, chrom, start, frag_len, dup_rate, rng)
+        write_fragment_bed(os.path.join(outdir, sample_id + ".frags.cut.bed"), genome, chrom, start, frag_len)
+        # Own generator so the mate drops leave the other files as they were
+        write_frag_len(os.path.join(outdir, sample_id + ".frag_len.txt"), frag_len, single_mate_rate, np.random.default_rng([seed, k]))
+        write_bins(os.path.join(outdir, sample_id + ".frags.bin500.awk.bed"), genome, sample_id, chrom, start, frag_len)
+        peaks_name = sample_id + ".peaks.bed.stringent.bed"
+        peak_sets[group].append((peaks_name, write_peaks(os.path.join(outdir, peaks_name), rng, genome, sites, 0.8)))
+
+        meta.append(meta_row(sample_id, group, replicate, depth, dup_rate, rng))
+        sheet.append("%s,%d,1,%s_1.fastq.gz,%s_2.fastq.gz" % (group, replicate, sample_id, sample_id))
+
+    for group in groups:
+        write_consensus(os.path.join(outdir, group + ".consensus.peaks.bed"), peak_sets[group])
+
+    # IgG controls so the samplesheet validates with --igg_control true
+    for replicate in range(1, replicates + 1):
+        sheet.append("igg,%d,%d,igg_R%d_1.fastq.gz,igg_R%d_2.fastq.gz" % (replicate, replicate, replicate, replicate))
+
+    columns = list(meta[0].keys())
+    with open(os.path.join(outdir, "meta_table.csv"), "w") as fout:
+        fout.write(",".join(columns) + "\n")
+        for row in meta:
+            fout.write(",".join(str(row[col]) for col in columns) + "\n")
+    with open(os.path.join(outdir, "samplesheet.csv"), "w") as fout:
+        fout.write("\n".join(sheet) + "\n")
+
+    # Written last, a dataset holding it is complete
+    write_chrom_sizes(os.path.join(outdir, "genome.sizes"), genome)
+
+def parse_list(value, cast):
+    return [cast(item) for item in value.split(",")]
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic CUT&RUN reporting dataset.")
+    parser.add_argument("--outdir", required=True)
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--replicates", type=int, default=2, help="Replicates per group")
+    parser.add_argument("--depth", type=int, default=100000, help="Fragments per sample")
+    parser.add_argument("--genome_size", type=int, default=10000000)
+    parser.add_argument("--chroms", type=int, default=5)
+    parser.add_argument("--peaks", type=int, default=2000, help="Peak sites per group")
+    parser.add_argument("--frip", type=float, default=0.3, help="Fraction of fragments drawn around peaks")
+    parser.add_argument("--dup_rate", type=float, default=0.05)
+    parser.add_argument("--frag_modes", default="170,340", help="Fragment length mixture means")
+    parser.add_argument("--frag_sd", type=float, default=30)
+    parser.add_argument("--frag_weights", default="0.8,0.2", help="Fragment length mixture weights")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--single_mate_rate", type=float, default=0.01, help="Fraction of pairs with one mate filtered out, giving half counts in *.frag_len.txt")
+    args = parser.parse_args()
+
+    generate(args.outdir, args.samples, args.replicates, args.depth, args.genome_size, args.chroms, args.peaks,
+             args.frip, args.dup_rate, parse_list(args.frag_modes, float), args.frag_sd, parse_list(args.frag_weights, float), args.seed, args.single_mate_rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+include { initOptions; saveFiles; getSoftwareName } from './functions'
+
+params.options = [:]
+options        = initOptions(params.options)
+
+process BAM_TO_FRAGMENTS {
+    tag "$meta.id"
+    label 'process_medium'
+    publishDir "${params.outdir}",
+        mode: params.publish_dir_mode,
+        saveAs: { filename -> saveFiles(filename:filename, options:params.options, publish_dir:getSoftwareName(task.process), publish_id:'') }
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::numpy=1.20.* conda-forge::pandas=1.2.* bioconda::pysam=0.16.0.1" : null)
+    container "luslab/cutandrun-dev-reporting:1.0"
+
+    input:
+    tuple val(meta), path(bam)
+
+    output:
+    tuple val(meta), path("*.frags.cut.bed"), emit: bed
+    tuple val(meta), path("*.frag_len.txt"),  emit: frag_len
+    path  "*.version.txt",                    emit: version
+
+    script:
+    """
+    bam_to_fragments.py \\
+        --bam $bam \\
+        --bed ${meta.id}.frags.cut.bed \\
+        --frag_len ${meta.id}.frag_len.txt \\
+        --threads $task.cpus \\
+        --tmp_dir . \\
+        $options.args
+
+    python -c "import pysam; print(pysam.__version__)" > pysam.version.txt
+    """
+}
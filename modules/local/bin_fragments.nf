@@ -0,0 +1,32 @@
+include { initOptions; saveFiles; getSoftwareName } from './functions'
+
+params.options = [:]
+options        = initOptions(params.options)
+
+process BIN_FRAGMENTS {
+    tag "$meta.id"
+    label 'process_low'
+    publishDir "${params.outdir}",
+        mode: params.publish_dir_mode,
+        saveAs: { filename -> saveFiles(filename:filename, options:params.options, publish_dir:getSoftwareName(task.process), publish_id:'') }
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::numpy=1.20.* conda-forge::pandas=1.2.*" : null)
+    container "luslab/cutandrun-dev-reporting:1.0"
+
+    input:
+    tuple val(meta), path(bed)
+    path  sizes
+
+    output:
+    tuple val(meta), path("*.bin500.awk.bed"), emit: bin500
+    tuple val(meta), path("*.awk.bed"),        emit: bins
+
+    script:
+    """
+    bin_fragments.py \\
+        --bed $bed \\
+        --chrom_sizes $sizes \\
+        --prefix ${meta.id}.frags \\
+        $options.args
+    """
+}
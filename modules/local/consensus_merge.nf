@@ -0,0 +1,33 @@
+include { initOptions; saveFiles; getSoftwareName } from './functions'
+
+params.options = [:]
+options        = initOptions(params.options)
+
+process CONSENSUS_MERGE {
+    tag "$meta.id"
+    label 'process_low'
+    publishDir "${params.outdir}",
+        mode: params.publish_dir_mode,
+        saveAs: { filename -> saveFiles(filename:filename, options:params.options, publish_dir:getSoftwareName(task.process), publish_id:'') }
+
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::numpy=1.20.*" : null)
+    container "luslab/cutandrun-dev-reporting:1.0"
+
+    input:
+    tuple val(meta), path(beds)
+
+    output:
+    tuple val(meta), path("*.consensus.peaks.bed"),              emit: bed
+    tuple val(meta), path("*.consensus.peaks.filtered.awk.bed"), emit: filtered_bed
+    path  "*.version.txt",                                       emit: version
+
+    script:
+    """
+    consensus_merge.py \\
+        --peaks $beds \\
+        --prefix ${meta.id} \\
+        $options.args
+
+    python --version | grep -E -o \"([0-9]{1,}\\.)+[0-9]{1,}\" > python.version.txt
+    """
+}
@@ -4,35 +4,36 @@ include { initOptions; saveFiles; getSoftwareName } from './functions'
 params.options = [:]
 options        = initOptions(params.options)
 
-process BEDTOOLS_GENOMECOV_SCALE {
+process FRAGMENT_COVERAGE {
     tag "$meta.id"
     label 'process_high'
     publishDir "${params.outdir}",
         mode: params.publish_dir_mode,
         saveAs: { filename -> saveFiles(filename:filename, options:params.options, publish_dir:getSoftwareName(task.process), publish_id:meta.id) }
 
-    conda (params.enable_conda ? "bioconda::bedtools=2.30.0" : null)
-    if (workflow.containerEngine == 'singularity' && !params.singularity_pull_docker_container) {
-        container "https://depot.galaxyproject.org/singularity/bedtools:2.30.0--hc088bd4_0"
-    } else {
-        container "quay.io/biocontainers/bedtools:2.30.0--hc088bd4_0"
-    }
+    conda (params.enable_conda ? "conda-forge::python=3.8.3 conda-forge::numpy=1.20.* conda-forge::pandas=1.2.* bioconda::pysam=0.16.0.1" : null)
+    container "luslab/cutandrun-dev-reporting:1.0"
 
     input:
-    tuple val(meta), path(bam), val(scale)
+    tuple val(meta), path(bam), path(bai), val(scale)
 
     output:
     tuple val(meta), path("*.bedGraph"), emit: bedgraph
     path "*.version.txt"               , emit: version
 
     script:
-    def software = getSoftwareName(task.process)
     def prefix   = options.suffix ? "${meta.id}${options.suffix}" : "${meta.id}"
-
+    def cache    = params.fragment_cache_dir ? "--cache_dir ${file(params.fragment_cache_dir).toAbsolutePath()}" : ''
     """
-    bedtools genomecov -ibam $bam $options.args -bg -scale $scale \\
-    | bedtools sort > ${prefix}.bedGraph
-
-    bedtools --version | sed -e "s/bedtools v//g" > ${software}.version.txt
+    fragment_coverage.py \\
+        --bam $bam \\
+        --scale $scale \\
+        --threads $task.cpus \\
+        --tmp_dir . \\
+        --output ${prefix}.bedGraph \\
+        $cache \\
+        $options.args
+
+    python -c "import pysam; print(pysam.__version__)" > pysam.version.txt
     """
 }
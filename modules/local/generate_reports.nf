@@ -18,16 +18,19 @@ process GENERATE_REPORTS {
     path seacr_beds
     path bam
     path bai
-    path frag_len_header_multiqc
 
     output:
     path '*.pdf',             emit: pdf
     path '*.csv',             emit: csv
     path '*.png',             emit: png
-    path '*frag_len_mqc.yaml', emit: frag_len_multiqc
+    path '*_mqc.{yaml,tsv}', emit: multiqc
+    path 'bin_store',         optional: true, emit: bin_store
+    path 'reporting_profile.json',    emit: profile
     path '*.version.txt',     emit: version
 
     script:  // This script is bundled with the pipeline, in nf-core/cutandrun/bin/
+    def partials = params.report_partials_dir ? "--partials_dir ${file(params.report_partials_dir).toAbsolutePath()}" : ''
+    def cache    = params.fragment_cache_dir ? "--cache_dir ${file(params.fragment_cache_dir).toAbsolutePath()}" : ''
     """
     reporting.py gen_reports \\
         --meta $meta_data \\
@@ -35,12 +38,16 @@ process GENERATE_REPORTS {
         --bin_frag "*bin500.awk.bed" \\
         --seacr_bed "*bed.*.bed" \\
         --bams "*.bam" \\
+        --tmp_dir . \\
+        --threads $task.cpus \\
+        --shard_size 50000000 \\
+        --bin_store bin_store \\
+        --profile \\
+        $partials \\
+        $cache \\
         --output . \\
-        --log log.txt
-
-    if [ -f "03_03_frag_len_mqc.txt" ]; then
-        cat $frag_len_header_multiqc 03_03_frag_len_mqc.txt > frag_len_mqc.yaml
-    fi
+        --log log.txt \\
+        $options.args
 
     python --version | grep -E -o \"([0-9]{1,}\\.)+[0-9]{1,}\" > python.version.txt
     """
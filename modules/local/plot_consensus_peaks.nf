@@ -24,7 +24,9 @@ process PLOT_CONSENSUS_PEAKS {
     """
     consensus_peaks.py \\
         --peaks "*.peaks.bed" \\
-        --outpath .
+        --outpath . \\
+        --threads $task.cpus \\
+        $options.args
 
     python --version | grep -E -o \"([0-9]{1,}\\.)+[0-9]{1,}\" > python.version.txt
     """
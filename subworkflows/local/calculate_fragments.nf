@@ -2,16 +2,12 @@
  * Calculate bed fragments from bam file
  */
 
-params.samtools_options      = [:]
-params.samtools_view_options = [:]
-params.bamtobed_options      = [:]
-params.awk_options           = [:]
-params.cut_options           = [:]
+params.samtools_options         = [:]
+params.samtools_view_options    = [:]
+params.bam_to_fragments_options = [:]
 
 include { SAMTOOLS_VIEW_SORT_STATS } from "./samtools_view_sort_stats"                            addParams( samtools_options: params.samtools_options, samtools_view_options: params.samtools_view_options )
-include { BEDTOOLS_BAMTOBED        } from "../../modules/nf-core/modules/bedtools/bamtobed/main" addParams( options: params.bamtobed_options )
-include { AWK                      } from "../../modules/local/awk"                               addParams( options: params.awk_options      )
-include { CUT                      } from "../../modules/local/cut"                               addParams( options: params.cut_options      )
+include { BAM_TO_FRAGMENTS         } from "../../modules/local/bam_to_fragments"                  addParams( options: params.bam_to_fragments_options )
 
 workflow CALCULATE_FRAGMENTS {
     take:
@@ -22,17 +18,13 @@ workflow CALCULATE_FRAGMENTS {
     // Filter for mapped reads only
     SAMTOOLS_VIEW_SORT_STATS( bam )
 
-    // Convert to bed file
-    BEDTOOLS_BAMTOBED ( SAMTOOLS_VIEW_SORT_STATS.out.bam  )
-
-    // Keep the read pairs that are on the same chromosome and fragment length less than 1000bp.
-    AWK ( BEDTOOLS_BAMTOBED.out.bed  )
-
-    // Only extract the fragment related columns
-    CUT ( AWK.out.file )
+    // Pair mates into a fragment bed of read pairs on the same chromosome and shorter than 1000bp,
+    // and count the fragment lengths, in one pass over the bam
+    BAM_TO_FRAGMENTS ( SAMTOOLS_VIEW_SORT_STATS.out.bam )
 
     emit:
-    bed              = CUT.out.file
+    bed              = BAM_TO_FRAGMENTS.out.bed                // channel: [ val(meta), [ bed ] ]
+    frag_len         = BAM_TO_FRAGMENTS.out.frag_len           // channel: [ val(meta), [ txt ] ]
     mapped_bam       = SAMTOOLS_VIEW_SORT_STATS.out.bam        // channel: [ val(meta), [ bam ] ]
     bai              = SAMTOOLS_VIEW_SORT_STATS.out.bai        // channel: [ val(meta), [ bai ] ]
     stats            = SAMTOOLS_VIEW_SORT_STATS.out.stats      // channel: [ val(meta), [ stats ] ]
@@ -40,6 +32,5 @@ workflow CALCULATE_FRAGMENTS {
     idxstats         = SAMTOOLS_VIEW_SORT_STATS.out.idxstats   // channel: [ val(meta), [ idxstats ] ]
 
     samtools_version = SAMTOOLS_VIEW_SORT_STATS.out.samtools_version //    path: *.version.txt
-    bedtools_version = BEDTOOLS_BAMTOBED.out.version                 //    path: *.version.txt
-    awk_version      = AWK.out.version                               //    path: *.version.txt
+    pysam_version    = BAM_TO_FRAGMENTS.out.version                  //    path: *.version.txt
 }
@@ -2,16 +2,12 @@
  * Create group consensus peaks
  */
 
-params.bedtools_merge_options = [:]
-params.sort_options           = [:]
-params.plot_peak_options      = [:]
-params.awk_threshold_options  = [:]
-params.run_peak_plotting      = true
+params.consensus_merge_options = [:]
+params.plot_peak_options       = [:]
+params.run_peak_plotting       = true
 
-include { SORT                 } from "../../modules/local/sort"                           addParams( options: params.sort_options           )
-include { BEDTOOLS_MERGE       } from "../../modules/nf-core/modules/bedtools/merge/main" addParams( options: params.bedtools_merge_options )
-include { AWK                  } from "../../modules/local/awk"                            addParams( options: params.awk_threshold_options  )
-include { PLOT_CONSENSUS_PEAKS } from "../../modules/local/plot_consensus_peaks"           addParams( options: params.plot_peak_options      )
+include { CONSENSUS_MERGE      } from "../../modules/local/consensus_merge"      addParams( options: params.consensus_merge_options )
+include { PLOT_CONSENSUS_PEAKS } from "../../modules/local/plot_consensus_peaks" addParams( options: params.plot_peak_options       )
 
 workflow CONSENSUS_PEAKS {
 
@@ -20,22 +16,16 @@ workflow CONSENSUS_PEAKS {
 
     main:
 
-    // Sort bed files
-    SORT ( bed )
-
-    // Merge peaks
-    BEDTOOLS_MERGE ( SORT.out.file )
-
-    // Filter peaks on minimum replicate consensus
-    AWK ( BEDTOOLS_MERGE.out.bed )
+    // Merge the sorted replicate peaks and filter on minimum replicate consensus in one pass
+    CONSENSUS_MERGE ( bed )
 
     // Plot consensus peak sets
     if(params.run_peak_plotting) {
-        PLOT_CONSENSUS_PEAKS ( BEDTOOLS_MERGE.out.bed.collect{it[1]}.ifEmpty([]) )
+        PLOT_CONSENSUS_PEAKS ( CONSENSUS_MERGE.out.bed.collect{it[1]}.ifEmpty([]) )
     }
 
     emit:
-    bed              = BEDTOOLS_MERGE.out.bed       // channel: [ val(meta), [ bed ] ]
-    filtered_bed     = AWK.out.file                 // channel: [ val(meta), [ bed ] ]
-    bedtools_version = BEDTOOLS_MERGE.out.version   // path: *.version.txt
+    bed            = CONSENSUS_MERGE.out.bed          // channel: [ val(meta), [ bed ] ]
+    filtered_bed   = CONSENSUS_MERGE.out.filtered_bed // channel: [ val(meta), [ bed ] ]
+    python_version = CONSENSUS_MERGE.out.version      // path: *.version.txt
 }
@@ -51,7 +51,6 @@ ch_multiqc_config        = file("$projectDir/assets/multiqc_config.yaml", checkI
 ch_multiqc_custom_config = params.multiqc_config ? Channel.fromPath(params.multiqc_config) : Channel.empty()
 
 // Header files for MultiQC
-ch_frag_len_header_multiqc       = file("$projectDir/assets/multiqc/frag_len_header.txt", checkIfExists: true)
 
 /*
 ========================================================================================
@@ -257,10 +256,10 @@ else if(params.save_align_intermed) {
 }
 
 // Consensus peak options
-def awk_threshold           = modules["awk_threshold"]
-awk_threshold.command   = "' \$10 >= " + params.replicate_threshold.toString() + " {print \$0}'"
-def awk_all_threshold       = modules["awk_threshold"]
-awk_threshold.command   = "' \$10 >= 1 {print \$0}'"
+def consensus_merge_options      = modules["consensus_merge"].clone()
+consensus_merge_options.args     = "--min_replicates " + params.replicate_threshold.toString()
+def consensus_merge_all_options  = modules["consensus_merge"].clone()
+consensus_merge_all_options.args = "--min_replicates 1"
 
 // Meta annotation options
 def awk_bt2_options         = modules["awk_bt2"]
@@ -281,13 +280,11 @@ multiqc_options.args += params.multiqc_title ? " --title \"$params.multiqc_title
  */
 include { INPUT_CHECK                    } from "../subworkflows/local/input_check"                          addParams( options: [:]                                        )
 include { CAT_FASTQ                      } from "../modules/local/cat_fastq"                                 addParams( options: cat_fastq_options                          )
-include { BEDTOOLS_GENOMECOV_SCALE       } from "../modules/local/bedtools_genomecov_scale"                  addParams( options: modules["bedtools_genomecov_bedgraph"]     )
+include { FRAGMENT_COVERAGE              } from "../modules/local/fragment_coverage"                         addParams( options: modules["fragment_coverage"]               )
 include { SEACR_CALLPEAK as SEACR_NO_IGG } from "../modules/local/seacr_no_igg"                              addParams( options: modules["seacr"]                           )
-include { AWK as AWK_NAME_PEAK_BED       } from "../modules/local/awk"                                       addParams( options: modules["awk_name_peak_bed"]               )
 include { IGV_SESSION                    } from "../modules/local/igv_session"                               addParams( options: modules["igv"]                             )
 include { AWK as AWK_EDIT_PEAK_BED       } from "../modules/local/awk"                                       addParams( options: modules["awk_edit_peak_bed"]               )
-include { AWK as AWK_FRAG_BIN            } from "../modules/local/awk"                                       addParams( options: modules["awk_frag_bin"]                    )
-include { SAMTOOLS_CUSTOMVIEW            } from "../modules/local/modules/samtools/custom_view/main"         addParams( options: modules["samtools_frag_len"]               )
+include { BIN_FRAGMENTS                  } from "../modules/local/bin_fragments"                             addParams( options: modules["bin_fragments"]                   )
 include { EXPORT_META                    } from "../modules/local/export_meta"                               addParams( options: modules["export_meta"]                     )
 include { GENERATE_REPORTS               } from "../modules/local/generate_reports"                          addParams( options: modules["generate_reports"]                )
 include { GET_SOFTWARE_VERSIONS          } from "../modules/local/get_software_versions"                     addParams( options: [publish_files : ["csv":""]]               )
@@ -301,10 +298,10 @@ include { ALIGN_BOWTIE2                                  } from "../subworkflows
 include { SAMTOOLS_VIEW_SORT_STATS                       } from "../subworkflows/local/samtools_view_sort_stats" addParams( samtools_options: samtools_qfilter_options, samtools_view_options: samtools_view_options )
 include { ANNOTATE_META_AWK as ANNOTATE_BT2_META         } from "../subworkflows/local/annotate_meta_awk"        addParams( options: awk_bt2_options, meta_suffix: "_target", script_mode: true )
 include { ANNOTATE_META_AWK as ANNOTATE_BT2_SPIKEIN_META } from "../subworkflows/local/annotate_meta_awk"        addParams( options: awk_bt2_spikein_options, meta_suffix: "_spikein", script_mode: true )
-include { CONSENSUS_PEAKS                                } from "../subworkflows/local/consensus_peaks"          addParams( bedtools_merge_options: modules["bedtools_merge_groups"], sort_options: modules["sort_group_peaks"], awk_threshold_options: awk_threshold, plot_peak_options: modules["plot_peaks"], run_peak_plotting: run_peak_plotting)
-include { CONSENSUS_PEAKS as CONSENSUS_PEAKS_ALL         } from "../subworkflows/local/consensus_peaks"          addParams( bedtools_merge_options: modules["bedtools_merge_groups"], sort_options: modules["sort_group_peaks"], awk_threshold_options: awk_all_threshold, plot_peak_options: modules["plot_peaks"], run_peak_plotting: run_peak_plotting)
+include { CONSENSUS_PEAKS                                } from "../subworkflows/local/consensus_peaks"          addParams( consensus_merge_options: consensus_merge_options, plot_peak_options: modules["plot_peaks"], run_peak_plotting: run_peak_plotting)
+include { CONSENSUS_PEAKS as CONSENSUS_PEAKS_ALL         } from "../subworkflows/local/consensus_peaks"          addParams( consensus_merge_options: consensus_merge_all_options, plot_peak_options: modules["plot_peaks"], run_peak_plotting: run_peak_plotting)
 include { ANNOTATE_META_AWK as ANNOTATE_DEDUP_META       } from "../subworkflows/local/annotate_meta_awk"        addParams( options: awk_dedup_options, meta_suffix: "", meta_prefix: "dedup_", script_mode: false )
-include { CALCULATE_FRAGMENTS                            } from "../subworkflows/local/calculate_fragments"      addParams( samtools_options: modules["calc_frag_samtools"], samtools_view_options: modules["calc_frag_samtools_view"], bamtobed_options: modules["calc_frag_bamtobed"], awk_options: modules["calc_frag_awk"], cut_options: modules["calc_frag_cut"] )
+include { CALCULATE_FRAGMENTS                            } from "../subworkflows/local/calculate_fragments"      addParams( samtools_options: modules["calc_frag_samtools"], samtools_view_options: modules["calc_frag_samtools_view"], bam_to_fragments_options: modules["calc_frag_bam_to_fragments"] )
 include { FASTQC_TRIMGALORE                              } from "../subworkflows/local/fastqc_trimgalore"        addParams( fastqc_options: modules["fastqc"], trimgalore_options: trimgalore_options )
 
 /*
@@ -323,8 +320,6 @@ include { DEEPTOOLS_COMPUTEMATRIX as DEEPTOOLS_COMPUTEMATRIX_GENE  } from "../mo
 include { DEEPTOOLS_COMPUTEMATRIX as DEEPTOOLS_COMPUTEMATRIX_PEAKS } from "../modules/nf-core/modules/deeptools/computematrix/main" addParams( options: modules["dt_compute_mat_peaks"]  )
 include { DEEPTOOLS_PLOTHEATMAP as DEEPTOOLS_PLOTHEATMAP_GENE      } from "../modules/nf-core/modules/deeptools/plotheatmap/main"   addParams( options: modules["dt_plotheatmap_gene"]   )
 include { DEEPTOOLS_PLOTHEATMAP as DEEPTOOLS_PLOTHEATMAP_PEAKS     } from "../modules/nf-core/modules/deeptools/plotheatmap/main"   addParams( options: modules["dt_plotheatmap_peaks"]  )
-include { SAMTOOLS_SORT                                            } from "../modules/nf-core/modules/samtools/sort/main.nf"        addParams( options: modules["samtools_sort"]         )
-include { SAMTOOLS_INDEX                                           } from "../modules/nf-core/modules/samtools/index/main.nf"       addParams( options: modules["samtools_index"]        )
 
 /*
  * SUBWORKFLOW: Consisting entirely of nf-core/modules
@@ -594,19 +589,30 @@ workflow CUTANDRUN {
 
     if(run_peak_calling) {
         /*
-        * MODULE: Convert bam files to bedgraph
+        * CHANNEL: Pair each bam with its index so coverage can be computed per chromosome
         */
-        BEDTOOLS_GENOMECOV_SCALE (
-            ch_samtools_bam_scale
+        ch_samtools_bam_scale
+            .map { row -> [row[0].id, row ].flatten()}
+            .join ( ch_samtools_bai.map { row -> [row[0].id, row[1]] } )
+            .map { row -> [ row[1], row[2], row[4], row[3] ] }
+            .set { ch_samtools_bam_bai_scale }
+        //EXAMPLE CHANNEL STRUCT: [[META], BAM, BAI, SCALE_FACTOR]
+        //ch_samtools_bam_bai_scale | view
+
+        /*
+        * MODULE: Convert bam files to scaled fragment coverage bedgraphs
+        */
+        FRAGMENT_COVERAGE (
+            ch_samtools_bam_bai_scale
         )
         //EXAMPLE CHANNEL STRUCT: [META], BEDGRAPH]
-        //BEDTOOLS_GENOMECOV_SCALE.out.bedgraph | view
+        //FRAGMENT_COVERAGE.out.bedgraph | view
 
         /*
         * MODULE: Clip off bedgraphs so none overlap beyond chromosome edge
         */
         UCSC_BEDCLIP (
-            BEDTOOLS_GENOMECOV_SCALE.out.bedgraph,
+            FRAGMENT_COVERAGE.out.bedgraph,
             PREPARE_GENOME.out.chrom_sizes
         )
         //EXAMPLE CHANNEL STRUCT: [META], BEDGRAPH]
@@ -626,7 +632,7 @@ workflow CUTANDRUN {
         /*
          * CHANNEL: Separate bedgraphs into target/control
          */
-        BEDTOOLS_GENOMECOV_SCALE.out.bedgraph.branch { it ->
+        FRAGMENT_COVERAGE.out.bedgraph.branch { it ->
             target: it[0].group != "igg"
             control: it[0].group == "igg"
         }
@@ -692,19 +698,10 @@ workflow CUTANDRUN {
             //SEACR_NO_IGG.out.bed | view
         }
 
-        /*
-        * MODULE: Add sample identifier column to peak beds
-        */
-        AWK_NAME_PEAK_BED (
-            ch_seacr_bed
-        )
-        // EXAMPLE CHANNEL STRUCT: [[META], BED]
-        //AWK_NAME_PEAK_BED.out.file | view
-
         /*
         * CHANNEL: Group all samples
         */
-        AWK_NAME_PEAK_BED.out.file
+        ch_seacr_bed
             .map { row -> [ 1, row[1] ] }
             .groupTuple(by: [0])
             .map { row ->
@@ -735,7 +732,7 @@ workflow CUTANDRUN {
         /*
         * CHANNEL: Group samples based on group
         */
-        AWK_NAME_PEAK_BED.out.file
+        ch_seacr_bed
             .map { row -> [ row[0].group, row[1] ] }
             .groupTuple(by: [0])
             .map { row ->
@@ -767,33 +764,24 @@ workflow CUTANDRUN {
         /*
         * SUBWORKFLOW: Calculate fragment bed from bams
         * - Filter for mapped reads
-        * - Convert to bed file
-        * - Keep the read pairs that are on the same chromosome and fragment length less than 1000bp
-        * - Only extract the fragment related columns using cut
+        * - Pair mates into fragments, keeping pairs on the same chromosome with fragment length less than 1000bp
+        * - Count fragment lengths in the same pass
         */
         CALCULATE_FRAGMENTS (
             ch_samtools_bam
         )
-        ch_software_versions = ch_software_versions.mix(CALCULATE_FRAGMENTS.out.bedtools_version.first().ifEmpty(null))
+        ch_software_versions = ch_software_versions.mix(CALCULATE_FRAGMENTS.out.pysam_version.first().ifEmpty(null))
         //EXAMPLE CHANNEL STRUCT: NO CHANGE
         //CALCULATE_FRAGMENTS.out.bed | view
 
         /*
         * MODULE: Bin the fragments into 500bp bins ready for downstream reporting
         */
-        AWK_FRAG_BIN(
-            CALCULATE_FRAGMENTS.out.bed
-        )
-        //AWK_FRAG_BIN.out.file | view
-
-        /*
-        * MODULE: Calculate fragment lengths
-        */
-        SAMTOOLS_CUSTOMVIEW (
-            ch_samtools_bam,
-            ch_samtools_bai
+        BIN_FRAGMENTS(
+            CALCULATE_FRAGMENTS.out.bed,
+            PREPARE_GENOME.out.chrom_sizes
         )
-        //SAMTOOLS_CUSTOMVIEW.out.tsv | view
+        //BIN_FRAGMENTS.out.bin500 | view
     }
 
     if(run_reporting) {
@@ -894,35 +882,19 @@ workflow CUTANDRUN {
             ch_samtools_bam.collect{it[0]}.ifEmpty(["{NO-DATA}"])
         )
 
-        /*
-        * MODULE: Sort bams by mate pair ids (no position)
-        */
-        SAMTOOLS_SORT (
-            ch_samtools_bam
-        )
-        //EXAMPLE CHANNEL STRUCT: [[META], BAM]
-        //SAMTOOLS_SORT.out.bam | view
-
-        SAMTOOLS_INDEX (
-            SAMTOOLS_SORT.out.bam
-        )
-        //EXAMPLE CHANNEL STRUCT: [[META], BAI]
-        //SAMTOOLS_INDEX.out.bai | view
-
         /*
         * MODULE: Generate python reporting using mixture of meta-data and direct file processing
         */
-        ch_frag_len_multiqc = Channel.empty()
+        ch_reporting_multiqc = Channel.empty()
         GENERATE_REPORTS(
-            EXPORT_META.out.csv,                        // meta-data report stats
-            SAMTOOLS_CUSTOMVIEW.out.tsv.collect{it[1]}, // raw fragments
-            AWK_FRAG_BIN.out.file.collect{it[1]},       // binned fragments
-            ch_seacr_bed.collect{it[1]},                // peak beds
-            SAMTOOLS_SORT.out.bam.collect{it[1]},       // bam files sorted by mate pair ids
-            SAMTOOLS_INDEX.out.bai.collect{it[1]},      // bai files sorted by mate pair ids
-            ch_frag_len_header_multiqc                  // multiqc config header for fragment length distribution plot
+            EXPORT_META.out.csv,                             // meta-data report stats
+            CALCULATE_FRAGMENTS.out.frag_len.collect{it[1]}, // raw fragments
+            BIN_FRAGMENTS.out.bin500.collect{it[1]},         // binned fragments
+            ch_seacr_bed.collect{it[1]},                     // peak beds
+            ch_samtools_bam.collect{it[1]},                  // coordinate sorted bam files, the same ones coverage reads
+            ch_samtools_bai.collect{it[1]}                   // bai files
         )
-        ch_frag_len_multiqc  = GENERATE_REPORTS.out.frag_len_multiqc
+        ch_reporting_multiqc = GENERATE_REPORTS.out.multiqc
         ch_software_versions = ch_software_versions.mix(GENERATE_REPORTS.out.version.ifEmpty(null))
 
         /*
@@ -962,7 +934,7 @@ workflow CUTANDRUN {
             ch_samtools_flagstat.collect{it[1]}.ifEmpty([]),
             ch_samtools_idxstats.collect{it[1]}.ifEmpty([]),
             ch_markduplicates_metrics.collect{it[1]}.ifEmpty([]),
-            ch_frag_len_multiqc.collect().ifEmpty([])
+            ch_reporting_multiqc.collect().ifEmpty([])
         )
         multiqc_report = MULTIQC.out.report.toList()
     }